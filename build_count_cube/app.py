@@ -0,0 +1,27 @@
+"""
+rebuild the count cube snapshot used by count_points and extract_points. Runs on
+a daily schedule, see count_cube
+"""
+import logging
+import os
+import boto3
+import count_cube
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+COUNT_CUBE_URI = os.getenv('COUNT_CUBE_URI', default='s3://csb-data/summary/count_cube.npz')
+
+athena = boto3.client('athena')
+s3 = boto3.client('s3')
+
+
+def lambda_handler(event, context):
+    # leave a margin to store the snapshot before the Lambda times out
+    cube = count_cube.build(athena, s3, COUNT_CUBE_URI, context.get_remaining_time_in_millis() / 1000 - 60)
+
+    return {
+        'created': cube.created,
+        'entry_count': len(cube.count),
+        'output_location': COUNT_CUBE_URI
+    }
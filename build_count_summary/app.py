@@ -0,0 +1,61 @@
+"""
+maintain the summary table of point counts per H3 cell, entry_date, provider and
+platform_name used by count_points. Runs on a schedule and appends the counts
+for each (complete) archive date not yet in the summary.
+"""
+import logging
+import os
+import boto3
+from athena_query import run_query
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
+DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
+SUMMARY_TABLE = os.getenv('SUMMARY_TABLE', default='csb_h3_daily_counts')
+SUMMARY_LOCATION = os.getenv('SUMMARY_LOCATION', default='s3://csb-data/summary/csb_h3_daily_counts/')
+# must match count_points
+SUMMARY_H3_RESOLUTION = int(os.getenv('SUMMARY_H3_RESOLUTION', default=3))
+
+athena = boto3.client('athena')
+
+
+def create_table_sql():
+    return f"""CREATE EXTERNAL TABLE IF NOT EXISTS {DATABASE}.{SUMMARY_TABLE} (
+    h3_cell bigint,
+    entry_date date,
+    provider string,
+    platform_name string,
+    point_count bigint)
+    STORED AS PARQUET
+    LOCATION '{SUMMARY_LOCATION}'"""
+
+
+def update_table_sql():
+    # entry_date is the archive date so counts for earlier days do not change. The
+    # current day is still being loaded and is left for the next run
+    return f"""INSERT INTO {DATABASE}.{SUMMARY_TABLE}
+    SELECT h3_latlng_to_cell(lat, lon, {SUMMARY_H3_RESOLUTION}), entry_date, provider, platform_name, count(*)
+    FROM {DATABASE}.{TABLE}
+    WHERE entry_date > coalesce((select max(entry_date) from {DATABASE}.{SUMMARY_TABLE}), date('1970-01-01'))
+    AND entry_date < current_date
+    GROUP BY 1, 2, 3, 4"""
+
+
+def remaining_seconds(context):
+    # leave a margin to report the outcome before the Lambda times out
+    return context.get_remaining_time_in_millis() / 1000 - 10
+
+
+def lambda_handler(event, context):
+    run_query(athena, create_table_sql(), remaining_seconds(context), tags={'endpoint': 'build_count_summary'})
+    query_execution = run_query(athena, update_table_sql(), remaining_seconds(context),
+                                tags={'endpoint': 'build_count_summary'})
+    statistics = query_execution['Statistics']
+    logger.info(f"summary updated, scanned {statistics['DataScannedInBytes']} bytes")
+
+    return {
+        'query_execution_id': query_execution['QueryExecutionId'],
+        'data_scanned_in_bytes': statistics['DataScannedInBytes']
+    }
@@ -0,0 +1,66 @@
+"""
+write a snapshot of the provider/platform catalog to S3, used by list_platforms
+to answer unfiltered and provider-only requests without querying Athena.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from datetime import timezone
+import boto3
+from athena_query import run_query
+from athena_results import split_s3_uri, stream_csv_results
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
+DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
+PLATFORM_CATALOG_URI = os.getenv('PLATFORM_CATALOG_URI', default='s3://csb-data/summary/platform_catalog.json')
+
+athena = boto3.client('athena')
+s3 = boto3.client('s3')
+
+
+def catalog_sql():
+    # same order as list_platforms
+    return f"""SELECT provider, platform_name, count(*), date(min(time)), date(max(time))
+    FROM {DATABASE}.{TABLE}
+    GROUP BY 1, 2
+    ORDER BY 1, 2"""
+
+
+def rows_to_catalog(rows):
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'platforms': [
+            {
+                'provider': provider,
+                'platform': platform,
+                'point_count': int(point_count),
+                'first_date': first_date,
+                'last_date': last_date
+            } for provider, platform, point_count, first_date, last_date in rows
+        ]
+    }
+
+
+def lambda_handler(event, context):
+    # leave a margin to store the snapshot before the Lambda times out
+    query_execution = run_query(athena, catalog_sql(), context.get_remaining_time_in_millis() / 1000 - 30,
+                                tags={'endpoint': 'build_platform_catalog'})
+    catalog = rows_to_catalog(stream_csv_results(s3, query_execution))
+
+    bucket, key = split_s3_uri(PLATFORM_CATALOG_URI)
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(catalog, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+    logger.info(f"stored {len(catalog['platforms'])} platforms in {PLATFORM_CATALOG_URI}")
+
+    return {
+        'platform_count': len(catalog['platforms']),
+        'output_location': PLATFORM_CATALOG_URI
+    }
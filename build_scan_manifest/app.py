@@ -0,0 +1,70 @@
+"""
+write the manifest of point table partition sizes to S3, used by scan_estimate
+to estimate how much data a query will read before starting it. The latest
+entry_date in the table versions the data for extract_reuse.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from datetime import timezone
+import boto3
+from athena_query import run_query
+from athena_results import split_s3_uri, stream_csv_results
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
+DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
+SCAN_MANIFEST_URI = os.getenv('SCAN_MANIFEST_URI', default='s3://csb-data/summary/scan_manifest.json')
+
+athena = boto3.client('athena')
+s3 = boto3.client('s3')
+
+
+def manifest_sql():
+    # a file is within a single H3 partition but may hold several entry_dates. Each
+    # file is counted once, in the month of its latest entry_date
+    return f"""SELECT h3, date_format(entry_date, '%Y-%m') AS month, sum(file_size), max(entry_date)
+    FROM (
+        SELECT "$path", arbitrary("$file_size") AS file_size, arbitrary(h3) AS h3, max(entry_date) AS entry_date
+        FROM {DATABASE}.{TABLE}
+        GROUP BY 1
+    )
+    GROUP BY 1, 2
+    ORDER BY 1, 2"""
+
+
+def rows_to_manifest(rows):
+    partitions = {}
+    latest_entry_date = None
+    for cell, month, size, entry_date in rows:
+        partitions.setdefault(cell, {})[month] = int(size)
+        latest_entry_date = max(latest_entry_date or entry_date, entry_date)
+    return {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'latest_entry_date': latest_entry_date,
+        'partitions': partitions
+    }
+
+
+def lambda_handler(event, context):
+    # leave a margin to store the manifest before the Lambda times out
+    query_execution = run_query(athena, manifest_sql(), context.get_remaining_time_in_millis() / 1000 - 30,
+                                tags={'endpoint': 'build_scan_manifest'})
+    manifest = rows_to_manifest(stream_csv_results(s3, query_execution))
+
+    bucket, key = split_s3_uri(SCAN_MANIFEST_URI)
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(manifest, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+    logger.info(f"stored sizes of {len(manifest['partitions'])} partitions in {SCAN_MANIFEST_URI}")
+
+    return {
+        'partition_count': len(manifest['partitions']),
+        'output_location': SCAN_MANIFEST_URI
+    }
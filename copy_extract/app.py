@@ -0,0 +1,70 @@
+"""
+copy the output of an earlier identical extract (see extract_reuse) for a new
+order instead of running the Athena query again. Copies are made within S3 so
+the order's output remains available for as long as one just extracted.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from datetime import timezone
+import boto3
+from athena_results import split_s3_uri
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+MANIFEST_NAME = 'manifest.json'
+
+s3 = boto3.client('s3')
+
+
+def copy_object(source, destination):
+    """server-side copy between S3 URIs, in parts for objects over 5GB"""
+    source_bucket, source_key = split_s3_uri(source)
+    bucket, key = split_s3_uri(destination)
+    s3.copy({'Bucket': source_bucket, 'Key': source_key}, bucket, key)
+    return destination
+
+
+def copy_manifest(manifest_location, unload_location):
+    """
+    copy the files of each part listed in the manifest of a Parquet extract
+    under the new extract's prefix and write its manifest
+
+    :return: S3 location of the new manifest
+    """
+    bucket, key = split_s3_uri(manifest_location)
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+    for part in manifest['parts']:
+        part['files'] = [copy_object(i, f"{unload_location}part-{part['part']:03d}/reused/{i.split('/')[-1]}")
+                         for i in part['files']]
+    manifest['created'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    manifest['reused_from'] = manifest_location
+
+    new_location = unload_location + MANIFEST_NAME
+    bucket, key = split_s3_uri(new_location)
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'), ContentType='application/json')
+    return new_location
+
+
+def lambda_handler(event, context):
+    """
+    expects the order_id, label, output_format, reuse_location and unload_location from format_point_query
+
+    :return: dict with the S3 location of the order's copy
+    """
+    reuse_location = event['reuse_location']
+    if event['output_format'] == 'parquet':
+        output_location = copy_manifest(reuse_location, event['unload_location'])
+    else:
+        # consumers expect CSV files at the top level of the bucket
+        bucket, _ = split_s3_uri(reuse_location)
+        output_location = copy_object(reuse_location, f"s3://{bucket}/{event['order_id']}-{event['label']}.csv")
+    logger.info(f'copied {reuse_location} to {output_location}')
+
+    return {
+        'label': event['label'],
+        'output_location': output_location
+    }
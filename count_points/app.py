@@ -1,13 +1,33 @@
+import base64
 import json
 import boto3
-import time
 import logging
+import math
 import os
 from datetime import datetime
+from email.utils import format_datetime
 import re
+from athena_query import run_query, QueryTimeoutException, QueryFailedException
+from athena_results import split_s3_uri, stream_csv_results
+from query_jobs import DynamoDBJobStore, is_async_request, submit_job, job_response
+from count_cube import load_snapshot
+from extract_reuse import data_version
+from http_response import api_response, dumps
+from h3_cells import interior_cells, inner_bbox, cell_to_bigint, polygon_bounds
+from query_governor import QueryGovernor, ConcurrencyLimitException, throttled_response, INTERACTIVE, ASYNC_JOB
+from query_stats import filter_shape, batch_shape
+from query_builder import filters_to_where_clause, bbox_to_where_clause, parse_bbox, parse_polygon, \
+    partition_clause, where, validate_dates, IllegalArgumentException
+from result_cache import ResultCache, DynamoDBCacheStore, normalize_filters, cache_key, cache_headers
+from s3_snapshot import S3JsonSnapshot
+from scan_estimate import estimate_scan, estimate_headers, over_budget, over_budget_response, SCAN_BUDGET_BYTES, \
+    MAX_SCAN_BYTES
+from single_flight import SingleFlight, DynamoDBLeaseStore
+from tile_counts import decompose, tile_bounds, tile_clause, remainder_strips
 
 
 athena = boto3.client('athena')
+s3 = boto3.client('s3')
 # APIGW times out in ~30 seconds
 timeout_in_seconds = 25
 
@@ -15,44 +35,60 @@ logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "INFO"))
 TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
 DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
-
-platform_name_pattern = re.compile("^[- .a-zA-Z0-9_/()',!]+$")
-provider_name_pattern = re.compile("^[a-zA-Z0-9 ,]+$")
-date_pattern = re.compile("^[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}$")
-unique_id_pattern = re.compile("^[a-zA-Z0-9-]+$")
-
-
-def valid_bbox(coords: list[float]):
-    if len(coords) != 4:
-        return False
-    if coords[0] < -180 or coords[0] > 180 or coords[2] < -180 or coords[2] > 180:
-        return False
-    if coords[1] < -90 or coords[1] > 90 or coords[3] < -90 or coords[3] > 90:
-        return False
-    # crosses antimeridian
-    if coords[0] >= coords[2]:
-        return False
-    if coords[1] == coords[3]:
-        return False
-
-    return True
-
-
-def create_sql_from_bbox(bbox_string: str) -> list[str]:
-    try:
-        coords = [float(i.strip()) for i in bbox_string.split(',')]
-        if not valid_bbox(coords):
-            raise IllegalArgumentException('invalid bbox coordinates: out of range or crosses antimeridian')
-        minx = coords[0]
-        miny = coords[1]
-        maxx = coords[2]
-        maxy = coords[3]
-        return [
-            f"(lon > {minx} and lon < {maxx})",
-            f"(lat > {miny} and lat < {maxy})"
-        ]
-    except ValueError as e:
-        raise IllegalArgumentException('invalid bbox coordinates: non-numeric values')
+# point counts per H3 cell, entry_date, provider, platform_name. see build_count_summary
+SUMMARY_TABLE = os.getenv('SUMMARY_TABLE', default='csb_h3_daily_counts')
+SUMMARY_H3_RESOLUTION = int(os.getenv('SUMMARY_H3_RESOLUTION', default=3))
+# limits the length of the SQL statement
+MAX_SUMMARY_CELLS = 4000
+# filters which can be applied to the summary table
+SUMMARY_FILTERS = ['bbox', 'platforms', 'providers', 'archive_date_start', 'archive_date_end']
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+# limits the length of the SQL statement for batch (POST) requests
+MAX_FILTER_SETS = 100
+# /count/histogram facets and the columns each one groups by
+HISTOGRAM_FACETS = {
+    'month': ['month'],
+    'provider': ['provider'],
+    'cell': ['lon', 'lat']
+}
+HISTOGRAM_COLUMNS = ['month', 'provider', 'lon', 'lat']
+# size in degrees of the cells counted by the cell facet
+HISTOGRAM_CELL_SIZE = 1
+# mode=approx: bboxes up to this area (square degrees) are still counted exactly.
+# Larger areas are sampled at a proportionally smaller rate, down to MIN_SAMPLE_PERCENT
+EXACT_COUNT_AREA = 4.0
+MIN_SAMPLE_PERCENT = 1.0
+# z-score of the reported confidence interval
+CONFIDENCE_LEVEL = 0.95
+CONFIDENCE_Z = 1.96
+
+# filters which can be answered from quadtree tile counts
+TILE_FILTERS = ['bbox', 'platforms', 'providers', 'collection_date_start', 'collection_date_end',
+                'archive_date_start', 'archive_date_end', 'unique_id']
+# tile counts are reused by any bbox containing the tile and so are kept longer than whole results.
+# Keys include the scan manifest's latest entry_date so counts are not reused once more data is ingested
+TILE_COUNT_TTL = int(os.getenv('TILE_COUNT_TTL', default=24 * 60 * 60))
+TILE_CACHE_MAX_ENTRIES = 4096
+
+# module scope so entries survive across warm invocations
+result_cache = ResultCache(DynamoDBCacheStore(ORDERS_TABLE))
+tile_cache = ResultCache(DynamoDBCacheStore(ORDERS_TABLE), max_entries=TILE_CACHE_MAX_ENTRIES,
+                         ttl_in_seconds=TILE_COUNT_TTL)
+job_store = DynamoDBJobStore(ORDERS_TABLE)
+# identical concurrent requests share a single Athena execution
+single_flight = SingleFlight(DynamoDBLeaseStore(ORDERS_TABLE))
+# limits concurrent queries across all API and order Lambdas
+governor = QueryGovernor(DynamoDBLeaseStore(ORDERS_TABLE))
+
+# loaded once per container. see count_cube for rebuilding the snapshot
+COUNT_CUBE_URI = os.getenv('COUNT_CUBE_URI')
+count_cube = load_snapshot(s3, COUNT_CUBE_URI) if COUNT_CUBE_URI else None
+
+# partition sizes for estimating the data read by a query. see build_scan_manifest
+SCAN_MANIFEST_URI = os.getenv('SCAN_MANIFEST_URI', default='s3://csb-data/summary/scan_manifest.json')
+scan_manifest = S3JsonSnapshot(s3, *split_s3_uri(SCAN_MANIFEST_URI))
+
+filter_set_name_pattern = re.compile("^[-.a-zA-Z0-9_ ]{1,64}$")
 
 
 def iso8601_to_utc_timestamp(datestring):
@@ -67,132 +103,557 @@ def utc_timestamp_to_iso8601(timestamp):
     return datestring[0:10]+'T00:00:00Z'
 
 
-# prepare strings for SQL by single quoting names and escaping single quotes w/in name
-def sql_quote_and_escape(name):
-    return "'" + name.replace("'", "''") + "'"
+def create_summary_sql(filters: dict) -> tuple[str, list] | None:
+    """
+    construct SQL which answers the count from the pre-aggregated summary table
+    for the H3 cells lying entirely inside the bbox. Points in the remaining
+    (edge) area of the bbox, and any points archived since the summary was last
+    updated, are counted exactly against the point table in the same query.
+    The edge count only reads the partitions along the bbox edges and skips the
+    inner part of the bbox, see h3_cells.inner_bbox, without testing each point's cell
+
+    :return: tuple of (SQL, parameters) or None if the filters cannot be answered from the summary
+    """
+    if not set(filters.keys()).issubset(SUMMARY_FILTERS):
+        return None
+
+    # summary table has the provider, platform_name, entry_date columns in common with point table
+    attribute_filters = {k: v for k, v in filters.items() if k != 'bbox'}
+    attribute_clauses, attribute_params = filters_to_where_clause(attribute_filters)
+    # most recent archive date included in the summary table
+    watermark = f"coalesce((select max(entry_date) from {DATABASE}.{SUMMARY_TABLE}), date('1970-01-01'))"
+    summary_clauses = attribute_clauses + [f"entry_date <= {watermark}"]
+    # points archived since the summary was updated
+    recent_clauses, recent_params = filters_to_where_clause(filters)
+    recent_clauses.append(f"entry_date > {watermark}")
+
+    # cell lists are derived from the bbox and so are left in the SQL rather than passed as parameters
+    sql = f"select (select coalesce(sum(point_count), 0) from {DATABASE}.{SUMMARY_TABLE}"
+    if 'bbox' not in filters:
+        sql += f"{where(summary_clauses)}) + (select count(*) from {DATABASE}.{TABLE}{where(recent_clauses)})"
+        return sql, attribute_params + recent_params
 
+    try:
+        coords = parse_bbox(filters['bbox'])
+    except IllegalArgumentException:
+        return None
+    cells = interior_cells(coords, SUMMARY_H3_RESOLUTION)
+    if not cells or len(cells) > MAX_SUMMARY_CELLS:
+        return None
+    cell_list = ','.join([str(cell_to_bigint(i)) for i in cells])
+    summary_clauses.insert(0, f"h3_cell in ({cell_list})")
+
+    edge_clauses, edge_params = filters_to_where_clause(filters)
+    inner = inner_bbox(coords, SUMMARY_H3_RESOLUTION)
+    if inner:
+        minx, miny, maxx, maxy = coords
+        inner_minx, inner_miny, inner_maxx, inner_maxy = inner
+        strips = [
+            [minx, miny, maxx, inner_miny],
+            [minx, inner_maxy, maxx, maxy],
+            [minx, inner_miny, inner_minx, inner_maxy],
+            [inner_maxx, inner_miny, maxx, inner_maxy]
+        ]
+        edge_clauses, edge_params = bbox_to_where_clause(coords, partition_clause(*strips))
+        attribute_where, attribute_where_params = filters_to_where_clause(attribute_filters)
+        edge_clauses += attribute_where
+        edge_params += attribute_where_params
+        edge_clauses.append("not (lon > ? and lon < ? and lat > ? and lat < ?)")
+        edge_params += [inner_minx, inner_maxx, inner_miny, inner_maxy]
+    edge_clauses.append(f"h3_latlng_to_cell(lat, lon, {SUMMARY_H3_RESOLUTION}) not in ({cell_list})")
+    edge_clauses.append(f"entry_date <= {watermark}")
+
+    sql += f"{where(summary_clauses)}) + " \
+           f"(select count(*) from {DATABASE}.{TABLE}{where(edge_clauses)}) + " \
+           f"(select count(*) from {DATABASE}.{TABLE}{where(recent_clauses)})"
+    return sql, attribute_params + edge_params + recent_params
+
+
+def tile_key(filters: dict, tile: str, version: str) -> str:
+    # same tile with the same attribute filters and data version, whatever the bbox
+    return cache_key('count-tile', {k: v for k, v in filters.items() if k != 'bbox'} | {'tile': tile,
+                                                                                     'data_version': version})
+
+
+def create_tile_sql(filters: dict) -> tuple[str | None, list, dict] | None:
+    """
+    construct SQL which counts only the parts of the bbox not yet in the tile
+    cache: its quadtree tiles and the remainder strips along its edges, which
+    are cached as a tile of the bbox. Cached counts are added to the result by
+    get_count. The WHERE clause is limited to the uncached parts, so cached
+    tiles are not read. Without a data version in the scan manifest every part
+    is counted and none cached
+
+    :return: tuple of (SQL, parameters, keyword arguments for get_count), SQL is None when every part is cached,
+        or None if the bbox cannot be tiled
+    """
+    if 'bbox' not in filters or not set(filters.keys()).issubset(TILE_FILTERS):
+        return None
+    try:
+        coords = parse_bbox(filters['bbox'])
+        decomposition = decompose(coords)
+    except IllegalArgumentException:
+        return None
+    if decomposition is None:
+        return None
+    interior, tiles = decomposition
+    # counted with the bbox predicate, unlike the tiles
+    remainder = f"remainder/{filters['bbox']}"
+
+    version = data_version(scan_manifest.get())
+    parts = [remainder] + tiles
+    cached = tile_cache.get_many([tile_key(filters, i, version) for i in parts]) if version else {}
+    uncached = [i for i in parts if tile_key(filters, i, version) not in cached]
+    logger.info(f'{len(parts) - len(uncached)} of {len(parts)} tile counts cached')
+    tile_counts = {
+        'cached': sum([value for value, _ in cached.values()]),
+        'tiles': uncached,
+        'filters': filters,
+        'version': version
+    }
+    if not uncached:
+        return None, [], {'tile_counts': tile_counts}
+
+    clauses = []
+    column_params = []
+    areas = []
+    for part in uncached:
+        if part == remainder:
+            clause, part_params = tile_clause(interior)
+            clause = f"not {clause}"
+            areas += remainder_strips(coords, interior)
+        else:
+            clause, part_params = tile_clause(tile_bounds(part))
+            areas.append(tile_bounds(part))
+        clauses.append(clause)
+        column_params += part_params
+
+    # only the partitions of the uncached parts are read
+    where_clauses, params = bbox_to_where_clause(coords, partition_clause(*areas))
+    attribute_clauses, attribute_params = filters_to_where_clause({k: v for k, v in filters.items() if k != 'bbox'})
+    where_clauses += attribute_clauses + [f"({' or '.join(clauses)})"]
+    params += attribute_params + column_params
+    sql = f"select {', '.join([f'count_if({i})' for i in clauses])} from {DATABASE}.{TABLE}{where(where_clauses)}"
+    return sql, column_params + params, {'tile_counts': tile_counts}
+
+
+def is_approx_request(event):
+    query_params = event.get('queryStringParameters') or {}
+    return query_params.get('mode', '').lower() == 'approx'
+
+
+def sample_percent(filters: dict) -> float:
+    """
+    percentage of rows to sample for an approximate count. Scales inversely with
+    the bbox area so the expected number of sampled points stays roughly constant
+    """
+    area = 360.0 * 180.0
+    if 'bbox' in filters:
+        try:
+            minx, miny, maxx, maxy = parse_bbox(filters['bbox'])
+            area = (maxx - minx) * (maxy - miny)
+        except IllegalArgumentException:
+            # bbox predicate is dropped by filters_to_where_clause as well
+            pass
+    if 'polygon' in filters:
+        try:
+            # area of the polygon's bbox, an upper bound
+            minx, miny, maxx, maxy = polygon_bounds(parse_polygon(filters['polygon']))
+            area = min(area, (maxx - minx) * (maxy - miny))
+        except IllegalArgumentException:
+            pass
+    if area <= EXACT_COUNT_AREA:
+        return 100.0
+    return max(MIN_SAMPLE_PERCENT, round(100.0 * EXACT_COUNT_AREA / area, 2))
+
+
+def create_sample_sql(filters: dict, percent: float) -> tuple[str, list]:
+    # BERNOULLI samples individual rows so the binomial error bounds hold. SYSTEM
+    # sampling skips whole files but CSB points are strongly clustered by file
+    where_clauses, params = filters_to_where_clause(filters)
+    return f'select count(*) from {DATABASE}.{TABLE} tablesample bernoulli ({percent}){where(where_clauses)}', params
+
+
+def estimate_from_sample(sample_count: int, percent: float) -> dict:
+    """
+    scale up the count of sampled rows. Each of the N matching rows is included
+    with probability p, so the sample count is Binomial(N, p) and the estimate
+    k/p has a standard error of about sqrt(k(1-p))/p
+
+    :return: response body with the estimate, its confidence interval and the sample rate
+    """
+    p = percent / 100.0
+    estimate = sample_count / p
+    if sample_count:
+        margin = CONFIDENCE_Z * math.sqrt(sample_count * (1 - p)) / p
+    else:
+        # "rule of three" upper bound when no points were sampled
+        margin = 3 / p
+    return {
+        'count': str(round(estimate)),
+        'approximate': True,
+        'confidence_interval': [max(sample_count, math.floor(estimate - margin)), math.ceil(estimate + margin)],
+        'confidence_level': CONFIDENCE_LEVEL,
+        'sample_percent': percent
+    }
 
-def filters_to_where_clause(filters: dict) -> list[str]:
-    where_clauses = []
 
-    if 'bbox' in filters:
+def parse_filter_sets(body: str) -> tuple[list[str], list[dict]]:
+    """
+    validate the body of a batch request, e.g.
+    {"filter_sets": [{"name": "gulf", "bbox": "-97,27,-90,30", "providers": "PGS"}, ...]}
+    Filters take the same (string) values as the GET query parameters
+
+    :return: tuple of (names, normalized filters) in request order
+    """
+    try:
+        payload = json.loads(body)
+        filter_sets = payload['filter_sets']
+    except (TypeError, ValueError, KeyError):
+        raise IllegalArgumentException('body must be a JSON object with a filter_sets list')
+    if not isinstance(filter_sets, list) or not 0 < len(filter_sets) <= MAX_FILTER_SETS:
+        raise IllegalArgumentException(f'filter_sets must be a list of 1 to {MAX_FILTER_SETS} filter sets')
+
+    names = []
+    normalized = []
+    for filter_set in filter_sets:
+        if not isinstance(filter_set, dict) or not all(isinstance(i, str) for i in filter_set.values()):
+            raise IllegalArgumentException('each filter set must be an object with string values')
+        name = filter_set.get('name', '')
+        if not filter_set_name_pattern.match(name):
+            raise IllegalArgumentException(f'invalid filter set name: {name}')
+        if name in names:
+            raise IllegalArgumentException(f'duplicate filter set name: {name}')
+        filters = normalize_filters(filter_set)
+        if 'bbox' in filters:
+            # unlike GET, reject rather than ignore an invalid bbox
+            parse_bbox(filters['bbox'])
+        if 'polygon' in filters:
+            parse_polygon(filters['polygon'])
+        validate_dates(filters)
+        names.append(name)
+        normalized.append(filters)
+    return names, normalized
+
+
+def create_batch_sql(filter_sets: list[dict]) -> tuple[str, list]:
+    """
+    count all of the filter sets in a single scan of the point table. Each set
+    gets its own conditional count so overlapping sets are each counted in full
+    """
+    columns = []
+    params = []
+    for i, filters in enumerate(filter_sets):
+        where_clauses, filter_params = filters_to_where_clause(filters)
+        predicate = ' and '.join(where_clauses) if where_clauses else 'true'
+        columns.append(f"count_if({predicate}) as c{i}")
+        params += filter_params
+    sql = f"select {', '.join(columns)} from {DATABASE}.{TABLE}"
+
+    # partitions needed by any of the filter sets
+    if all('bbox' in i or 'polygon' in i for i in filter_sets):
+        # a set's polygon covers no more partitions than its bbox
+        h3_clause = partition_clause(*[parse_polygon(i['polygon']) if 'polygon' in i else parse_bbox(i['bbox'])
+                                       for i in filter_sets])
+        if h3_clause:
+            sql += f" where {h3_clause[0]}"
+            params += h3_clause[1]
+    return sql, params
+
+
+def get_count(query_execution_id, names=None, tile_counts=None):
+    """
+    :param names: filter set names for a batch query, in column order
+    :param tile_counts: for a tile query, the total of the cached tiles and the
+        tiles (and remainder) counted by the query, in column order
+    """
+    response = athena.get_query_results(QueryExecutionId=query_execution_id)
+    row = response['ResultSet']['Rows'][1]['Data']
+    if tile_counts:
+        counts = [int(i['VarCharValue']) for i in row]
+        if tile_counts['version']:
+            tile_cache.put_many({tile_key(tile_counts['filters'], tile, tile_counts['version']): count
+                                 for tile, count in zip(tile_counts['tiles'], counts)})
+        return {'count': str(tile_counts['cached'] + sum(counts))}
+    if names is None:
+        return {'count': row[0]['VarCharValue']}
+    return {'counts': {name: column['VarCharValue'] for name, column in zip(names, row)}}
+
+
+def parse_facets(query_params) -> list[str]:
+    """
+    :return: requested histogram facets in canonical order, all facets by default
+    """
+    requested = (query_params or {}).get('facets')
+    if not requested:
+        return list(HISTOGRAM_FACETS)
+    requested = set([i.strip() for i in requested.split(',')])
+    unknown = requested - set(HISTOGRAM_FACETS)
+    if unknown:
+        raise IllegalArgumentException(f"unknown facets: {','.join(sorted(unknown))}")
+    return [i for i in HISTOGRAM_FACETS if i in requested]
+
+
+def grouping_id(facet: str) -> int:
+    """value of grouping() over HISTOGRAM_COLUMNS for the rows of the facet's grouping set"""
+    # bits are set for the columns which are not part of the grouping set
+    bits = [0 if i in HISTOGRAM_FACETS[facet] else 1 for i in HISTOGRAM_COLUMNS]
+    return int(''.join([str(i) for i in bits]), 2)
+
+
+def create_histogram_sql(filters: dict, facets: list[str]) -> tuple[str, list]:
+    """
+    count points for each of the facets in a single scan using grouping sets
+    """
+    where_clauses, params = filters_to_where_clause(filters)
+    grouping_sets = ', '.join([f"({', '.join(HISTOGRAM_FACETS[i])})" for i in facets])
+    columns = ', '.join(HISTOGRAM_COLUMNS)
+    sql = f"select grouping({columns}), {columns}, count(*) from (" \
+          f"select date_format(time, '%Y-%m') as month, provider, " \
+          f"cast(floor(lon / {HISTOGRAM_CELL_SIZE}) * {HISTOGRAM_CELL_SIZE} as integer) as lon, " \
+          f"cast(floor(lat / {HISTOGRAM_CELL_SIZE}) * {HISTOGRAM_CELL_SIZE} as integer) as lat " \
+          f"from {DATABASE}.{TABLE}{where(where_clauses)}) " \
+          f"group by grouping sets ({grouping_sets}) order by 1, 2, 3, 4, 5"
+    return sql, params
+
+
+def get_histogram(query_execution_id, facets):
+    """
+    :return: response body with the counts of each facet in columnar form, e.g.
+        {"month": {"month": ["2023-01", ...], "count": [10, ...]}, "cell": {"lon": [...], "lat": [...], "count": [...]}}
+    """
+    query_execution = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+    histogram = {i: {column: [] for column in HISTOGRAM_FACETS[i] + ['count']} for i in facets}
+    facet_by_grouping_id = {grouping_id(i): i for i in facets}
+
+    for row in stream_csv_results(s3, query_execution):
+        facet = facet_by_grouping_id[int(row[0])]
+        values = dict(zip(HISTOGRAM_COLUMNS, row[1:5]))
+        for column in HISTOGRAM_FACETS[facet]:
+            value = values[column]
+            histogram[facet][column].append(int(value) if column in ['lon', 'lat'] else value)
+        histogram[facet]['count'].append(int(row[5]))
+    return histogram
+
+
+def histogram_response(event):
+    query_params = event.get('queryStringParameters')
+    try:
+        facets = parse_facets(query_params)
+    except IllegalArgumentException as e:
+        return {
+            'statusCode': 400,
+            'body': dumps({'message': str(e)})
+        }
+    filters = normalize_filters(query_params)
+    # as for /count, an invalid polygon or date is rejected rather than ignored
+    try:
+        if 'polygon' in filters:
+            parse_polygon(filters['polygon'])
+        validate_dates(filters)
+    except IllegalArgumentException as e:
+        return {
+            'statusCode': 400,
+            'body': dumps({'message': str(e)})
+        }
+    key = cache_key('histogram', {'filters': filters, 'facets': facets})
+    sql, params = create_histogram_sql(filters, facets)
+    estimate = estimate_scan(scan_manifest.get(), filters)
+    return query_response(event, 'histogram', sql, params, key, get_histogram, {'facets': facets}, estimate=estimate,
+                          tags={'shape': filter_shape(filters)})
+
+
+def count_cube_response(filters):
+    """count from the cube, which omits points archived since its snapshot was built"""
+    return {
+        'statusCode': 200,
+        'headers': {'Last-Modified': format_datetime(datetime.fromisoformat(count_cube.created), usegmt=True)},
+        'body': dumps({'count': str(count_cube.count_points(filters)), 'as_of': count_cube.created})
+    }
+
+
+def query_response(event, endpoint, sql, params, key, fetch_results, fetch_params=None, allow_async=True,
+                   estimate=None, tags=None):
+    """
+    answer the request from the result cache, or by running the query (or
+    starting it as a job when asynchronous) and caching its result. Queries
+    estimated to read more than the scan budget are started as a job, or
+    rejected when too large to run at all. Answers 429 when too many queries
+    are already running, see query_governor
+
+    :param params: values for the ? placeholders in the SQL
+    :param fetch_results: function taking the QueryExecutionId (and any fetch_params) and returning the response body
+    :param fetch_params: optional dict of keyword arguments for fetch_results
+    :param estimate: optional scan estimate of the query, see scan_estimate
+    :param tags: optional dict of query_stats tags in addition to the endpoint
+    :return: API response
+    """
+    tags = {'endpoint': endpoint} | (tags or {})
+    cached = result_cache.get(key)
+    if cached:
+        body, age = cached
+        logger.info(f"returning cached result ({age} seconds old)")
+        return {
+            'statusCode': 200,
+            'headers': cache_headers(age) | estimate_headers(estimate),
+            'body': dumps(body)
+        }
+
+    if over_budget(estimate, MAX_SCAN_BYTES) or (not allow_async and over_budget(estimate, SCAN_BUDGET_BYTES)):
+        logger.warning(f'rejecting query estimated to scan {estimate}')
+        return over_budget_response(estimate, MAX_SCAN_BYTES if allow_async else SCAN_BUDGET_BYTES)
+
+    logger.info(f'{sql} {params}')
+    if allow_async and (is_async_request(event) or over_budget(estimate, SCAN_BUDGET_BYTES)):
+        # held until the job completes
         try:
-            where_clauses += create_sql_from_bbox(filters['bbox'])
-        except IllegalArgumentException as e:
+            slot = governor.acquire(ASYNC_JOB)
+        except ConcurrencyLimitException as e:
             logger.warning(str(e))
+            return throttled_response(e)
+        try:
+            query_execution_id = single_flight.start_query(athena, sql, params=params)
+        except Exception:
+            governor.release(slot)
+            raise
+        response = submit_job(job_store, event, endpoint, query_execution_id, key, fetch_params, tags, slot)
+        response['headers'].update(estimate_headers(estimate))
+        return response
 
-    if 'platforms' in filters:
-        # create a list of SQL-friendly platform names from URL query params
-        if platform_name_pattern.match(filters['platforms']):
-            platforms = [sql_quote_and_escape(i) for i in filters['platforms'].split(',')]
-            where_clauses.append(f'platform_name in ({",".join(platforms)})')
-        else:
-            logger.warning('platforms parameter contains illegal characters')
+    try:
+        with governor.slot(INTERACTIVE):
+            query_execution = run_query(athena, sql, timeout_in_seconds, single_flight=single_flight, params=params,
+                                        tags=tags)
+    except ConcurrencyLimitException as e:
+        logger.warning(str(e))
+        return throttled_response(e)
+    except QueryTimeoutException as e:
+        execution_time = round(int(e.statistics.get('TotalExecutionTimeInMillis', 0)) / 1000, 1)
+        logger.info(f"query timed out after approximately {execution_time} seconds")
 
-    if 'providers' in filters:
-        if provider_name_pattern.match(filters['providers']):
-            providers = [sql_quote_and_escape(i) for i in filters['providers'].split(',')]
-            where_clauses.append(f'provider in ({",".join(providers)})')
-        else:
-            logger.warning('providers parameter contains illegal characters')
-
-    # dates are inclusive. either start, end, or both may be specified
-    if 'collection_date_start' in filters or 'collection_date_end' in filters:
-        start = ''
-        end = ''
-        # ignore values not in YYYY-MM-DD format
-        if 'collection_date_start' in filters and date_pattern.match(filters['collection_date_start']):
-            start = filters['collection_date_start']
-
-        if 'collection_date_end' in filters and date_pattern.match(filters['collection_date_end']):
-            end = filters['collection_date_end']
-
-        if start and end:
-            where_clauses.append(f"(time >= date('{start}') and time <= date('{end}'))")
-        elif start:
-            where_clauses.append(f"time >= date('{start}')")
-        elif end:
-            where_clauses.append(f"time <= date('{end}')")
-
-    # archive date is in UTC and represented as UNIX timestamp
-    if 'archive_date_start' in filters or 'archive_date_end' in filters:
-        start = ''
-        end = ''
-        if 'archive_date_start' in filters and date_pattern.match(filters['archive_date_start']):
-            start = filters['archive_date_start']
-
-        if 'archive_date_end' in filters and date_pattern.match(filters['archive_date_end']):
-            end = filters['archive_date_end']
-
-        if start and end:
-            where_clauses.append(f"(entry_date >= date('{start}') and entry_date <= date('{end}'))")
-        elif start:
-            where_clauses.append(f"entry_date >= date('{start}')")
-        elif end:
-            where_clauses.append(f"entry_date <= date('{end}')")
-
-    if 'unique_id' in filters and unique_id_pattern.match(filters['unique_id']):
-        unique_id = filters['unique_id']
-        where_clauses.append(f"unique_id = '{unique_id}'")
-
-    return where_clauses
+        return {
+            'statusCode': 500,
+            'body': dumps({'message': 'query took too long to respond'})
+        }
+    except QueryFailedException as e:
+        logger.error(str(e))
+        return {
+            'statusCode': 500,
+            'body': dumps({'message': 'query failed'})
+        }
+
+    body = fetch_results(query_execution['QueryExecutionId'], **(fetch_params or {}))
+    result_cache.put(key, body)
+
+    return {
+        'statusCode': 200,
+        'headers': cache_headers(0) | estimate_headers(estimate),
+        'body': dumps(body)
+    }
 
 
+@api_response
 def lambda_handler(event, context):
     logger.info(event)
     http_method = event['requestContext']['http']['method']
+
+    # poll for the result of an asynchronous request
+    path_parameters = event.get('pathParameters') or {}
+    if http_method == 'GET' and 'job_id' in path_parameters:
+        if '/histogram/' in event.get('rawPath', ''):
+            return job_response(job_store, athena, path_parameters['job_id'], 'histogram', get_histogram, result_cache,
+                                governor)
+        return job_response(job_store, athena, path_parameters['job_id'], 'count', get_count, result_cache, governor)
+
+    if http_method == 'GET' and event.get('rawPath', '').endswith('/histogram'):
+        return histogram_response(event)
+
     sql = f'select count(*) from {DATABASE}.{TABLE}'
+    params = []
+
+    filters = {}
+    # percentage of rows sampled for an approximate count, None for an exact count
+    approx_percent = None
+    # filter set names of a batch request
+    names = None
+    # keyword arguments for get_count
+    fetch_params = None
+    # estimated data read by the query, None if unknown
+    estimate = None
+    # query_stats tags, method is how the count is computed
+    tags = {}
 
     if http_method == 'GET':
-        if 'queryStringParameters' in event:
-            where_clauses = filters_to_where_clause(event['queryStringParameters'])
-            if len(where_clauses):
-                sql += f" where {' and '.join(where_clauses)}"
+        filters = normalize_filters(event.get('queryStringParameters'))
+        # unlike a bbox, an invalid polygon or date is rejected rather than ignored
+        try:
+            if 'polygon' in filters:
+                parse_polygon(filters['polygon'])
+            validate_dates(filters)
+        except IllegalArgumentException as e:
+            return {
+                'statusCode': 400,
+                'body': dumps({'message': str(e)})
+            }
+        if count_cube and not count_cube.is_stale() and count_cube.supports(filters):
+            return count_cube_response(filters)
+
+        estimate = estimate_scan(scan_manifest.get(), filters)
+        tags = {'shape': filter_shape(filters), 'method': 'scan'}
+        # small bboxes are counted exactly even when an approximation is requested
+        if is_approx_request(event) and sample_percent(filters) < 100:
+            approx_percent = sample_percent(filters)
+            sql, params = create_sample_sql(filters, approx_percent)
+            tags['method'] = 'sample'
+        # the summary table answers most of a bbox without reading the point table,
+        # tiles only avoid reading the parts of it already counted
+        elif summary := create_summary_sql(filters):
+            logger.info('using summary table')
+            sql, params = summary
+            tags['method'] = 'summary'
+        elif tiled := create_tile_sql(filters):
+            sql, params, fetch_params = tiled
+            if sql is None:
+                logger.info('using cached tile counts')
+                return {
+                    'statusCode': 200,
+                    'body': dumps({'count': str(fetch_params['tile_counts']['cached'])})
+                }
+            tags['method'] = 'tiles'
+        else:
+            where_clauses, params = filters_to_where_clause(filters)
+            sql += where(where_clauses)
 
     elif http_method == 'POST':
-        # TODO
-        pass
+        body = event.get('body')
+        if body and event.get('isBase64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        try:
+            names, filter_sets = parse_filter_sets(body)
+        except IllegalArgumentException as e:
+            return {
+                'statusCode': 400,
+                'body': dumps({'message': str(e)})
+            }
+        sql, params = create_batch_sql(filter_sets)
+        fetch_params = {'names': names}
+        estimate = estimate_scan(scan_manifest.get(), *filter_sets)
+        tags = {'shape': batch_shape(filter_sets), 'method': 'batch'}
+        # distinct from any GET filters
+        filters = {'filter_sets': [[name, i] for name, i in zip(names, filter_sets)]}
     elif http_method == 'OPTIONS':
         # TODO
         pass
     else:
         return {
             'statusCode': 405,
-            'body': json.dumps({'message': 'Method Not Allowed'})
+            'body': dumps({'message': 'Method Not Allowed'})
         }
 
-    logger.info(sql)
-    response = athena.start_query_execution(
-        QueryString=sql,
-        WorkGroup='primary'
-    )
-    query_execution_id = response['QueryExecutionId']
-
-    query_state = None
-    check_count = 0
-    while check_count < timeout_in_seconds and query_state != 'SUCCEEDED':
-        time.sleep(1)
-        response = athena.get_query_execution(QueryExecutionId=query_execution_id)
-        query_state = response['QueryExecution']['Status']['State']
-        check_count = check_count + 1
-
-    if query_state != 'SUCCEEDED':
-        execution_time = round(int(response['QueryExecution']['Statistics']['TotalExecutionTimeInMillis'])*1000)
-        logger.info(f"query completed in approximately {execution_time} seconds")
-
-        return {
-            'statusCode': 500,
-            'body': json.dumps({'message': 'query took too long to respond'})
-        }
-
-    response = athena.get_query_results(QueryExecutionId=query_execution_id)
-    record_count = response['ResultSet']['Rows'][1]['Data'][0]['VarCharValue']
-
-    return {
-        'statusCode': 200,
-        'body': json.dumps({'count': record_count})
-    }
-
-
-class IllegalArgumentException(Exception):
-    pass
+    key = cache_key('count-approx' if approx_percent else 'count', filters)
+    if approx_percent:
+        # sampled queries are expected to complete quickly and so are always synchronous
+        return query_response(event, 'count', sql, params, key,
+                              lambda i: estimate_from_sample(int(get_count(i)['count']), approx_percent),
+                              allow_async=False, estimate=estimate, tags=tags)
+    return query_response(event, 'count', sql, params, key, get_count, fetch_params, estimate=estimate, tags=tags)
@@ -11,6 +11,8 @@ import uuid
 import time
 import copy
 import jsonschema
+from h3_cells import polygon_bounds
+import query_builder
 
 STATE_MACHINE_ARN = os.environ.get("STATE_MACHINE_ARN")
 
@@ -78,6 +80,18 @@ def lambda_handler(event, context):
         if mb_dataset and 'grid' not in payload:
             raise IllegalArgumentException(f'Multibeam datasets can only be requested with gridded output')
 
+        # CSB points are limited to the polygon, other datasets use its extent
+        if 'polygon' in payload:
+            try:
+                payload['polygon'] = query_builder.parse_polygon(payload['polygon'])
+            except query_builder.IllegalArgumentException as e:
+                raise IllegalArgumentException(f'invalid payload format - {e}')
+            if 'bbox' not in payload:
+                payload['bbox'] = polygon_bounds(payload['polygon'])
+        else:
+            # referenced by the state machine
+            payload['polygon'] = None
+
         # accommodate legacy bbox string
         if isinstance(payload['bbox'], str):
             try:
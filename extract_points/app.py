@@ -0,0 +1,245 @@
+"""
+synchronous extract of the points in a small area of interest, returned in the
+HTTP response as gzipped CSV or NDJSON rather than through an order. Requests
+are limited to MAX_POINTS, enforced in two steps:
+ - a precount from the count cube, see precount. Requests it puts over the
+   budget are rejected before any query is run
+ - the query is limited to one more than MAX_POINTS rows. Finding more rejects
+   the request without a count, the response only tells it exceeds max_points
+Larger areas are extracted by placing an order.
+
+e.g. GET /points?bbox=-90.1,29.9,-90.0,30.0&providers=PGS&format=ndjson
+"""
+import base64
+import csv
+import gzip
+import io
+import logging
+import os
+import boto3
+from athena_query import run_query, QueryTimeoutException, QueryFailedException
+from athena_results import split_s3_uri, stream_csv_results
+from count_cube import load_snapshot, SUPPORTED_FILTERS
+from h3_cells import polygon_bounds
+from http_response import api_response, accepted_encodings, dumps
+from order_size import cube_filters
+from query_governor import QueryGovernor, ConcurrencyLimitException, throttled_response, INTERACTIVE
+from query_stats import filter_shape
+from query_builder import filters_to_where_clause, parse_bbox, parse_polygon, where, validate_dates, \
+    POINT_COLUMNS, COMPACT_COLUMNS, IllegalArgumentException
+from result_cache import normalize_filters
+from s3_snapshot import S3JsonSnapshot
+from scan_estimate import estimate_scan, estimate_headers, over_budget, over_budget_response, SCAN_BUDGET_BYTES
+from single_flight import DynamoDBLeaseStore
+
+athena = boto3.client('athena')
+s3 = boto3.client('s3')
+# APIGW times out in ~30 seconds
+timeout_in_seconds = 25
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
+DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+# point budget of a synchronous extract
+MAX_POINTS = int(os.getenv('SYNC_EXTRACT_MAX_POINTS', default=100_000))
+# Lambda responses are limited to 6MB, of which base64 encoding takes a quarter
+MAX_RESPONSE_BYTES = int(os.getenv('SYNC_EXTRACT_MAX_BYTES', default=4_500_000))
+OUTPUT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+NUMERIC_COLUMNS = ['lon', 'lat', 'depth']
+GZIP_LEVEL = 6
+
+# limits concurrent queries across all API and order Lambdas
+governor = QueryGovernor(DynamoDBLeaseStore(ORDERS_TABLE))
+
+# loaded once per container. see count_cube for rebuilding the snapshot
+COUNT_CUBE_URI = os.getenv('COUNT_CUBE_URI')
+count_cube = load_snapshot(s3, COUNT_CUBE_URI) if COUNT_CUBE_URI else None
+
+# partition sizes for estimating the data read by a query. see build_scan_manifest
+SCAN_MANIFEST_URI = os.getenv('SCAN_MANIFEST_URI', default='s3://csb-data/summary/scan_manifest.json')
+scan_manifest = S3JsonSnapshot(s3, *split_s3_uri(SCAN_MANIFEST_URI))
+
+
+def error_response(status_code, message, **details):
+    return {
+        'statusCode': status_code,
+        'body': dumps({'message': message} | details)
+    }
+
+
+def too_many_points_response(count=None):
+    """
+    :param count: the precount, None when the query found more than MAX_POINTS
+    """
+    details = {'max_points': MAX_POINTS}
+    if count is not None:
+        details['count'] = count
+    return error_response(413, f'request matches more than {MAX_POINTS} points, place an order instead', **details)
+
+
+def area(bbox):
+    minx, miny, maxx, maxy = bbox
+    return (maxx - minx) * (maxy - miny)
+
+
+def precount(filters: dict) -> int | None:
+    """
+    number of points matching the filters, counted from the cube without a query.
+    Exact when the cube supports the filters. Otherwise the cube cells and months
+    enclosing the area of interest give an upper bound. When that is over the
+    budget it is scaled by the share of the cells' area the AOI covers, since a
+    small AOI in a dense cell is usually well within the budget, unless other
+    filters the cube cannot count may exclude most of the points
+
+    :return: point count, or None if the cube is unavailable or cannot count the filters
+    """
+    if count_cube is None or count_cube.is_stale():
+        return None
+    if count_cube.supports(filters):
+        return count_cube.count_points(filters)
+
+    bbox = polygon_bounds(parse_polygon(filters['polygon'])) if 'polygon' in filters else parse_bbox(filters['bbox'])
+    supported = cube_filters(bbox, filters, count_cube.cell_size)
+    if not count_cube.supports(supported):
+        return None
+    upper_bound = count_cube.count_points(supported)
+    if upper_bound <= MAX_POINTS:
+        return upper_bound
+    # e.g. a unique_id may match few of the points counted
+    if not set(filters).issubset(SUPPORTED_FILTERS + ['polygon']):
+        return None
+    # assumes points are spread evenly over the enclosing cells
+    return round(upper_bound * area(bbox) / area(parse_bbox(supported['bbox'])))
+
+
+def create_extract_sql(filters: dict, columns: list[str]) -> tuple[str, list]:
+    """one more row than the budget so that an over budget request can be detected"""
+    where_clauses, params = filters_to_where_clause(filters)
+    sql = f"select {','.join(columns)} from {DATABASE}.{TABLE}{where(where_clauses)} limit {MAX_POINTS + 1}"
+    return sql, params
+
+
+def ndjson_record(columns, row):
+    """:return: dict of the row's values, numeric columns as numbers and empty values as None"""
+    record = {}
+    for column, value in zip(columns, row):
+        if value == '':
+            record[column] = None
+        elif column in NUMERIC_COLUMNS:
+            record[column] = float(value)
+        else:
+            record[column] = value
+    return record
+
+
+def write_points(rows, columns, output_format):
+    """
+    gzip the rows as they are read from the query's output
+
+    :return: tuple of (compressed bytes, number of rows), None for the bytes when over MAX_POINTS
+    """
+    buffer = io.BytesIO()
+    count = 0
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as compressed:
+        text = io.TextIOWrapper(compressed, encoding='utf-8', newline='')
+        if output_format == 'csv':
+            writer = csv.writer(text)
+            writer.writerow(columns)
+        for row in rows:
+            count += 1
+            if count > MAX_POINTS:
+                text.detach()
+                return None, count
+            if output_format == 'csv':
+                writer.writerow(row)
+            else:
+                text.write(dumps(ndjson_record(columns, row)) + '\n')
+        text.flush()
+        text.detach()
+    return buffer.getvalue(), count
+
+
+def points_response(event, data, count, output_format):
+    """
+    gzipped points with Content-Encoding for clients accepting gzip, otherwise
+    as a .gz file to download
+    """
+    filename = f'points.{output_format}'
+    headers = {'X-Point-Count': str(count)}
+    if 'gzip' in accepted_encodings(event):
+        headers |= {'Content-Type': OUTPUT_FORMATS[output_format], 'Content-Encoding': 'gzip'}
+    else:
+        headers['Content-Type'] = 'application/gzip'
+        filename += '.gz'
+    headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+@api_response
+def lambda_handler(event, context):
+    logger.info(event)
+    query_params = event.get('queryStringParameters') or {}
+
+    output_format = query_params.get('format', 'csv').lower()
+    if output_format not in OUTPUT_FORMATS:
+        return error_response(400, f"format must be one of {', '.join(OUTPUT_FORMATS)}")
+    columns = COMPACT_COLUMNS if query_params.get('compact', '').lower() == 'true' else POINT_COLUMNS
+
+    filters = normalize_filters(query_params)
+    if 'bbox' not in filters and 'polygon' not in filters:
+        return error_response(400, 'a bbox or polygon is required')
+    # unlike /count, an invalid area is rejected rather than ignored
+    try:
+        if 'bbox' in filters:
+            parse_bbox(filters['bbox'])
+        if 'polygon' in filters:
+            parse_polygon(filters['polygon'])
+        validate_dates(filters)
+    except IllegalArgumentException as e:
+        return error_response(400, str(e))
+
+    count = precount(filters)
+    if count is not None and count > MAX_POINTS:
+        logger.info(f'rejecting extract of about {count} points')
+        return too_many_points_response(count)
+
+    estimate = estimate_scan(scan_manifest.get(), filters)
+    if over_budget(estimate, SCAN_BUDGET_BYTES):
+        logger.warning(f'rejecting extract estimated to scan {estimate}')
+        return over_budget_response(estimate, SCAN_BUDGET_BYTES)
+
+    sql, params = create_extract_sql(filters, columns)
+    logger.info(f'{sql} {params}')
+    try:
+        with governor.slot(INTERACTIVE):
+            query_execution = run_query(athena, sql, timeout_in_seconds, params=params,
+                                        tags={'endpoint': 'points', 'shape': filter_shape(filters)})
+    except ConcurrencyLimitException as e:
+        logger.warning(str(e))
+        return throttled_response(e)
+    except QueryTimeoutException:
+        return error_response(500, 'query took too long to respond, place an order instead')
+    except QueryFailedException as e:
+        logger.error(str(e))
+        return error_response(500, 'query failed')
+
+    data, count = write_points(stream_csv_results(s3, query_execution), columns, output_format)
+    if data is None:
+        return too_many_points_response()
+    if len(data) > MAX_RESPONSE_BYTES:
+        logger.warning(f'{count} points compressed to {len(data)} bytes, more than {MAX_RESPONSE_BYTES}')
+        return error_response(413, 'response would be too large, place an order instead')
+
+    response = points_response(event, data, count, output_format)
+    response['headers'].update(estimate_headers(estimate))
+    return response
@@ -2,8 +2,21 @@
 construct SQL statement to extract points from CSB table per user request
 """
 import logging
+import math
 import os
-from utils import filters_to_where_clause
+import uuid
+import boto3
+from botocore.exceptions import ClientError
+from athena_query import execution_parameters
+from athena_results import split_s3_uri
+from extract_reuse import ExtractIndex, DynamoDBExtractStore, data_version, extract_key
+from query_stats import filter_shape
+import query_builder
+from query_builder import bbox_to_where_clause, filters_to_where_clause, placeholders, validate_dates, POINT_COLUMNS, \
+    COMPACT_COLUMNS
+from s3_snapshot import S3JsonSnapshot
+from scan_estimate import estimate_scan, over_budget, filter_cells, cell_bytes, ScanBudgetExceededException, \
+    MAX_SCAN_BYTES
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
@@ -11,31 +24,181 @@ logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
 DATABASE = os.getenv('ATHENA_DATABASE', 'dcdb')
 TABLE = os.getenv('ATHENA_TABLE', 'csb_parquet')
 S3_BUCKET = os.getenv('ATHENA_OUTPUT_BUCKET', 's3://order-pickup/')
+# parquet extracts are written by UNLOAD as ZSTD-compressed files under a prefix,
+# csv is the single quoted file written to the Athena query results location
+OUTPUT_FORMATS = ['parquet', 'csv']
+DEFAULT_OUTPUT_FORMAT = os.getenv('EXTRACT_OUTPUT_FORMAT', 'parquet')
+# parquet extracts are split by H3 partition into parts run in parallel by the
+# state machine, each reading about this much
+PART_SCAN_BYTES = int(os.getenv('PART_SCAN_BYTES', default=10 * 1024 ** 3))
+# cells per part when their sizes are unknown
+CELLS_PER_PART = int(os.getenv('CELLS_PER_PART', default=16))
+MAX_PARTS = int(os.getenv('MAX_EXTRACT_PARTS', default=16))
 
+# partition sizes for estimating the data read by the extract. see build_scan_manifest
+SCAN_MANIFEST_URI = os.getenv('SCAN_MANIFEST_URI', default='s3://csb-data/summary/scan_manifest.json')
+s3 = boto3.client('s3')
+scan_manifest = S3JsonSnapshot(s3, *split_s3_uri(SCAN_MANIFEST_URI))
+
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+extract_index = ExtractIndex(DynamoDBExtractStore(ORDERS_TABLE))
+
+
+def dataset_to_filters(dataset):
+    """
+    filters in the format of the API query parameters from the order's dataset,
+    which has lists of names and start/end objects for dates
+    """
+    filters = {i: dataset[i] for i in ['platforms', 'providers', 'unique_id', 'file_uuid'] if i in dataset}
+    for name in ['collection_date', 'archive_date']:
+        for bound in ['start', 'end']:
+            if bound in dataset.get(name, {}):
+                filters[f'{name}_{bound}'] = dataset[name][bound]
+    return filters
+
+
+def unload_statement(query_string, location):
+    """UNLOAD writing the query's results to the location as ZSTD-compressed Parquet"""
+    location = location.replace("'", "''")
+    return f"UNLOAD ({query_string}) TO '{location}' WITH (format = 'PARQUET', compression = 'ZSTD')"
+
+
+def format_template(text):
+    """escapes text for use as a States.Format template"""
+    return text.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+
+
+def split_cells(sizes, part_bytes=None, max_parts=None):
+    """
+    groups of H3 partitions for the parts of an extract, balanced by the bytes
+    each reads. Cells are assigned largest first to the least loaded part
+
+    :param sizes: dict of cell to bytes read, all 0 when unknown
+    :return: list of sorted lists of cells
+    """
+    part_bytes = part_bytes or PART_SCAN_BYTES
+    max_parts = max_parts or MAX_PARTS
+    total = sum(sizes.values())
+    count = math.ceil(total / part_bytes) if total else math.ceil(len(sizes) / CELLS_PER_PART)
+    count = max(1, min(count, max_parts, len(sizes)))
+
+    groups = [[] for _ in range(count)]
+    loads = [0] * count
+    for cell in sorted(sizes, key=lambda i: (-sizes[i], i)):
+        # ties go to the part with fewest cells
+        n = min(range(count), key=lambda i: (loads[i], len(groups[i])))
+        groups[n].append(cell)
+        loads[n] += sizes[cell]
+    return [sorted(i) for i in groups]
 
-def lambda_handler(event, context):
-    where_clauses = []
 
+def extract_parts(query_string, params, cells, location):
+    """
+    one UNLOAD per group of cells, each restricted to its cells and written to
+    its own prefix. The state machine fills in the location of each attempt
+
+    :param cells: dict of cell to bytes read, or None if the extract is not partitioned
+    """
+    groups = split_cells(cells) if cells else [None]
+    parts = []
+    for n, group in enumerate(groups):
+        sql = query_string
+        part_params = params
+        if group:
+            sql += f" and h3 in ({placeholders(len(group))})"
+            part_params = params + group
+        parts.append({
+            'part': n,
+            'cells': group,
+            'query_template': unload_statement(format_template(sql), '{}'),
+            'execution_parameters': execution_parameters(part_params),
+            'part_prefix': f'{location}part-{n:03d}/',
+            'attempt': {'count': 0}
+        })
+    return parts
+
+
+def reusable_output(key):
+    """:return: location of an earlier extract's output which still exists, None if there is none"""
+    output_location = extract_index.get(key)
+    if not output_location:
+        return None
+    bucket, object_key = split_s3_uri(output_location)
+    try:
+        s3.head_object(Bucket=bucket, Key=object_key)
+    except ClientError as e:
+        logger.info(f'output {output_location} of extract {key} is no longer available: {e}')
+        return None
+    return output_location
+
+
+def lambda_handler(event, context):
     # only required parameter. Expects array of coords in minx,miny,maxx,maxy order
-    bbox = {
-        'minx': event['bbox'][0],
-        'miny': event['bbox'][1],
-        'maxx': event['bbox'][2],
-        'maxy': event['bbox'][3]
-    }
-    where_clauses.append(f"(lon > {bbox['minx']} and lon < {bbox['maxx']})")
-    where_clauses.append(f"(lat > {bbox['miny']} and lat < {bbox['maxy']})")
+    where_clauses, params = bbox_to_where_clause(event['bbox'])
+
+    filters = dataset_to_filters(event['dataset'])
+    # fails the dataset rather than extracting points over a wider date range than ordered
+    try:
+        validate_dates(filters)
+    except query_builder.IllegalArgumentException as e:
+        raise IllegalArgumentException(str(e))
+    # optional, limits the points to the area of interest within the bbox
+    if event.get('polygon'):
+        filters['polygon'] = event['polygon']
+    filter_clauses, filter_params = filters_to_where_clause(filters)
+    where_clauses += filter_clauses
+    params += filter_params
 
-    where_clauses += filters_to_where_clause(event['dataset'])
+    # fails the dataset rather than starting an extract too large to run
+    scan_filters = filters | {'bbox': ','.join([str(i) for i in event['bbox']])}
+    estimate = estimate_scan(scan_manifest.get(), scan_filters)
+    if over_budget(estimate, MAX_SCAN_BYTES):
+        raise ScanBudgetExceededException(
+            f"extract estimated to scan {estimate['bytes']} bytes, more than the limit of {MAX_SCAN_BYTES}", estimate)
 
-    # WARNING: hardcoded dependency on Glue table schema.
-    if 'format' in event['dataset'] and event['dataset']['format'] == 'compact':
-        query_string = f"SELECT lon,lat,depth,time FROM {DATABASE}.{TABLE} where {' and '.join(where_clauses)}"
+    # named response_format in the order's payload schema
+    if event['dataset'].get('response_format') == 'compact':
+        columns = COMPACT_COLUMNS
     else:
-        query_string = f"SELECT lon,lat,depth,time,platform_name,provider,unique_id,file_uuid FROM {DATABASE}.{TABLE} where {' and '.join(where_clauses)}"
+        columns = POINT_COLUMNS
+    query_string = f"SELECT {','.join(columns)} FROM {DATABASE}.{TABLE} where {' and '.join(where_clauses)}"
+
+    output_format = event['dataset'].get('output_format', DEFAULT_OUTPUT_FORMAT)
+    if output_format not in OUTPUT_FORMATS:
+        raise IllegalArgumentException(f"output_format must be one of {', '.join(OUTPUT_FORMATS)}")
+    unload_location = None
+    parts = None
+    if output_format == 'parquet':
+        unload_location = f"{S3_BUCKET}extracts/{event['order_id']}/{event['dataset']['label']}/{uuid.uuid4()}/"
+        # partitions read by the extract, same as those in its h3 predicate
+        cells = filter_cells(scan_filters)
+        if cells is not None:
+            cells = cell_bytes(scan_manifest.get(), cells, filters)
+        parts = extract_parts(query_string, params, cells, unload_location)
+
+    # same output as an earlier order until more data is ingested
+    key = extract_key(query_string, execution_parameters(params), output_format, data_version(scan_manifest.get()))
+    reuse_location = reusable_output(key)
+    if reuse_location:
+        logger.info(f'reusing output {reuse_location} of extract {key}')
 
     return {
         'query_string': query_string,
+        'output_format': output_format,
+        # prefix of the parts' Parquet files and manifest, null for csv which is at the query's OutputLocation
+        'unload_location': unload_location,
+        # UNLOADs run in parallel by the state machine, null for csv
+        'parts': parts,
+        'extract_key': key,
+        # output of an earlier identical extract copied instead of running this one
+        'reuse_location': reuse_location,
+        # passed to Athena by the state machine
+        'execution_parameters': execution_parameters(params),
+        'scan_estimate': estimate,
+        # sized by size_order
+        'filters': filters,
+        # tags the statistics recorded once the extract completes
+        'filter_shape': filter_shape(filters | {'bbox': event['bbox']}),
         'label': event['dataset']['label'],
         'order_id': event['order_id']
     }
@@ -43,4 +206,3 @@ def lambda_handler(event, context):
 
 class IllegalArgumentException(Exception):
     pass
-
@@ -1,7 +1,6 @@
 """
 handles API request and returns a list of S3 object URLs based on query to ArcGIS map service
 """
-import json
 import logging
 import os
 import boto3
@@ -10,6 +9,7 @@ from urllib.parse import parse_qs
 from urllib.parse import urlencode
 import requests
 from botocore.errorfactory import ClientError
+from http_response import api_response, dumps
 base_url = 'https://gis.ngdc.noaa.gov/arcgis/rest/services/csb/MapServer/1/query?'
 
 logger = logging.getLogger()
@@ -33,6 +33,7 @@ def construct_s3_url(filename):
     return 'https://noaa-dcdb-bathymetry-pds.s3.amazonaws.com/' + s3_key
 
 
+@api_response
 def lambda_handler(event, context):
     print(event)
 
@@ -74,5 +75,5 @@ def lambda_handler(event, context):
 
     return {
         "statusCode": 200,
-        "body": json.dumps(names)
+        "body": dumps(names)
     }
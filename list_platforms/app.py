@@ -1,13 +1,25 @@
-import json
 import boto3
-import time
 import logging
 import os
 from datetime import datetime
-import re
+from athena_query import run_query, QueryTimeoutException, QueryFailedException
+from athena_results import split_s3_uri, stream_csv_results, read_page, encode_cursor, decode_cursor, InvalidCursorException
+from http_response import api_response, dumps
+from query_governor import QueryGovernor, ConcurrencyLimitException, throttled_response, INTERACTIVE, ASYNC_JOB
+from query_stats import filter_shape
+from platform_index import CatalogIndex, DEFAULT_LIMIT, MAX_LIMIT
+import query_builder
+from query_builder import filters_to_where_clause, where, validate_dates
+from query_jobs import DynamoDBJobStore, is_async_request, submit_job, job_response
+from s3_snapshot import S3JsonSnapshot
+from result_cache import ResultCache, DynamoDBCacheStore, normalize_filters, cache_key, cache_headers
+from scan_estimate import estimate_scan, estimate_headers, over_budget, over_budget_response, SCAN_BUDGET_BYTES, \
+    MAX_SCAN_BYTES
+from single_flight import SingleFlight, DynamoDBLeaseStore
 
 
 athena = boto3.client('athena')
+s3 = boto3.client('s3')
 # APIGW times out in ~30 seconds
 timeout_in_seconds = 25
 
@@ -15,44 +27,33 @@ logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "INFO"))
 TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
 DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
-
-platform_name_pattern = re.compile("^[- .a-zA-Z0-9_/()',!]+$")
-provider_name_pattern = re.compile("^[a-zA-Z0-9 ,]+$")
-date_pattern = re.compile("^[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}$")
-unique_id_pattern = re.compile("^[a-zA-Z0-9-]+$")
-
-
-def valid_bbox(coords: list[float]):
-    if len(coords) != 4:
-        return False
-    if coords[0] < -180 or coords[0] > 180 or coords[2] < -180 or coords[2] > 180:
-        return False
-    if coords[1] < -90 or coords[1] > 90 or coords[3] < -90 or coords[3] > 90:
-        return False
-    # crosses antimeridian
-    if coords[0] >= coords[2]:
-        return False
-    if coords[1] == coords[3]:
-        return False
-
-    return True
-
-
-def create_sql_from_bbox(bbox_string: str) -> list[str]:
-    try:
-        coords = [float(i.strip()) for i in bbox_string.split(',')]
-        if not valid_bbox(coords):
-            raise IllegalArgumentException('invalid bbox coordinates: out of range or crosses antimeridian')
-        minx = coords[0]
-        miny = coords[1]
-        maxx = coords[2]
-        maxy = coords[3]
-        return [
-            f"(lon > {minx} and lon < {maxx})",
-            f"(lat > {miny} and lat < {maxy})"
-        ]
-    except ValueError as e:
-        raise IllegalArgumentException('invalid bbox coordinates: non-numeric values')
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+
+# module scope so entries survive across warm invocations
+result_cache = ResultCache(DynamoDBCacheStore(ORDERS_TABLE))
+job_store = DynamoDBJobStore(ORDERS_TABLE)
+# identical concurrent requests share a single Athena execution
+single_flight = SingleFlight(DynamoDBLeaseStore(ORDERS_TABLE))
+# limits concurrent queries across all API and order Lambdas
+governor = QueryGovernor(DynamoDBLeaseStore(ORDERS_TABLE))
+
+# maximum and default number of platforms per page. Keeps pages, which are also
+# stored in the job and result cache items, well within DynamoDB's item size limit
+MAX_PAGE_SIZE = 1000
+
+# written daily by build_platform_catalog
+PLATFORM_CATALOG_URI = os.getenv('PLATFORM_CATALOG_URI', default='s3://csb-data/summary/platform_catalog.json')
+platform_catalog = S3JsonSnapshot(s3, *split_s3_uri(PLATFORM_CATALOG_URI))
+# prefix search over the catalog's platform names, see platform_index
+platform_index = CatalogIndex(platform_catalog)
+# search results change only with the daily catalog
+SEARCH_MAX_AGE = 300
+# distinguishes cursors into the catalog snapshot from those into a query's output
+CATALOG_CURSOR = 'catalog'
+
+# partition sizes for estimating the data read by a query. see build_scan_manifest
+SCAN_MANIFEST_URI = os.getenv('SCAN_MANIFEST_URI', default='s3://csb-data/summary/scan_manifest.json')
+scan_manifest = S3JsonSnapshot(s3, *split_s3_uri(SCAN_MANIFEST_URI))
 
 
 def iso8601_to_utc_timestamp(datestring):
@@ -67,133 +68,260 @@ def utc_timestamp_to_iso8601(timestamp):
     return datestring[0:10] + 'T00:00:00Z'
 
 
-# prepare strings for SQL by single quoting names and escaping single quotes w/in name
-def sql_quote_and_escape(name):
-    return "'" + name.replace("'", "''") + "'"
+def platforms_page(query_execution, offset=0, limit=MAX_PAGE_SIZE):
+    """
+    read a page of platforms from the query's CSV output, with a cursor for the
+    next page when more follow
 
+    :param limit: maximum number of platforms to return
+    """
+    page, more = read_page(stream_csv_results(s3, query_execution, offset), limit)
 
-def filters_to_where_clause(filters: dict) -> list[str]:
-    where_clauses = []
+    body = {
+        'count': len(page),
+        'data': [{'provider': i[0], 'platform': i[1]} for i in page]
+    }
+    if more:
+        body['next_cursor'] = encode_cursor(query_execution['QueryExecutionId'], offset + limit)
+    return body
 
-    if 'bbox' in filters:
-        try:
-            where_clauses += create_sql_from_bbox(filters['bbox'])
-        except IllegalArgumentException as e:
-            logger.warning(str(e))
 
-    if 'platforms' in filters:
-        # create a list of SQL-friendly platform names from URL query params
-        if platform_name_pattern.match(filters['platforms']):
-            platforms = [sql_quote_and_escape(i) for i in filters['platforms'].split(',')]
-            where_clauses.append(f'platform_name in ({",".join(platforms)})')
-        else:
-            logger.warning('platforms parameter contains illegal characters')
+def get_platforms(query_execution_id, offset=0, limit=MAX_PAGE_SIZE):
+    response = athena.get_query_execution(QueryExecutionId=query_execution_id)
+    return platforms_page(response['QueryExecution'], offset, limit)
+
 
+def next_page(cursor, limit):
+    """continue reading the output of an earlier query rather than running it again"""
+    query_execution_id, offset = decode_cursor(cursor)
+    if query_execution_id.startswith(f'{CATALOG_CURSOR}/'):
+        return next_catalog_page(query_execution_id, offset, limit)
+    try:
+        query_execution = athena.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+    except athena.exceptions.InvalidRequestException:
+        raise InvalidCursorException('invalid cursor')
+    # only page through the output of platform queries
+    if query_execution['Status']['State'] != 'SUCCEEDED' or \
+            not query_execution['Query'].startswith('select distinct provider, platform_name'):
+        raise InvalidCursorException('invalid cursor')
+    return platforms_page(query_execution, offset, limit)
+
+
+def platforms_from_catalog(filters, offset=0, limit=MAX_PAGE_SIZE):
+    """
+    answer unfiltered and provider-only requests from the catalog snapshot, a
+    page at a time like the query results
+
+    :return: response body or None if the snapshot is unavailable
+    """
+    catalog = platform_catalog.get()
+    if catalog is None:
+        return None
+
+    providers = None
     if 'providers' in filters:
-        if provider_name_pattern.match(filters['providers']):
-            providers = [sql_quote_and_escape(i) for i in filters['providers'].split(',')]
-            where_clauses.append(f'provider in ({",".join(providers)})')
-        else:
-            logger.warning('providers parameter contains illegal characters')
-
-    # dates are inclusive. either start, end, or both may be specified
-    if 'collection_date_start' in filters or 'collection_date_end' in filters:
-        start = ''
-        end = ''
-        # ignore values not in YYYY-MM-DD format
-        if 'collection_date_start' in filters and date_pattern.match(filters['collection_date_start']):
-            start = filters['collection_date_start']
-
-        if 'collection_date_end' in filters and date_pattern.match(filters['collection_date_end']):
-            end = filters['collection_date_end']
-
-        if start and end:
-            where_clauses.append(f"(time >= date('{start}') and time <= date('{end}'))")
-        elif start:
-            where_clauses.append(f"time >= date('{start}')")
-        elif end:
-            where_clauses.append(f"time <= date('{end}')")
-
-    # archive date is in UTC and represented as UNIX timestamp
-    if 'archive_date_start' in filters or 'archive_date_end' in filters:
-        start = ''
-        end = ''
-        if 'archive_date_start' in filters and date_pattern.match(filters['archive_date_start']):
-            start = filters['archive_date_start']
-
-        if 'archive_date_end' in filters and date_pattern.match(filters['archive_date_end']):
-            end = filters['archive_date_end']
-
-        if start and end:
-            where_clauses.append(f"(entry_date >= date('{start}') and entry_date <= date('{end}'))")
-        elif start:
-            where_clauses.append(f"entry_date >= date('{start}')")
-        elif end:
-            where_clauses.append(f"entry_date <= date('{end}')")
-
-    if 'unique_id' in filters and unique_id_pattern.match(filters['unique_id']):
-        unique_id = filters['unique_id']
-        where_clauses.append(f"unique_id = '{unique_id}'")
-
-    return where_clauses
+        providers = filters['providers'].split(',')
+
+    data = [{'provider': i['provider'], 'platform': i['platform']}
+            for i in catalog['platforms'] if providers is None or i['provider'] in providers]
+    page = data[offset:offset + limit]
+    body = {
+        'count': len(page),
+        'data': page
+    }
+    if offset + limit < len(data):
+        # tied to the snapshot, offsets into a newer catalog may skip or repeat platforms
+        catalog_id = f"{CATALOG_CURSOR}/{catalog['created']}/{filters.get('providers', '')}"
+        body['next_cursor'] = encode_cursor(catalog_id, offset + limit)
+    return body
 
 
+def next_catalog_page(catalog_id, offset, limit):
+    try:
+        _, created, providers = catalog_id.split('/', 2)
+    except ValueError:
+        raise InvalidCursorException('invalid cursor')
+    catalog = platform_catalog.get()
+    if catalog is None or catalog['created'] != created:
+        raise InvalidCursorException('cursor has expired, request the first page again')
+    filters = {'providers': providers} if providers else {}
+    return platforms_from_catalog(filters, offset, limit)
+
+
+def parse_limit(query_params):
+    if 'limit' not in query_params:
+        return MAX_PAGE_SIZE
+    try:
+        limit = int(query_params['limit'])
+    except ValueError:
+        raise IllegalArgumentException('limit must be an integer')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise IllegalArgumentException(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return limit
+
+
+def search_response(event):
+    """
+    platforms with a name, or a word within it, starting with the q parameter.
+    Answered from the catalog snapshot only
+    """
+    query_params = event.get('queryStringParameters') or {}
+    try:
+        if not query_params.get('q', '').strip():
+            raise IllegalArgumentException('q must be provided')
+        limit = int(query_params.get('limit', DEFAULT_LIMIT))
+        if limit < 1 or limit > MAX_LIMIT:
+            raise IllegalArgumentException(f'limit must be between 1 and {MAX_LIMIT}')
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': dumps({'message': 'limit must be an integer'})
+        }
+    except IllegalArgumentException as e:
+        return {
+            'statusCode': 400,
+            'body': dumps({'message': str(e)})
+        }
+
+    index = platform_index.get()
+    if index is None:
+        return {
+            'statusCode': 503,
+            'headers': {'Retry-After': '60'},
+            'body': dumps({'message': 'platform catalog unavailable'})
+        }
+
+    providers = None
+    if 'providers' in query_params:
+        providers = set([i.strip() for i in query_params['providers'].split(',')])
+    data = index.search(query_params['q'], limit, providers)
+    return {
+        'statusCode': 200,
+        'headers': {'Cache-Control': f'public, max-age={SEARCH_MAX_AGE}'},
+        'body': dumps({'count': len(data), 'data': data})
+    }
+
+
+@api_response
 def lambda_handler(event, context):
     logger.info(event)
     http_method = event['requestContext']['http']['method']
+
+    # poll for the result of an asynchronous request
+    path_parameters = event.get('pathParameters') or {}
+    if http_method == 'GET' and 'job_id' in path_parameters:
+        return job_response(job_store, athena, path_parameters['job_id'], 'platforms', get_platforms, result_cache,
+                            governor)
+
+    if http_method == 'GET' and event.get('rawPath', '').endswith('/search'):
+        return search_response(event)
+
     sql = f'select distinct provider, platform_name from {DATABASE}.{TABLE}'
 
+    filters = {}
+
     if http_method == 'GET':
-        if 'queryStringParameters' in event:
-            where_clauses = filters_to_where_clause(event['queryStringParameters'])
-            if len(where_clauses):
-                sql += f" where {' and '.join(where_clauses)}"
+        query_params = event.get('queryStringParameters') or {}
+        try:
+            limit = parse_limit(query_params)
+            if 'cursor' in query_params:
+                return {
+                    'statusCode': 200,
+                    'body': dumps(next_page(query_params['cursor'], limit))
+                }
+            filters = normalize_filters(query_params)
+            validate_dates(filters)
+        except (IllegalArgumentException, InvalidCursorException, query_builder.IllegalArgumentException) as e:
+            return {
+                'statusCode': 400,
+                'body': dumps({'message': str(e)})
+            }
+
+        if not is_async_request(event) and set(filters.keys()).issubset(['providers']):
+            body = platforms_from_catalog(filters, limit=limit)
+            if body is not None:
+                return {
+                    'statusCode': 200,
+                    'body': dumps(body)
+                }
+
+        where_clauses, params = filters_to_where_clause(filters)
+        sql += where(where_clauses)
     else:
         return {
             'statusCode': 405,
-            'body': json.dumps({'message': 'Method Not Allowed'})
+            'body': dumps({'message': 'Method Not Allowed'})
         }
 
     sql += ' order by 1, 2'
-    logger.info(sql)
-    response = athena.start_query_execution(
-        QueryString=sql,
-        WorkGroup='primary'
-    )
-    query_execution_id = response['QueryExecutionId']
-
-    query_state = None
-    check_count = 0
-
-    # Athena Query states: QUEUED | RUNNING | SUCCEEDED | FAILED | CANCELLED
-    while check_count < timeout_in_seconds and (
-            query_state is None or query_state == 'QUEUED' or query_state == 'RUNNING'):
-        time.sleep(1)
-        response = athena.get_query_execution(QueryExecutionId=query_execution_id)
-        query_state = response['QueryExecution']['Status']['State']
-        check_count = check_count + 1
-
-    if query_state != 'SUCCEEDED':
+    key = cache_key('platforms', filters)
+    estimate = estimate_scan(scan_manifest.get(), filters)
+    # only the first page of the default size is cached, later pages are read from the query output
+    cacheable = 'limit' not in query_params
+    cached = result_cache.get(key) if cacheable else None
+    if cached:
+        body, age = cached
+        logger.info(f"returning cached result ({age} seconds old)")
+        return {
+            'statusCode': 200,
+            'headers': cache_headers(age) | estimate_headers(estimate),
+            'body': dumps(body)
+        }
+
+    if over_budget(estimate, MAX_SCAN_BYTES):
+        logger.warning(f'rejecting query estimated to scan {estimate}')
+        return over_budget_response(estimate, MAX_SCAN_BYTES)
+
+    logger.info(f'{sql} {params}')
+    tags = {'endpoint': 'platforms', 'shape': filter_shape(filters), 'method': 'scan' if cacheable else 'page'}
+    # queries over the scan budget are always run as a job
+    if is_async_request(event) or over_budget(estimate, SCAN_BUDGET_BYTES):
+        # held until the job completes
+        try:
+            slot = governor.acquire(ASYNC_JOB)
+        except ConcurrencyLimitException as e:
+            logger.warning(str(e))
+            return throttled_response(e)
+        try:
+            query_execution_id = single_flight.start_query(athena, sql, params=params)
+        except Exception:
+            governor.release(slot)
+            raise
+        response = submit_job(job_store, event, 'platforms', query_execution_id, key if cacheable else None,
+                              params={'limit': limit}, tags=tags, slot=slot)
+        response['headers'].update(estimate_headers(estimate))
+        return response
+
+    try:
+        with governor.slot(INTERACTIVE):
+            query_execution = run_query(athena, sql, timeout_in_seconds, single_flight=single_flight, params=params,
+                                        tags=tags)
+    except ConcurrencyLimitException as e:
+        logger.warning(str(e))
+        return throttled_response(e)
+    except (QueryTimeoutException, QueryFailedException) as e:
+        logger.warning(str(e))
         return {
             'statusCode': 500,
-            'body': json.dumps({'message': 'query failed or took too long to respond'})
+            'body': dumps({'message': 'query failed or took too long to respond'})
         }
 
-    execution_time = round(int(response['QueryExecution']['Statistics']['TotalExecutionTimeInMillis']) * 1000)
+    execution_time = round(int(query_execution['Statistics']['TotalExecutionTimeInMillis']) / 1000, 1)
     logger.info(f"query completed in approximately {execution_time} seconds")
 
-    response = athena.get_query_results(QueryExecutionId=query_execution_id)
-    results = []
-    for i in response['ResultSet']['Rows']:
-        results.append({'provider': i['Data'][0]['VarCharValue'], 'platform': i['Data'][1]['VarCharValue']})
-    record_count = len(response['ResultSet']['Rows'])
+    body = platforms_page(query_execution, limit=limit)
+    if not cacheable:
+        return {
+            'statusCode': 200,
+            'headers': estimate_headers(estimate),
+            'body': dumps(body)
+        }
 
+    result_cache.put(key, body)
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'count': record_count,
-            'data': results[1:]
-        })
+        'headers': cache_headers(0) | estimate_headers(estimate),
+        'body': dumps(body)
     }
 
 
@@ -1,7 +1,7 @@
-import json
 import logging
 import os
 import boto3
+from http_response import api_response, dumps
 # import requests
 
 # setup logging
@@ -33,6 +33,7 @@ def get_order_status(order_id):
     return response['Item']
 
 
+@api_response
 def lambda_handler(event, context):
     try:
         order_id = event['pathParameters']['proxy']
@@ -45,26 +46,26 @@ def lambda_handler(event, context):
         logger.warning(e.args[0])
         return {
             'statusCode': 404,
-            'body': json.dumps(e.args[0])
+            'body': dumps(e.args[0])
         }
     except BadRequestException as e:
         logger.warning(e.args[0])
         return {
             'statusCode': 400,
-            'body': json.dumps(e.args[0])
+            'body': dumps(e.args[0])
         }
     except Exception as e:
         logger.warning(e.args[0])
         return {
             'statusCode': 500,
-            'body': json.dumps(e.args[0])
+            'body': dumps(e.args[0])
         }
 
 
     return {
         "statusCode": 200,
-        "body": json.dumps(response)
-        # "body": json.dumps({
+        "body": dumps(response)
+        # "body": dumps({
         #     "message": f"status of order {order_id}: TODO"
         # })
     }
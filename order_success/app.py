@@ -1,3 +1,4 @@
+import json
 from datetime import timezone
 from datetime import datetime
 from datetime import timedelta
@@ -10,6 +11,7 @@ import boto3
 TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(TABLE)
+s3 = boto3.client('s3')
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
@@ -39,15 +41,40 @@ def update_order(order_id, output_location, status='complete'):
         raise Exception("failed to update order")
 
 
+def s3_url(uri):
+    bucket_name, key = uri.removeprefix('s3://').split('/', 1)
+    return f'https://{bucket_name}.s3.amazonaws.com/{key}'
+
+
+def read_manifest(manifest_location):
+    """:return: manifest of a Parquet extract written by write_extract_manifest"""
+    bucket_name, key = manifest_location.removeprefix('s3://').split('/', 1)
+    return json.loads(s3.get_object(Bucket=bucket_name, Key=key)['Body'].read())
+
+
 def format_message(output_location):
     now = datetime.now(timezone.utc)
     expiration_date = now + timedelta(days=7)
 
-    # convert s3 location to URL
-    bucket_name, filename = output_location.split('/')[-2:]
-    url = f'https://{bucket_name}.s3.amazonaws.com/{filename}'
+    # convert s3 location to URL, or one per file of a Parquet extract
+    if output_location.endswith('manifest.json'):
+        manifest = read_manifest(output_location)
+        urls = [s3_url(file) for part in manifest['parts'] for file in part['files']]
+        failed = len(manifest['failed_parts'])
+    else:
+        bucket_name, filename = output_location.split('/')[-2:]
+        urls = [f'https://{bucket_name}.s3.amazonaws.com/{filename}']
+        failed = 0
+
+    if len(urls) == 1:
+        location = f'from {urls[0]}.'
+    else:
+        location = 'from the following URLs:\n' + '\n'.join(urls)
+    if failed:
+        total = failed + len(manifest['parts'])
+        location += f'\n{failed} of the {total} parts of the requested area could not be extracted and are missing.'
 
-    return f"""Your data request is ready and can be downloaded from {url}.\nThe data will be available until {expiration_date.strftime('%B %-d, %Y')}."""
+    return f"""Your data request is ready and can be downloaded {location}\nThe data will be available until {expiration_date.strftime('%B %-d, %Y')}."""
 
 
 def lambda_handler(event, context):
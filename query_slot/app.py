@@ -0,0 +1,33 @@
+"""
+take or release a query_governor slot on behalf of the state machine, which
+starts the point extracts itself. Acquiring fails with ConcurrencyLimitException
+while every extract slot is taken; the state machine retries until one is free
+"""
+import logging
+import os
+from query_governor import QueryGovernor, EXTRACT
+from single_flight import DynamoDBLeaseStore
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+ORDERS_TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+governor = QueryGovernor(DynamoDBLeaseStore(ORDERS_TABLE))
+
+
+def lambda_handler(event, context):
+    """
+    expects {"action": "acquire", "query_class": "extract"} or {"action": "release", "slot": {...}}
+
+    :return: dict with the slot acquired, None if the query is not governed
+    """
+    if event['action'] == 'acquire':
+        slot = governor.acquire(event.get('query_class', EXTRACT))
+        logger.info(f'acquired slot {slot}')
+        return {'slot': slot}
+
+    if event['action'] == 'release':
+        governor.release(event.get('slot'))
+        return {'slot': None}
+
+    raise ValueError(f"unknown action {event['action']}")
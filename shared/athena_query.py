@@ -0,0 +1,150 @@
+"""
+run Athena queries on behalf of the API Lambdas. Polls query status on an
+adaptive schedule (quick first checks, then jittered backoff) instead of a fixed
+one-second sleep, and stops the query if it runs past the caller's deadline.
+"""
+import logging
+import os
+import random
+import time
+
+from query_stats import record_query
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+WORK_GROUP = os.getenv('ATHENA_WORK_GROUP', default='primary')
+
+# small queries commonly finish in a few hundred milliseconds so check early and
+# often, then back off to limit the number of GetQueryExecution calls
+FIRST_POLLS = [0.1, 0.15, 0.25]
+BACKOFF_RATE = 1.5
+MAX_POLL_INTERVAL = 3.0
+
+# Athena Query states: QUEUED | RUNNING | SUCCEEDED | FAILED | CANCELLED
+TERMINAL_STATES = ['SUCCEEDED', 'FAILED', 'CANCELLED']
+
+
+def poll_intervals(first_polls=FIRST_POLLS, backoff_rate=BACKOFF_RATE, max_interval=MAX_POLL_INTERVAL, rng=random):
+    """
+    generate the sequence of wait times (in seconds) between status checks. The
+    first few are fixed, after which the interval grows by backoff_rate up to
+    max_interval with "equal jitter" applied so concurrent callers spread out
+    """
+    for interval in first_polls:
+        yield interval
+
+    interval = first_polls[-1] if first_polls else 0.1
+    while True:
+        interval = min(interval * backoff_rate, max_interval)
+        yield interval / 2 + rng.uniform(0, interval / 2)
+
+
+def execution_parameters(params):
+    """
+    Athena ExecutionParameters are SQL literals given as strings, e.g. 'PGS' (quoted) or -97.0
+
+    :param params: list of str, int or float values
+    """
+    return ["'" + i.replace("'", "''") + "'" if isinstance(i, str) else str(i) for i in params]
+
+
+def start_query(client, sql, work_group=WORK_GROUP, params=None):
+    """
+    :param params: optional values for the ? placeholders in the SQL, in order
+    :return: QueryExecutionId
+    """
+    kwargs = {}
+    if params:
+        kwargs['ExecutionParameters'] = execution_parameters(params)
+    response = client.start_query_execution(
+        QueryString=sql,
+        WorkGroup=work_group,
+        **kwargs
+    )
+    return response['QueryExecutionId']
+
+
+def wait_for_query(client, query_execution_id, timeout_in_seconds, sleep=time.sleep, clock=time.monotonic,
+                   stop_on_timeout=True):
+    """
+    poll until the query reaches a terminal state. Stops the query (unless
+    stop_on_timeout is False) and raises QueryTimeoutException once
+    timeout_in_seconds has elapsed.
+
+    :return: QueryExecution structure of the successful query, including Statistics
+    """
+    deadline = clock() + timeout_in_seconds
+    check_count = 0
+    for interval in poll_intervals():
+        response = client.get_query_execution(QueryExecutionId=query_execution_id)
+        check_count += 1
+        query_execution = response['QueryExecution']
+        query_state = query_execution['Status']['State']
+        if query_state in TERMINAL_STATES:
+            break
+
+        remaining = deadline - clock()
+        if remaining <= 0:
+            logger.warning(f'query {query_execution_id} still running after {check_count} status checks')
+            if stop_on_timeout:
+                client.stop_query_execution(QueryExecutionId=query_execution_id)
+            raise QueryTimeoutException(query_execution_id, query_execution.get('Statistics', {}))
+
+        sleep(min(interval, remaining))
+
+    logger.debug(f'query {query_execution_id} {query_state} after {check_count} status checks')
+    if query_state != 'SUCCEEDED':
+        reason = query_execution['Status'].get('StateChangeReason', query_state)
+        raise QueryFailedException(query_execution_id, reason, query_execution.get('Statistics', {}))
+
+    return query_execution
+
+
+def run_query(client, sql, timeout_in_seconds, work_group=WORK_GROUP, sleep=time.sleep, clock=time.monotonic,
+              single_flight=None, params=None, tags=None):
+    """
+    start the query and wait for it to complete
+
+    :param params: optional values for the ? placeholders in the SQL, in order
+    :param single_flight: optional SingleFlight used to share the execution with
+        identical concurrent queries. A shared query is left running on timeout
+        since other callers may be waiting on it
+    :param tags: optional dict of endpoint, shape and order_id. When given the
+        query's Statistics are recorded, see query_stats
+    :return: QueryExecution structure of the successful query, including Statistics
+    """
+    if single_flight:
+        query_execution_id = single_flight.start_query(client, sql, work_group=work_group, params=params)
+    else:
+        query_execution_id = start_query(client, sql, work_group=work_group, params=params)
+    try:
+        query_execution = wait_for_query(client, query_execution_id, timeout_in_seconds, sleep=sleep, clock=clock,
+                                         stop_on_timeout=single_flight is None)
+    except QueryTimeoutException as e:
+        if tags:
+            record_query(query_execution_id, 'TIMEOUT', e.statistics, **tags)
+        raise
+    except QueryFailedException as e:
+        if tags:
+            record_query(query_execution_id, 'FAILED', e.statistics, **tags)
+        raise
+
+    if tags:
+        record_query(query_execution_id, query_execution['Status']['State'], query_execution.get('Statistics'), **tags)
+    return query_execution
+
+
+class QueryTimeoutException(Exception):
+    def __init__(self, query_execution_id, statistics):
+        super().__init__(f'query {query_execution_id} did not complete in time')
+        self.query_execution_id = query_execution_id
+        self.statistics = statistics
+
+
+class QueryFailedException(Exception):
+    def __init__(self, query_execution_id, reason, statistics=None):
+        super().__init__(f'query {query_execution_id} failed: {reason}')
+        self.query_execution_id = query_execution_id
+        self.reason = reason
+        self.statistics = statistics or {}
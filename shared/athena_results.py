@@ -0,0 +1,67 @@
+"""
+read Athena query results by streaming the CSV output file from the query's S3
+OutputLocation. Avoids the 1000 row limit and row-by-row JSON structure of
+GetQueryResults, and memory use does not depend on the size of the result.
+"""
+import base64
+import codecs
+import csv
+import json
+import logging
+import os
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+
+def split_s3_uri(uri):
+    bucket, _, key = uri.replace('s3://', '', 1).partition('/')
+    return bucket, key
+
+
+def stream_csv_results(s3_client, query_execution, offset=0):
+    """
+    rows of the query's CSV output, excluding the header
+
+    :param query_execution: QueryExecution structure for a successful query
+    :param offset: number of data rows to skip
+    :return: iterator of rows as lists of strings
+    """
+    bucket, key = split_s3_uri(query_execution['ResultConfiguration']['OutputLocation'])
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    reader = csv.reader(codecs.getreader('utf-8')(body))
+    # skip the header
+    return islice(reader, offset + 1, None)
+
+
+def read_page(rows, limit):
+    """
+    :return: tuple of (list of up to limit rows, whether more rows follow)
+    """
+    page = list(islice(rows, limit + 1))
+    return page[:limit], len(page) > limit
+
+
+def encode_cursor(query_execution_id, offset):
+    cursor = json.dumps({'q': query_execution_id, 'o': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    :return: tuple of (QueryExecutionId, offset)
+    """
+    try:
+        value = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        query_execution_id = value['q']
+        offset = int(value['o'])
+    except Exception:
+        raise InvalidCursorException('invalid cursor')
+    if not isinstance(query_execution_id, str) or offset < 0:
+        raise InvalidCursorException('invalid cursor')
+    return query_execution_id, offset
+
+
+class InvalidCursorException(Exception):
+    pass
@@ -0,0 +1,291 @@
+"""
+in-memory cube of point counts by coarse lon/lat cell, collection month and
+provider/platform. Lets count_points answer the common filter panel requests
+with vectorized array operations instead of an Athena query.
+
+The cube is stored sparsely as parallel arrays holding one element per
+non-empty (cell, month, provider/platform) combination, loaded from a NumPy
+.npz snapshot in S3. Requests can only be answered from the cube when the bbox
+falls on cell boundaries and dates fall on month boundaries.
+
+Cube answers differ from Athena by:
+ - points archived since the snapshot was built
+ - points lying exactly on the bbox edges (the point table uses a strict
+   inequality, cube cells include their west and south edges)
+ - points collected exactly at midnight on the end date
+`verify` measures the difference and reports any sample exceeding
+VERIFY_TOLERANCE (relative difference).
+
+The snapshot is rebuilt daily by build_count_cube. Readers ignore a snapshot
+older than MAX_AGE rather than serve counts missing more than a day or two of
+archived points.
+
+rebuild the snapshot:
+    python count_cube.py --profile mfa build
+compare the snapshot against Athena:
+    python count_cube.py --profile mfa verify --samples 20
+"""
+import argparse
+import io
+import logging
+import os
+import random
+from datetime import date, datetime, timezone
+
+import boto3
+import numpy as np
+from athena_query import run_query
+from athena_results import split_s3_uri, stream_csv_results
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# size of cells in degrees
+CELL_SIZE = 1.0
+# maximum relative difference between cube and Athena counts
+VERIFY_TOLERANCE = 0.01
+
+TABLE = os.getenv('ATHENA_TABLE', default='csb_parquet')
+DATABASE = os.getenv('ATHENA_DATABASE', default='dcdb')
+SNAPSHOT_URI = os.getenv('COUNT_CUBE_URI', default='s3://csb-data/summary/count_cube.npz')
+# seconds after which a snapshot is no longer used, allows for a failed daily rebuild
+MAX_AGE = int(os.getenv('COUNT_CUBE_MAX_AGE', default=2 * 24 * 3600))
+
+SUPPORTED_FILTERS = ['bbox', 'platforms', 'providers', 'collection_date_start', 'collection_date_end']
+
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+
+class CountCube:
+    def __init__(self, x, y, month, series, count, providers, platforms, cell_size=CELL_SIZE, created=''):
+        # cell column and row, i.e. floor(lon / cell_size), floor(lat / cell_size)
+        self.x = x
+        self.y = y
+        # collection month as year * 12 + month - 1
+        self.month = month
+        # index into providers, platforms
+        self.series = series
+        self.count = count
+        self.providers = providers
+        self.platforms = platforms
+        self.cell_size = cell_size
+        self.created = created
+
+    def age(self, now=None):
+        """seconds since the snapshot was built, None if unknown"""
+        if not self.created:
+            return None
+        now = now or datetime.now(timezone.utc)
+        return max(0, int((now - datetime.fromisoformat(self.created)).total_seconds()))
+
+    def is_stale(self, max_age=MAX_AGE, now=None):
+        """whether the snapshot is too old, or of unknown age, to be used"""
+        age = self.age(now)
+        return age is None or age > max_age
+
+    def _cell_index(self, value):
+        """cell boundary index for the coordinate, or None if not on a cell boundary"""
+        index = round(value / self.cell_size)
+        if abs(index * self.cell_size - value) > 1e-9:
+            return None
+        return index
+
+    @staticmethod
+    def _month_boundary(datestring):
+        """month index of a date falling on the first of a month, otherwise None"""
+        try:
+            year, month, day = [int(i) for i in datestring.split('-')]
+        except ValueError:
+            return None
+        if day != 1:
+            return None
+        return month_index(year, month)
+
+    def _bbox_cells(self, bbox_string):
+        try:
+            coords = [float(i) for i in bbox_string.split(',')]
+        except ValueError:
+            return None
+        if len(coords) != 4:
+            return None
+        cells = [self._cell_index(i) for i in coords]
+        if None in cells or cells[0] >= cells[2] or cells[1] >= cells[3]:
+            return None
+        return cells
+
+    def supports(self, filters):
+        """whether the (normalized) filters can be answered from the cube"""
+        if not set(filters.keys()).issubset(SUPPORTED_FILTERS):
+            return False
+        if 'bbox' in filters and self._bbox_cells(filters['bbox']) is None:
+            return False
+        for name in ['collection_date_start', 'collection_date_end']:
+            if name in filters and self._month_boundary(filters[name]) is None:
+                return False
+        return True
+
+    def count_points(self, filters):
+        """
+        number of points matching the filters. Caller must first check supports()
+        """
+        mask = np.ones(len(self.count), dtype=bool)
+
+        if 'bbox' in filters:
+            minx, miny, maxx, maxy = self._bbox_cells(filters['bbox'])
+            mask &= (self.x >= minx) & (self.x < maxx) & (self.y >= miny) & (self.y < maxy)
+
+        # end date is treated as exclusive, consistent with "time <= date(end)" on a timestamp
+        if 'collection_date_start' in filters:
+            mask &= self.month >= self._month_boundary(filters['collection_date_start'])
+        if 'collection_date_end' in filters:
+            mask &= self.month < self._month_boundary(filters['collection_date_end'])
+
+        if 'providers' in filters or 'platforms' in filters:
+            selected = np.ones(len(self.providers), dtype=bool)
+            if 'providers' in filters:
+                selected &= np.isin(self.providers, filters['providers'].split(','))
+            if 'platforms' in filters:
+                selected &= np.isin(self.platforms, filters['platforms'].split(','))
+            mask &= np.isin(self.series, np.flatnonzero(selected))
+
+        return int(self.count[mask].sum())
+
+    def save(self, fileobj):
+        np.savez_compressed(
+            fileobj, x=self.x, y=self.y, month=self.month, series=self.series, count=self.count,
+            providers=self.providers, platforms=self.platforms,
+            cell_size=np.array(self.cell_size), created=np.array(self.created)
+        )
+
+    @classmethod
+    def load(cls, fileobj):
+        with np.load(fileobj, allow_pickle=False) as data:
+            return cls(
+                data['x'], data['y'], data['month'], data['series'], data['count'],
+                data['providers'], data['platforms'], float(data['cell_size']), str(data['created'])
+            )
+
+    @classmethod
+    def from_rows(cls, rows, cell_size=CELL_SIZE):
+        """
+        :param rows: iterable of (x, y, month, provider, platform_name, count) as produced by build_sql()
+        """
+        series_ids = {}
+        columns = [[], [], [], [], []]
+        for x, y, month, provider, platform_name, count in rows:
+            series = series_ids.setdefault((provider, platform_name), len(series_ids))
+            for column, value in zip(columns, [x, y, month, series, count]):
+                column.append(int(value))
+
+        names = list(series_ids.keys())
+        return cls(
+            np.array(columns[0], dtype=np.int16),
+            np.array(columns[1], dtype=np.int16),
+            np.array(columns[2], dtype=np.int32),
+            np.array(columns[3], dtype=np.int32),
+            np.array(columns[4], dtype=np.int64),
+            np.array([i[0] for i in names], dtype=str),
+            np.array([i[1] for i in names], dtype=str),
+            cell_size,
+            datetime.now(timezone.utc).isoformat(timespec='seconds')
+        )
+
+
+def load_snapshot(s3_client, uri=SNAPSHOT_URI):
+    """
+    :return: CountCube or None if the snapshot cannot be loaded
+    """
+    bucket, key = split_s3_uri(uri)
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        cube = CountCube.load(io.BytesIO(response['Body'].read()))
+    except Exception as e:
+        logger.warning(f'unable to load count cube from {uri}: {e}')
+        return None
+    logger.info(f'loaded count cube created {cube.created} with {len(cube.count)} entries')
+    return cube
+
+
+def build_sql(cell_size=CELL_SIZE):
+    return f"""SELECT cast(floor(lon / {cell_size}) as integer), cast(floor(lat / {cell_size}) as integer),
+    year(time) * 12 + month(time) - 1, provider, platform_name, count(*)
+    FROM {DATABASE}.{TABLE}
+    GROUP BY 1, 2, 3, 4, 5"""
+
+
+def build(athena, s3_client, uri=SNAPSHOT_URI, timeout_in_seconds=30 * 60):
+    query_execution = run_query(athena, build_sql(), timeout_in_seconds, tags={'endpoint': 'build_count_cube'})
+    cube = CountCube.from_rows(stream_csv_results(s3_client, query_execution))
+    with io.BytesIO() as f:
+        cube.save(f)
+        f.seek(0)
+        bucket, key = split_s3_uri(uri)
+        s3_client.upload_fileobj(f, bucket, key)
+    logger.info(f'stored count cube with {len(cube.count)} entries in {uri}')
+    return cube
+
+
+def verify(athena, s3_client, samples, uri=SNAPSHOT_URI, rng=random):
+    """
+    compare cube counts against Athena for randomly chosen cell-aligned bboxes and months
+
+    :return: list of (filters, cube count, athena count) exceeding VERIFY_TOLERANCE
+    """
+    cube = load_snapshot(s3_client, uri)
+    failures = []
+    for i in range(samples):
+        # pick an occupied cell so the comparison is meaningful
+        index = rng.randrange(len(cube.count))
+        size = rng.choice([1, 2, 5])
+        minx, miny = [int(j) * cube.cell_size for j in (cube.x[index], cube.y[index])]
+        maxx, maxy = minx + size * cube.cell_size, miny + size * cube.cell_size
+        year, month = divmod(int(cube.month[index]), 12)
+        start = date(year, month + 1, 1)
+        end = date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+        filters = {
+            'bbox': f'{minx},{miny},{maxx},{maxy}',
+            'collection_date_start': start.isoformat(),
+            'collection_date_end': end.isoformat()
+        }
+
+        # same half-open intervals as the cube
+        sql = f"""SELECT count(*) FROM {DATABASE}.{TABLE} WHERE
+        lon >= {minx} and lon < {maxx} and lat >= {miny} and lat < {maxy} and
+        time >= date('{start}') and time < date('{end}')"""
+        query_execution = run_query(athena, sql, 5 * 60)
+        athena_count = int(next(stream_csv_results(s3_client, query_execution))[0])
+        cube_count = cube.count_points(filters)
+
+        difference = abs(cube_count - athena_count) / max(athena_count, 1)
+        logger.info(f'{filters}: cube {cube_count}, athena {athena_count}')
+        if difference > VERIFY_TOLERANCE:
+            failures.append((filters, cube_count, athena_count))
+    return failures
+
+
+if __name__ == '__main__':
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    arg_parser = argparse.ArgumentParser(description="rebuild or verify the count cube snapshot used by count_points")
+    arg_parser.add_argument("--profile", default="default", help="AWS profile")
+    arg_parser.add_argument("--uri", default=SNAPSHOT_URI, help="S3 location of the snapshot")
+    subparsers = arg_parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="query Athena and store a new snapshot")
+    verify_parser = subparsers.add_parser("verify", help="compare snapshot counts against Athena")
+    verify_parser.add_argument("--samples", type=int, default=20, help="number of comparisons")
+    args = arg_parser.parse_args()
+
+    session = boto3.Session(profile_name=args.profile)
+    athena_client = session.client('athena')
+    s3 = session.client('s3')
+
+    if args.command == 'build':
+        build(athena_client, s3, args.uri)
+    else:
+        mismatches = verify(athena_client, s3, args.samples, args.uri)
+        for mismatch in mismatches:
+            logger.warning(f'cube count differs from Athena: {mismatch}')
+        logger.info(f'{args.samples - len(mismatches)} of {args.samples} samples within tolerance')
@@ -0,0 +1,113 @@
+"""
+reuse of point extracts across orders. An order repeating the AOI and filters of
+an earlier one, e.g. a standard harbor box requested weekly, produces the same
+SQL. Until more data is ingested the earlier output is copied rather than
+running the extract again.
+
+Extracts are keyed on a hash of their SQL, parameters and output format together
+with the data version, the latest entry_date in the scan manifest (see
+build_scan_manifest). Items in the orders table map the key to the S3 output and
+expire before the outputs themselves are removed from the pickup bucket.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+import boto3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# outputs remain in the pickup bucket for 7 days
+REUSE_TTL_IN_SECONDS = int(os.getenv('EXTRACT_REUSE_TTL', default=6 * 24 * 60 * 60))
+
+
+def data_version(manifest):
+    """:return: latest entry_date of the points in the scan manifest, None if unknown"""
+    return manifest.get('latest_entry_date') if manifest else None
+
+
+def extract_key(query_string, parameters, output_format, version):
+    """:return: hash identifying the extract's output, None without a data version"""
+    if not version:
+        return None
+    canonical = json.dumps({
+        'sql': ' '.join(query_string.split()),
+        'parameters': parameters,
+        'format': output_format,
+        'data_version': version
+    }, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ExtractIndex:
+    """
+    output location of earlier extracts by key. Errors reading or writing the
+    store are logged and the extract run as usual rather than failing the order
+    """
+    def __init__(self, store, ttl_in_seconds=REUSE_TTL_IN_SECONDS, clock=time.time):
+        self.store = store
+        self.ttl_in_seconds = ttl_in_seconds
+        self.clock = clock
+
+    def get(self, key):
+        """:return: S3 location of the earlier output, None if there is no valid one"""
+        if not key:
+            return None
+        try:
+            found = self.store.get(key)
+        except Exception as e:
+            logger.warning(f'failed to look up extract {key}: {e}')
+            return None
+        if found is None:
+            return None
+        output_location, created = found
+        # the table's TTL attribute removes expired items eventually, not immediately
+        if self.clock() - created > self.ttl_in_seconds:
+            return None
+        return output_location
+
+    def put(self, key, output_location):
+        if not key:
+            return
+        now = self.clock()
+        try:
+            self.store.put(key, output_location, now, now + self.ttl_in_seconds)
+        except Exception as e:
+            logger.warning(f'failed to store extract {key}: {e}')
+
+
+class DynamoDBExtractStore:
+    """extract outputs stored as items in the orders table, removed by its TTL attribute"""
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+
+    def get(self, key):
+        response = self.table.get_item(Key={'PK': 'EXTRACT#' + key, 'SK': 'OUTPUT'})
+        if 'Item' not in response:
+            return None
+        item = response['Item']
+        return item['output_location'], float(item['created'])
+
+    def put(self, key, output_location, created, expires):
+        self.table.put_item(Item={
+            'PK': 'EXTRACT#' + key,
+            'SK': 'OUTPUT',
+            'output_location': output_location,
+            'created': str(created),
+            'TTL': int(expires)
+        })
+
+
+class MemoryExtractStore:
+    """shared store substitute for local use and tests"""
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def put(self, key, output_location, created, expires):
+        self.items[key] = (output_location, created)
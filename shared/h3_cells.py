@@ -0,0 +1,146 @@
+"""
+H3 cell coverage of bounding boxes and polygons. Uses the h3 v3 API, same as reprocess_csb_data.
+
+Bounding boxes are lists of coordinates in minx,miny,maxx,maxy order. Polygons
+are GeoJSON Polygon geometries with [lon, lat] positions.
+"""
+import math
+
+import h3
+
+# resolution of the csv/{h3_index}/ prefixes written by reprocess_csb_data
+PARTITION_RESOLUTION = 1
+# spacing in degrees of the points sampled when covering a bbox. Well under the
+# ~400km edge of a resolution 1 cell
+COVERING_STEP = 1.0
+# polygons are filled with cells of this resolution (~12,400 km2/hexagon) before
+# mapping them to their partitions
+POLYFILL_RESOLUTION = 3
+# predicates listing more cells than this prune too little to be worth the longer SQL
+MAX_PARTITION_CELLS = 200
+
+# keeps vertices a small distance inside the bbox so that the curvature of the
+# (geodesic) cell edges cannot carry any part of a cell outside of it
+INTERIOR_MARGIN = 0.01
+# bound on the distance from a cell's center to its vertices relative to the
+# average edge length, the largest resolution 3 cell is ~1.27x
+CIRCUMRADIUS_FACTOR = 1.5
+# on the sphere used by H3
+KM_PER_DEGREE = 111.19
+
+
+def bbox_to_geojson(bbox):
+    minx, miny, maxx, maxy = bbox
+    return {
+        'type': 'Polygon',
+        'coordinates': [[[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]]
+    }
+
+
+def cell_to_bigint(cell):
+    """Athena's H3 functions represent cells as BIGINT rather than hex strings"""
+    return int(cell, 16)
+
+
+def cell_within_bbox(cell, bbox, margin=INTERIOR_MARGIN):
+    minx, miny, maxx, maxy = bbox
+    # boundary vertices as (lat, lon)
+    for lat, lon in h3.h3_to_geo_boundary(cell):
+        if not (minx + margin < lon < maxx - margin and miny + margin < lat < maxy - margin):
+            return False
+    return True
+
+
+def interior_cells(bbox, resolution, margin=INTERIOR_MARGIN):
+    """
+    cells lying entirely inside the bbox, i.e. every point in these cells also
+    satisfies the bbox predicate
+
+    :return: sorted list of H3 indexes
+    """
+    candidates = h3.polyfill(bbox_to_geojson(bbox), resolution, geo_json_conformant=True)
+    return sorted([i for i in candidates if cell_within_bbox(i, bbox, margin)])
+
+
+def inner_bbox(bbox, resolution, margin=INTERIOR_MARGIN):
+    """
+    part of the bbox lying more than a cell's diameter from its edges. The cell
+    containing any point in it lies entirely inside the bbox, so every point of
+    the inner bbox is in one of interior_cells(bbox, resolution)
+
+    :return: bbox, or None if the bbox is too small or too close to a pole to have one
+    """
+    minx, miny, maxx, maxy = bbox
+    diameter = 2 * CIRCUMRADIUS_FACTOR * h3.edge_length(resolution, unit='km')
+    # longitude degrees are shortest at the latitude furthest from the equator
+    cos_lat = math.cos(math.radians(max(abs(miny), abs(maxy))))
+    if cos_lat < 0.1:
+        return None
+    dx = diameter / (KM_PER_DEGREE * cos_lat) + 2 * margin
+    dy = diameter / KM_PER_DEGREE + 2 * margin
+    inner = [minx + dx, miny + dy, maxx - dx, maxy - dy]
+    if inner[0] >= inner[2] or inner[1] >= inner[3]:
+        return None
+    return inner
+
+
+def covering_cells(bbox, resolution=PARTITION_RESOLUTION, step=COVERING_STEP):
+    """
+    cells containing any point of the bbox, i.e. every point satisfying the bbox
+    predicate lies in one of these cells. Samples a grid of points over the bbox
+    and buffers their cells by one ring of neighbors so that points between the
+    samples (and on the bbox edges) are always covered
+
+    :return: sorted list of H3 indexes
+    """
+    minx, miny, maxx, maxy = bbox
+    columns = max(1, math.ceil((maxx - minx) / step))
+    rows = max(1, math.ceil((maxy - miny) / step))
+    cells = set()
+    for i in range(columns + 1):
+        lon = minx + (maxx - minx) * i / columns
+        for j in range(rows + 1):
+            lat = miny + (maxy - miny) * j / rows
+            cells.add(h3.geo_to_h3(lat, lon, resolution))
+
+    buffered = set()
+    for cell in cells:
+        buffered.update(h3.k_ring(cell, 1))
+    return sorted(buffered)
+
+
+def polygon_bounds(polygon):
+    """:return: bbox of the polygon's outer ring"""
+    lons = [i[0] for i in polygon['coordinates'][0]]
+    lats = [i[1] for i in polygon['coordinates'][0]]
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+def boundary_points(polygon, step=COVERING_STEP):
+    """points along the edges of all of the polygon's rings, no more than step degrees apart"""
+    points = []
+    for ring in polygon['coordinates']:
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            count = max(1, math.ceil(max(abs(x1 - x0), abs(y1 - y0)) / step))
+            points += [(x0 + (x1 - x0) * i / count, y0 + (y1 - y0) * i / count) for i in range(count + 1)]
+    return points
+
+
+def polygon_covering_cells(polygon, resolution=PARTITION_RESOLUTION, step=COVERING_STEP):
+    """
+    cells containing any point of the polygon. The polyfill only includes the
+    fine cells whose centers lie inside the polygon, so points sampled along the
+    edges cover the remainder. As for covering_cells, the partitions of these
+    are buffered by one ring of neighbors
+
+    :return: sorted list of H3 indexes
+    """
+    cells = set([h3.h3_to_parent(i, resolution)
+                 for i in h3.polyfill(polygon, max(resolution, POLYFILL_RESOLUTION), geo_json_conformant=True)])
+    for lon, lat in boundary_points(polygon, step):
+        cells.add(h3.geo_to_h3(lat, lon, resolution))
+
+    buffered = set()
+    for cell in cells:
+        buffered.update(h3.k_ring(cell, 1))
+    return sorted(buffered)
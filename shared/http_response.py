@@ -0,0 +1,157 @@
+"""
+common handling of API responses: bodies are serialized with orjson when it is
+available, given a strong ETag so that a matching If-None-Match is answered with
+304, and compressed with brotli or gzip when the client accepts it and the body
+is large enough to benefit.
+
+Lambda handlers are wrapped with api_response and return the usual
+{'statusCode', 'headers', 'body'} dict with the body already serialized by dumps.
+"""
+import base64
+import functools
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# smaller bodies are sent uncompressed, compression would save little or even add bytes
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', default=1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(obj) -> str:
+    """:return: compact JSON for the object"""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(obj, separators=(',', ':'))
+
+
+def request_header(event, name):
+    # HTTP API payload v2 lowercases header names, a REST API payload may not
+    headers = event.get('headers') or {}
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def accepted_encodings(event) -> set[str]:
+    """:return: content codings the client accepts, ignoring any with q=0"""
+    header = request_header(event, 'accept-encoding')
+    if not header:
+        return set()
+    encodings = set()
+    for item in header.split(','):
+        coding, *params = [i.strip() for i in item.split(';')]
+        try:
+            q = float(next((i[2:] for i in params if i.startswith('q=')), 1))
+        except ValueError:
+            q = 0
+        if coding and q > 0:
+            encodings.add(coding.lower())
+    return encodings
+
+
+def choose_encoding(event):
+    """:return: 'br', 'gzip' or None for the identity encoding"""
+    encodings = accepted_encodings(event)
+    if brotli and ('br' in encodings or '*' in encodings):
+        return 'br'
+    if 'gzip' in encodings or '*' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    # fixed mtime so that identical bodies compress to identical bytes
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def entity_tag(data: bytes, encoding=None) -> str:
+    """
+    strong ETag of the uncompressed body. Each content coding is a different
+    representation, so it is added as a suffix
+    """
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+
+def none_match(event, data: bytes) -> bool:
+    """:return: True if the If-None-Match header matches the body in any of its encodings"""
+    header = request_header(event, 'if-none-match')
+    if not header:
+        return False
+    digest = entity_tag(data).strip('"')
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        # weak comparison, as required for If-None-Match
+        tag = tag.removeprefix('W/').strip('"')
+        if tag == digest or tag.startswith(digest + '-'):
+            return True
+    return False
+
+
+def finalize(event, response: dict) -> dict:
+    """
+    add ETag and Content-Encoding to a handler's response, answering a matching
+    conditional GET with 304
+
+    :return: API response
+    """
+    body = response.get('body')
+    if body is None or response.get('isBase64Encoded'):
+        return response
+    if not isinstance(body, str):
+        body = dumps(body)
+    data = body.encode('utf-8')
+    headers = dict(response.get('headers') or {})
+
+    encoding = choose_encoding(event) if len(data) >= COMPRESSION_MIN_BYTES else None
+    if len(data) >= COMPRESSION_MIN_BYTES:
+        headers['Vary'] = 'Accept-Encoding'
+
+    # only complete results are cacheable, not pending jobs or errors
+    if response.get('statusCode') == 200:
+        headers['ETag'] = entity_tag(data, encoding)
+        method = (event.get('requestContext') or {}).get('http', {}).get('method', 'GET')
+        if method in ['GET', 'HEAD'] and none_match(event, data):
+            return {'statusCode': 304, 'headers': headers, 'body': ''}
+
+    if encoding is None:
+        return response | {'headers': headers, 'body': body}
+
+    compressed = compress(data, encoding)
+    logger.debug(f'compressed {len(data)} bytes to {len(compressed)} with {encoding}')
+    headers['Content-Encoding'] = encoding
+    return response | {
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def api_response(handler):
+    """decorator applying finalize to the responses of a Lambda handler"""
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        return finalize(event, handler(event, context))
+    return wrapper
@@ -0,0 +1,101 @@
+"""
+classify orders by an estimate of the number of points they extract, so that
+small orders are not queued behind continental-scale ones. The estimate is made
+before the extract is started, without an Athena query:
+ - from the count cube when available, counting the cube cells and months
+   enclosing the bbox and collection dates. Filters the cube does not support
+   are left out, so the count is an upper bound
+ - otherwise from the bytes the extract is estimated to scan (see scan_estimate)
+
+Each dataset's extract is sized by size_order, and small extracts run with their
+own slots (see query_governor). An order is small when the total of its datasets
+is, and none of them is multibeam or of unknown size, see verify_dataset_status.
+Small orders are gridded from a separate queue, which the grid worker checks
+before the queue of other orders. Large extracts are split into parts by
+format_point_query according to the bytes they read.
+"""
+import logging
+import math
+import os
+from datetime import date
+
+from query_governor import EXTRACT, SMALL_EXTRACT
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+SMALL = 'small'
+STANDARD = 'standard'
+
+SMALL_ORDER_POINTS = int(os.getenv('SMALL_ORDER_POINTS', default=1_000_000))
+# approximate size of a point in the Parquet point table
+BYTES_PER_POINT = int(os.getenv('BYTES_PER_POINT', default=12))
+
+QUERY_CLASSES = {
+    SMALL: SMALL_EXTRACT,
+    STANDARD: EXTRACT
+}
+
+
+def month_start(datestring, months_after=0):
+    """:return: YYYY-MM-DD first of the month of the date, or a later month, None if the date is invalid"""
+    try:
+        year, month, _ = [int(i) for i in datestring.split('-')]
+        month += months_after
+        return date(year + (month - 1) // 12, (month - 1) % 12 + 1, 1).isoformat()
+    except (ValueError, AttributeError):
+        return None
+
+
+def cube_filters(bbox, filters, cell_size):
+    """
+    filters the count cube supports which match every point matching the order's
+
+    :param filters: in the format of the API query parameters, names as lists or strings
+    """
+    minx, miny, maxx, maxy = bbox
+    outer = [math.floor(minx / cell_size) * cell_size, math.floor(miny / cell_size) * cell_size,
+             math.ceil(maxx / cell_size) * cell_size, math.ceil(maxy / cell_size) * cell_size]
+    supported = {'bbox': ','.join([str(float(i)) for i in outer])}
+    for name in ['platforms', 'providers']:
+        if name in filters:
+            values = filters[name]
+            supported[name] = ','.join(values) if isinstance(values, list) else values
+    # the cube's end month is exclusive
+    start = month_start(filters.get('collection_date_start'))
+    end = month_start(filters.get('collection_date_end'), months_after=1)
+    if start:
+        supported['collection_date_start'] = start
+    if end:
+        supported['collection_date_end'] = end
+    return supported
+
+
+def estimate_points(bbox, filters, cube=None, scan_estimate=None):
+    """:return: tuple of (estimated point count, method), (None, None) when no estimate can be made"""
+    if cube is not None:
+        supported = cube_filters(bbox, filters, cube.cell_size)
+        if cube.supports(supported):
+            return cube.count_points(supported), 'count_cube'
+    if scan_estimate is not None:
+        return scan_estimate['bytes'] // BYTES_PER_POINT, 'scan_manifest'
+    return None, None
+
+
+def size_class(points):
+    """orders of unknown size are not treated as small"""
+    if points is not None and points < SMALL_ORDER_POINTS:
+        return SMALL
+    return STANDARD
+
+
+def classify(bbox, filters, cube=None, scan_estimate=None):
+    """:return: dict with the size class, estimated points and the extract's query class"""
+    points, method = estimate_points(bbox, filters, cube, scan_estimate)
+    size = size_class(points)
+    return {
+        'size_class': size,
+        'estimated_points': points,
+        'estimate_method': method,
+        'query_class': QUERY_CLASSES[size]
+    }
@@ -0,0 +1,102 @@
+"""
+prefix search over platform names for type-ahead, built from the platform
+catalog snapshot written by build_platform_catalog. Names are indexed
+case-insensitively at the start of each word, so "atl" finds "Ramform Atlas".
+Keys are held in sorted lists and searched with bisect, no Athena query is made.
+"""
+import bisect
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# runs of letters and digits
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+def normalize(text):
+    """case-folded with whitespace collapsed"""
+    return ' '.join(str(text).casefold().split())
+
+
+def prefix_range(keys, prefix):
+    """:return: slice bounds of the sorted keys starting with prefix"""
+    start = bisect.bisect_left(keys, prefix)
+    end = bisect.bisect_left(keys, prefix[:-1] + chr(ord(prefix[-1]) + 1), lo=start)
+    return start, end
+
+
+class PlatformIndex:
+    def __init__(self, platforms):
+        """
+        :param platforms: list of dicts with provider and platform, e.g. the catalog's platforms
+        """
+        self.platforms = [(i['provider'], i['platform']) for i in platforms]
+        # whole names, matched first, and the remainder of the name from each later word
+        names = []
+        words = []
+        for n, (_, platform) in enumerate(self.platforms):
+            name = normalize(platform)
+            names.append((name, n))
+            for match in TOKEN_PATTERN.finditer(name):
+                if match.start() > 0:
+                    words.append((name[match.start():], n))
+        names.sort()
+        words.sort()
+        self.name_keys = [i[0] for i in names]
+        self.name_ids = [i[1] for i in names]
+        self.word_keys = [i[0] for i in words]
+        self.word_ids = [i[1] for i in words]
+
+    def __len__(self):
+        return len(self.platforms)
+
+    def search(self, prefix, limit=DEFAULT_LIMIT, providers=None):
+        """
+        platforms whose name, or a word within it, starts with the prefix. Names
+        starting with the prefix come first, each group in alphabetical order
+
+        :param providers: optional collection of providers to limit the results to
+        :return: list of dicts with provider and platform
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = []
+        seen = set()
+        for keys, ids in [(self.name_keys, self.name_ids), (self.word_keys, self.word_ids)]:
+            start, end = prefix_range(keys, prefix)
+            for n in ids[start:end]:
+                if n in seen or (providers and self.platforms[n][0] not in providers):
+                    continue
+                seen.add(n)
+                found.append(n)
+                if len(found) >= limit:
+                    break
+            if len(found) >= limit:
+                break
+        return [{'provider': self.platforms[n][0], 'platform': self.platforms[n][1]} for n in found]
+
+
+class CatalogIndex:
+    """PlatformIndex of a catalog snapshot, rebuilt when a new version of the catalog is loaded"""
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.catalog = None
+        self.index = None
+
+    def get(self):
+        """:return: PlatformIndex, or None if the catalog is unavailable"""
+        catalog = self.snapshot.get()
+        if catalog is None:
+            return None
+        # the snapshot returns the same object until the catalog changes
+        if catalog is not self.catalog:
+            self.index = PlatformIndex(catalog['platforms'])
+            self.catalog = catalog
+            logger.info(f"indexed {len(self.index)} platforms from catalog created {catalog.get('created')}")
+        return self.index
@@ -0,0 +1,282 @@
+"""
+construct WHERE clauses for point table queries from request filters. Clauses
+use ? placeholders with the values returned separately, in placeholder order,
+for use as Athena ExecutionParameters (see athena_query.start_query). The SQL
+text therefore depends only on which filters are present and how many values
+each has, never on the values themselves.
+
+Filters use the format of the API query parameters, e.g.
+    {'bbox': '-97,27,-90,30', 'platforms': 'Ramform Vanguard,Anonymous', 'collection_date_start': '2023-08-01'}
+Lists of platforms or providers may also be given as lists. A polygon filter is
+a GeoJSON Polygon geometry, either as a dict or its JSON string.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+from h3_cells import covering_cells, polygon_covering_cells, polygon_bounds, MAX_PARTITION_CELLS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+date_pattern = re.compile("^[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}$")
+DATE_FILTERS = ['collection_date_start', 'collection_date_end', 'archive_date_start', 'archive_date_end']
+# limits the length of the SQL statement
+MAX_POLYGON_VERTICES = 1000
+# WARNING: hardcoded dependency on Glue table schema
+POINT_COLUMNS = ['lon', 'lat', 'depth', 'time', 'platform_name', 'provider', 'unique_id', 'file_uuid']
+COMPACT_COLUMNS = ['lon', 'lat', 'depth', 'time']
+
+
+def placeholders(count):
+    return ', '.join(['?'] * count)
+
+
+def valid_bbox(coords: list[float]):
+    if len(coords) != 4:
+        return False
+    if coords[0] < -180 or coords[0] > 180 or coords[2] < -180 or coords[2] > 180:
+        return False
+    if coords[1] < -90 or coords[1] > 90 or coords[3] < -90 or coords[3] > 90:
+        return False
+    # crosses antimeridian
+    if coords[0] >= coords[2]:
+        return False
+    if coords[1] == coords[3]:
+        return False
+
+    return True
+
+
+def parse_bbox(bbox_string: str) -> list[float]:
+    try:
+        coords = [float(i.strip()) for i in bbox_string.split(',')]
+    except ValueError as e:
+        raise IllegalArgumentException('invalid bbox coordinates: non-numeric values')
+    if not valid_bbox(coords):
+        raise IllegalArgumentException('invalid bbox coordinates: out of range or crosses antimeridian')
+    return coords
+
+
+def orientation(p, q, r):
+    """:return: 1 if p, q, r turn counterclockwise, -1 if clockwise, 0 if collinear"""
+    value = (q[0] - p[0]) * (r[1] - p[1]) - (q[1] - p[1]) * (r[0] - p[0])
+    return (value > 0) - (value < 0)
+
+
+def segments_intersect(a, b, c, d):
+    """whether segment ab touches segment cd"""
+    o1, o2, o3, o4 = orientation(a, b, c), orientation(a, b, d), orientation(c, d, a), orientation(c, d, b)
+    if o1 != o2 and o3 != o4:
+        return True
+
+    def on_segment(p, q, r):
+        # r collinear with pq
+        return min(p[0], q[0]) <= r[0] <= max(p[0], q[0]) and min(p[1], q[1]) <= r[1] <= max(p[1], q[1])
+
+    return (o1 == 0 and on_segment(a, b, c)) or (o2 == 0 and on_segment(a, b, d)) or \
+        (o3 == 0 and on_segment(c, d, a)) or (o4 == 0 and on_segment(c, d, b))
+
+
+def self_intersects(ring) -> bool:
+    """whether any two edges of the closed ring cross or touch, other than adjacent edges at their shared vertex"""
+    edges = list(zip(ring[:-1], ring[1:]))
+    bounds = [(min(p[0], q[0]), min(p[1], q[1]), max(p[0], q[0]), max(p[1], q[1])) for p, q in edges]
+    for i in range(len(edges)):
+        minx, miny, maxx, maxy = bounds[i]
+        # adjacent edges, including the last and first, share a vertex
+        for j in range(i + 2, len(edges) - (1 if i == 0 else 0)):
+            # most pairs are far apart
+            if bounds[j][0] > maxx or bounds[j][2] < minx or bounds[j][1] > maxy or bounds[j][3] < miny:
+                continue
+            if segments_intersect(*edges[i], *edges[j]):
+                return True
+    return False
+
+
+def parse_polygon(value) -> dict:
+    """
+    validate a GeoJSON Polygon given as a dict or JSON string. Like bboxes,
+    polygons may not cross the antimeridian
+
+    :return: Polygon geometry with float coordinates
+    """
+    try:
+        polygon = json.loads(value) if isinstance(value, str) else value
+        if polygon['type'] != 'Polygon':
+            raise IllegalArgumentException('invalid polygon: geometry must be a Polygon')
+        rings = [[[float(x), float(y)] for x, y in ring] for ring in polygon['coordinates']]
+    except (TypeError, ValueError, KeyError):
+        raise IllegalArgumentException('invalid polygon: must be a GeoJSON Polygon')
+
+    if not rings or sum([len(i) for i in rings]) > MAX_POLYGON_VERTICES:
+        raise IllegalArgumentException(f'invalid polygon: must have 1 to {MAX_POLYGON_VERTICES} vertices')
+    for ring in rings:
+        if len(ring) < 4 or ring[0] != ring[-1]:
+            raise IllegalArgumentException('invalid polygon: rings must be closed with at least 4 positions')
+        if not all(-180 <= x <= 180 and -90 <= y <= 90 for x, y in ring):
+            raise IllegalArgumentException('invalid polygon: coordinates out of range')
+        # Athena's ST_Contains gives no useful answer for an invalid polygon
+        if self_intersects(ring):
+            raise IllegalArgumentException('invalid polygon: rings must not intersect themselves')
+
+    polygon = {'type': 'Polygon', 'coordinates': rings}
+    minx, miny, maxx, maxy = polygon_bounds(polygon)
+    if maxx - minx >= 180 or minx == maxx or miny == maxy:
+        raise IllegalArgumentException('invalid polygon: crosses the antimeridian or has no area')
+    return polygon
+
+
+def polygon_to_wkt(polygon: dict) -> str:
+    rings = ['(' + ', '.join([f'{x!r} {y!r}' for x, y in ring]) + ')' for ring in polygon['coordinates']]
+    return f"POLYGON ({', '.join(rings)})"
+
+
+def partition_clause(*areas, column='h3'):
+    """
+    predicate on the point table's H3 partition column which lets Athena skip the
+    partitions lying outside of the areas, each either a bbox or a GeoJSON Polygon
+
+    :return: tuple of (SQL, parameters) or None if the areas cover too much of the globe to benefit
+    """
+    cells = set()
+    for area in areas:
+        cells.update(polygon_covering_cells(area) if isinstance(area, dict) else covering_cells(area))
+    if len(cells) > MAX_PARTITION_CELLS:
+        return None
+    cells = sorted(cells)
+    return f"{column} in ({placeholders(len(cells))})", cells
+
+
+def bbox_to_where_clause(coords: list[float], h3_clause=None) -> tuple[list[str], list]:
+    """
+    :param h3_clause: partition predicate to use in place of the one for the bbox
+    """
+    minx, miny, maxx, maxy = coords
+    where_clauses = [
+        "(lon > ? and lon < ?)",
+        "(lat > ? and lat < ?)"
+    ]
+    params = [minx, maxx, miny, maxy]
+    # lets Athena skip the H3 partitions outside of the bbox
+    h3_clause = h3_clause or partition_clause(coords)
+    if h3_clause:
+        where_clauses.append(h3_clause[0])
+        params += h3_clause[1]
+    return where_clauses, params
+
+
+def polygon_to_where_clause(polygon: dict) -> tuple[list[str], list]:
+    """
+    bbox and partition predicates narrow the scan before the exact point in
+    polygon test. The WKT is built from validated numbers and is left in the SQL
+    since it may exceed the length allowed for an execution parameter
+    """
+    where_clauses, params = bbox_to_where_clause(polygon_bounds(polygon), partition_clause(polygon))
+    where_clauses.append(f"ST_Contains(ST_GeometryFromText('{polygon_to_wkt(polygon)}'), ST_Point(lon, lat))")
+    return where_clauses, params
+
+
+def names_list(value):
+    if isinstance(value, list):
+        return value
+    return value.split(',')
+
+
+def parse_date(value: str) -> str:
+    """
+    :return: the value if it is a valid date in YYYY-MM-DD format
+    """
+    try:
+        if not date_pattern.match(value):
+            raise ValueError(value)
+        datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise IllegalArgumentException(f'invalid date: {value}, must be in YYYY-MM-DD format')
+    return value
+
+
+def validate_dates(filters: dict):
+    """raise IllegalArgumentException if any of the date filters is not a valid date"""
+    for i in DATE_FILTERS:
+        if filters.get(i):
+            parse_date(filters[i])
+
+
+def date_range_clause(column, start, end):
+    """
+    dates are inclusive. Either start, end, or both may be specified. Values not
+    in YYYY-MM-DD format raise IllegalArgumentException rather than widening the query
+
+    :return: tuple of (list of zero or one SQL clauses, parameters)
+    """
+    start = parse_date(start) if start else ''
+    end = parse_date(end) if end else ''
+
+    if start and end:
+        return [f"({column} >= date(?) and {column} <= date(?))"], [start, end]
+    elif start:
+        return [f"{column} >= date(?)"], [start]
+    elif end:
+        return [f"{column} <= date(?)"], [end]
+    return [], []
+
+
+def filters_to_where_clause(filters: dict) -> tuple[list[str], list]:
+    """
+    :return: tuple of (list of SQL clauses to be combined with "and", parameters in placeholder order)
+    """
+    where_clauses = []
+    params = []
+
+    def add(clauses, values):
+        where_clauses.extend(clauses)
+        params.extend(values)
+
+    if 'bbox' in filters:
+        try:
+            add(*bbox_to_where_clause(parse_bbox(filters['bbox'])))
+        except IllegalArgumentException as e:
+            logger.warning(str(e))
+
+    if 'polygon' in filters:
+        try:
+            add(*polygon_to_where_clause(parse_polygon(filters['polygon'])))
+        except IllegalArgumentException as e:
+            logger.warning(str(e))
+
+    if 'platforms' in filters:
+        platforms = names_list(filters['platforms'])
+        add([f'platform_name in ({placeholders(len(platforms))})'], platforms)
+
+    if 'providers' in filters:
+        providers = names_list(filters['providers'])
+        add([f'provider in ({placeholders(len(providers))})'], providers)
+
+    if 'collection_date_start' in filters or 'collection_date_end' in filters:
+        add(*date_range_clause('time', filters.get('collection_date_start'), filters.get('collection_date_end')))
+
+    # archive date is in UTC and represented as UNIX timestamp
+    if 'archive_date_start' in filters or 'archive_date_end' in filters:
+        add(*date_range_clause('entry_date', filters.get('archive_date_start'), filters.get('archive_date_end')))
+
+    if 'unique_id' in filters:
+        add(['unique_id = ?'], [filters['unique_id']])
+
+    if 'file_uuid' in filters:
+        add(['file_uuid = ?'], [filters['file_uuid']])
+
+    return where_clauses, params
+
+
+def where(where_clauses: list[str]) -> str:
+    """WHERE clause (with leading space) combining the clauses, or an empty string if there are none"""
+    if not where_clauses:
+        return ''
+    return f" where {' and '.join(where_clauses)}"
+
+
+class IllegalArgumentException(Exception):
+    pass
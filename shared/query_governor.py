@@ -0,0 +1,127 @@
+"""
+limit the number of Athena queries running at once per class of query, so bulk
+work cannot crowd out interactive requests. Each class has a fixed number of
+slots, each a lease in the same store used by single_flight. A query takes any
+free slot and releases it once complete; slots held by a caller that never
+released them (e.g. its Lambda timed out) become free when their lease expires.
+
+Interactive requests finding every slot taken are answered right away with 429
+and Retry-After rather than queuing behind Athena until the API times out.
+Order extracts take an 'extract' slot from the state machine, which retries
+until one is free. Small orders (see order_size) take a 'small_extract' slot
+instead so they do not queue behind continental-scale extracts. Asynchronous
+API jobs take an 'async_job' slot, released when the job is next polled after
+the query completes. Jobs which are never polled cannot hold the slots orders
+need, and give theirs up when the lease expires.
+
+Errors talking to the lease store are logged and the query runs ungoverned.
+"""
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+INTERACTIVE = 'interactive'
+EXTRACT = 'extract'
+SMALL_EXTRACT = 'small_extract'
+ASYNC_JOB = 'async_job'
+
+# together within the account's limit on concurrent DML queries
+QUERY_LIMITS = {
+    INTERACTIVE: int(os.getenv('INTERACTIVE_QUERY_LIMIT', default=15)),
+    EXTRACT: int(os.getenv('EXTRACT_QUERY_LIMIT', default=5)),
+    SMALL_EXTRACT: int(os.getenv('SMALL_EXTRACT_QUERY_LIMIT', default=3)),
+    ASYNC_JOB: int(os.getenv('ASYNC_JOB_QUERY_LIMIT', default=2))
+}
+# longest a slot is held when not released, covering the API timeout for
+# interactive queries and the Athena query timeout for extracts
+LEASE_SECONDS = {
+    INTERACTIVE: 60,
+    EXTRACT: 60 * 60,
+    SMALL_EXTRACT: 60 * 60,
+    # Athena's default DML query timeout
+    ASYNC_JOB: 30 * 60
+}
+# suggested wait before retrying a throttled request, in seconds
+RETRY_AFTER = {
+    INTERACTIVE: 2,
+    EXTRACT: 15,
+    SMALL_EXTRACT: 5,
+    ASYNC_JOB: 15
+}
+
+
+def slot_key(query_class, n):
+    return f'slot-{query_class}-{n}'
+
+
+class QueryGovernor:
+    def __init__(self, store, limits=None, lease_seconds=None, clock=time.time, rng=random):
+        """
+        :param store: DynamoDBLeaseStore or MemoryLeaseStore
+        :param limits: optional dict of the number of slots per query class
+        """
+        self.store = store
+        self.limits = QUERY_LIMITS | (limits or {})
+        self.lease_seconds = LEASE_SECONDS | (lease_seconds or {})
+        self.clock = clock
+        self.rng = rng
+
+    def acquire(self, query_class):
+        """
+        take a free slot, trying them in random order so callers seldom contend for the same one
+
+        :return: dict identifying the slot, to be passed to release. None if the store is unavailable
+        :raises ConcurrencyLimitException: if every slot is taken
+        """
+        token = str(uuid.uuid4())
+        slots = list(range(self.limits[query_class]))
+        self.rng.shuffle(slots)
+        try:
+            for n in slots:
+                now = self.clock()
+                if self.store.claim(slot_key(query_class, n), token, now + self.lease_seconds[query_class], now):
+                    return {'key': slot_key(query_class, n), 'token': token}
+        except Exception as e:
+            logger.warning(f'unable to govern {query_class} query: {e}')
+            return None
+        raise ConcurrencyLimitException(query_class, RETRY_AFTER[query_class])
+
+    def release(self, slot):
+        if slot is None:
+            return
+        try:
+            self.store.release(slot['key'], slot['token'])
+        except Exception as e:
+            logger.warning(f"unable to release slot {slot['key']}: {e}")
+
+    @contextmanager
+    def slot(self, query_class):
+        """hold a slot for the duration of the with block"""
+        slot = self.acquire(query_class)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+
+def throttled_response(e):
+    """:return: API response telling the client to retry once a slot may be free"""
+    return {
+        'statusCode': 429,
+        'headers': {'Retry-After': str(e.retry_after)},
+        'body': json.dumps({'message': 'too many queries in progress, retry shortly'})
+    }
+
+
+class ConcurrencyLimitException(Exception):
+    def __init__(self, query_class, retry_after):
+        super().__init__(f'all {query_class} query slots are in use')
+        self.query_class = query_class
+        self.retry_after = retry_after
@@ -0,0 +1,168 @@
+"""
+asynchronous query jobs for the Athena-backed API endpoints. The request starts
+the query and returns 202 with a job id right away; clients then poll the job
+until the result is available. The result is stored with the job when first
+retrieved so polling never re-runs the query.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+import boto3
+
+from query_stats import record_execution
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# jobs (and their results) are removed a day after creation
+JOB_TTL_IN_SECONDS = 24 * 60 * 60
+# suggested wait between polls, in seconds
+RETRY_AFTER = 5
+
+
+def is_async_request(event):
+    query_params = event.get('queryStringParameters') or {}
+    return query_params.get('async', '').lower() == 'true'
+
+
+def job_url(event, job_id):
+    # construct endpoint URL as done for orders, e.g. https://<host>/count/jobs/<job_id>
+    return f"https://{event['headers']['host']}{event['rawPath']}/jobs/{job_id}"
+
+
+def submit_job(store, event, endpoint, query_execution_id, cache_key=None, params=None, tags=None, slot=None):
+    """
+    record a new job for a started query
+
+    :param params: optional dict of keyword arguments passed to fetch_results along with the QueryExecutionId
+    :param tags: optional dict of query_stats tags, the query's Statistics are recorded with them once it completes
+    :param slot: optional query_governor slot held by the query, released once it completes
+    :return: API response with 202 status
+    """
+    job_id = str(uuid.uuid4())
+    job = {
+        'endpoint': endpoint,
+        'query_execution_id': query_execution_id,
+        'cache_key': cache_key,
+        'status': 'running'
+    }
+    if params:
+        job['params'] = params
+    if tags:
+        job['tags'] = tags
+    if slot:
+        job['slot'] = slot
+    store.create(job_id, job)
+    logger.info(f'created job {job_id} for query {query_execution_id}')
+
+    body = {'job_id': job_id, 'status': 'running'}
+    if 'headers' in event and 'rawPath' in event:
+        body['url'] = job_url(event, job_id)
+    return {
+        'statusCode': 202,
+        'headers': {'Retry-After': str(RETRY_AFTER)},
+        'body': json.dumps(body)
+    }
+
+
+def job_response(store, client, job_id, endpoint, fetch_results, result_cache=None, governor=None):
+    """
+    report on the given job, retrieving and storing the result once the query is complete
+
+    :param fetch_results: function taking the QueryExecutionId and returning the response body
+    :param governor: optional QueryGovernor, releases the job's slot once the query is complete
+    :return: API response
+    """
+    job = store.get(job_id)
+    if job is None or job['endpoint'] != endpoint:
+        return {
+            'statusCode': 404,
+            'body': json.dumps({'message': f'no job found for id {job_id}'})
+        }
+
+    if job['status'] == 'running':
+        response = client.get_query_execution(QueryExecutionId=job['query_execution_id'])
+        query_state = response['QueryExecution']['Status']['State']
+
+        if query_state in ['QUEUED', 'RUNNING']:
+            return {
+                'statusCode': 202,
+                'headers': {'Retry-After': str(RETRY_AFTER)},
+                'body': json.dumps({'job_id': job_id, 'status': 'running'})
+            }
+
+        if job.get('tags'):
+            record_execution(response['QueryExecution'], **job['tags'])
+        if governor:
+            governor.release(job.get('slot'))
+
+        if query_state == 'SUCCEEDED':
+            job['result'] = fetch_results(job['query_execution_id'], **job.get('params', {}))
+            job['status'] = 'complete'
+            if result_cache and job.get('cache_key'):
+                result_cache.put(job['cache_key'], job['result'])
+        else:
+            job['status'] = 'failed'
+            job['message'] = response['QueryExecution']['Status'].get('StateChangeReason', query_state)
+        store.update(job_id, job)
+
+    if job['status'] == 'failed':
+        logger.warning(f"job {job_id} failed: {job['message']}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'job_id': job_id, 'status': 'failed', 'message': 'query failed'})
+        }
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(job['result'])
+    }
+
+
+class DynamoDBJobStore:
+    """jobs stored as items in the orders table, removed by its TTL attribute"""
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+
+    def create(self, job_id, job):
+        self.table.put_item(
+            Item={
+                'PK': 'JOB#' + job_id,
+                'SK': 'JOB',
+                'job': json.dumps(job),
+                'TTL': int(time.time()) + JOB_TTL_IN_SECONDS
+            }
+        )
+
+    def get(self, job_id):
+        response = self.table.get_item(Key={'PK': 'JOB#' + job_id, 'SK': 'JOB'})
+        if 'Item' not in response:
+            return None
+        return json.loads(response['Item']['job'])
+
+    def update(self, job_id, job):
+        self.table.update_item(
+            Key={'PK': 'JOB#' + job_id, 'SK': 'JOB'},
+            UpdateExpression='SET job = :job',
+            ExpressionAttributeValues={':job': json.dumps(job)}
+        )
+
+
+class MemoryJobStore:
+    """job store substitute for local use and tests"""
+    def __init__(self):
+        self.jobs = {}
+
+    def create(self, job_id, job):
+        self.jobs[job_id] = json.dumps(job)
+
+    def get(self, job_id):
+        if job_id not in self.jobs:
+            return None
+        return json.loads(self.jobs[job_id])
+
+    def update(self, job_id, job):
+        self.jobs[job_id] = json.dumps(job)
@@ -0,0 +1,174 @@
+"""
+record the Statistics of each Athena query as a structured log line, tagged with
+the endpoint, the shape of its filters (which filters were given, not their
+values) and, for extracts, the order id. Lines are written in CloudWatch
+embedded metric format so the bytes scanned and times also become metrics per
+endpoint without any API calls, e.g.
+    {"_aws": {...}, "record_type": "athena_query", "endpoint": "count", "shape": "bbox+providers",
+     "DataScannedInBytes": 1048576, "QueryQueueTimeInMillis": 120, ...}
+
+summarize aggregates the records into cost and latency percentiles per query
+shape, see src/utils/query_stats_report.py
+"""
+import json
+import logging
+import math
+import os
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+RECORD_TYPE = 'athena_query'
+METRIC_NAMESPACE = os.getenv('QUERY_STATS_NAMESPACE', default='BathyApp/Athena')
+# Athena charges per TB scanned, with a minimum of 10 MB per query
+PRICE_PER_TB = float(os.getenv('ATHENA_PRICE_PER_TB', default=5.0))
+MIN_BILLED_BYTES = 10 * 1024 ** 2
+
+# Statistics recorded, with the unit of their metric
+METRICS = {
+    'DataScannedInBytes': 'Bytes',
+    'QueryQueueTimeInMillis': 'Milliseconds',
+    'QueryPlanningTimeInMillis': 'Milliseconds',
+    'EngineExecutionTimeInMillis': 'Milliseconds',
+    'ServiceProcessingTimeInMillis': 'Milliseconds',
+    'TotalExecutionTimeInMillis': 'Milliseconds'
+}
+DIMENSIONS = ['endpoint', 'shape']
+PERCENTILES = [50, 90, 99]
+
+
+def filter_shape(filters) -> str:
+    """:return: names of the filters given, e.g. 'bbox+providers', or 'none'"""
+    names = sorted([name for name, value in (filters or {}).items() if value not in [None, '', []]])
+    return '+'.join(names) or 'none'
+
+
+def batch_shape(filter_sets) -> str:
+    """:return: shape of a query combining several filter sets, e.g. 'batch(bbox|bbox+providers)'"""
+    return f"batch({'|'.join(sorted(set([filter_shape(i) for i in filter_sets])))})"
+
+
+def statistics_record(query_execution_id, state, statistics, **tags) -> dict:
+    """
+    :param statistics: Statistics from the QueryExecution, possibly incomplete for a query that did not finish
+    :param tags: endpoint, shape, order_id and any other properties of the query
+    """
+    statistics = statistics or {}
+    record = {
+        'record_type': RECORD_TYPE,
+        'query_execution_id': query_execution_id,
+        'state': state
+    }
+    record.update({name: value for name, value in tags.items() if value is not None})
+    for name in METRICS:
+        if name in statistics:
+            record[name] = int(statistics[name])
+    reuse = statistics.get('ResultReuseInformation')
+    if reuse is not None:
+        record['ReusedPreviousResult'] = bool(reuse.get('ReusedPreviousResult'))
+    return record
+
+
+def embedded_metrics(record, timestamp=None) -> dict:
+    """:return: the record with the embedded metric format metadata"""
+    dimensions = [i for i in DIMENSIONS if i in record]
+    return record | {
+        '_aws': {
+            'Timestamp': int((timestamp or time.time()) * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRIC_NAMESPACE,
+                'Dimensions': [dimensions],
+                'Metrics': [{'Name': name, 'Unit': unit} for name, unit in METRICS.items() if name in record]
+            }]
+        }
+    }
+
+
+def record_query(query_execution_id, state, statistics, emit=print, **tags):
+    """
+    write the statistics of a query. Failures are logged rather than raised
+    since the statistics are not essential to the request
+
+    :return: the record, or None if it could not be written
+    """
+    try:
+        record = statistics_record(query_execution_id, state, statistics, **tags)
+        # printed since the embedded metric format requires the JSON on a line of its own
+        emit(json.dumps(embedded_metrics(record), default=str))
+        return record
+    except Exception as e:
+        logger.warning(f'failed to record statistics of query {query_execution_id}: {e}')
+        return None
+
+
+def record_execution(query_execution, emit=print, **tags):
+    """record_query for a QueryExecution structure as returned by GetQueryExecution"""
+    return record_query(query_execution.get('QueryExecutionId'), query_execution.get('Status', {}).get('State'),
+                        query_execution.get('Statistics'), emit=emit, **tags)
+
+
+def parse_records(lines):
+    """
+    read the records from log lines, e.g. exported from CloudWatch Logs with a
+    timestamp before the JSON. Each query is counted once, although several
+    requests may have waited on it
+
+    :return: list of records
+    """
+    records = {}
+    for line in lines:
+        start = line.find('{')
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if not isinstance(record, dict) or record.get('record_type') != RECORD_TYPE:
+            continue
+        record.pop('_aws', None)
+        records.setdefault(record.get('query_execution_id'), record)
+    return list(records.values())
+
+
+def percentile(values, p):
+    """nearest-rank percentile, or None for no values"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def query_cost(record) -> float:
+    """:return: estimated cost in dollars, zero for a reused result"""
+    if record.get('ReusedPreviousResult') or 'DataScannedInBytes' not in record:
+        return 0.0
+    return max(record['DataScannedInBytes'], MIN_BILLED_BYTES) / 1024 ** 4 * PRICE_PER_TB
+
+
+def summarize(records, keys=('endpoint', 'shape')) -> list[dict]:
+    """
+    aggregate records by the given tags
+
+    :return: list of dicts with the query count, bytes scanned, cost and time
+        percentiles per group, most expensive first
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple([record.get(i) for i in keys]), []).append(record)
+
+    summaries = []
+    for group, members in groups.items():
+        summary = dict(zip(keys, group))
+        summary['queries'] = len(members)
+        summary['failed'] = len([i for i in members if i.get('state') != 'SUCCEEDED'])
+        summary['reused'] = len([i for i in members if i.get('ReusedPreviousResult')])
+        summary['DataScannedInBytes'] = sum([i.get('DataScannedInBytes', 0) for i in members])
+        summary['cost'] = sum([query_cost(i) for i in members])
+        for name in ['TotalExecutionTimeInMillis', 'QueryQueueTimeInMillis', 'EngineExecutionTimeInMillis']:
+            values = [i[name] for i in members if name in i]
+            for p in PERCENTILES:
+                summary[f'{name}_p{p}'] = percentile(values, p)
+        summaries.append(summary)
+    return sorted(summaries, key=lambda i: i['cost'], reverse=True)
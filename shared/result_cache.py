@@ -0,0 +1,263 @@
+"""
+two-tier cache for API query results. An in-process LRU survives across warm
+invocations of the same Lambda container and is backed by items in the orders
+DynamoDB table, which expire via the table's TTL attribute.
+
+Entries are keyed on a canonical form of the request filters so equivalent
+requests (different ordering of names, excess coordinate precision, unpadded
+dates) share a single entry.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import boto3
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+CACHE_TTL_IN_SECONDS = int(os.getenv('RESULT_CACHE_TTL', default=3600))
+CACHE_MAX_ENTRIES = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', default=256))
+# approx 11m at the equator
+COORDINATE_PRECISION = 4
+
+LIST_FILTERS = ['platforms', 'providers']
+DATE_FILTERS = ['collection_date_start', 'collection_date_end', 'archive_date_start', 'archive_date_end']
+OTHER_FILTERS = ['unique_id']
+
+
+def normalize_bbox(bbox_string):
+    try:
+        coords = [round(float(i.strip()), COORDINATE_PRECISION) for i in bbox_string.split(',')]
+    except ValueError:
+        # leave it to the SQL generation to reject
+        return bbox_string
+    return ','.join([str(i) for i in coords])
+
+
+def normalize_polygon(polygon):
+    """compact GeoJSON with the coordinates rounded as for a bbox"""
+    try:
+        polygon = json.loads(polygon) if isinstance(polygon, str) else polygon
+        coordinates = [[[round(float(x), COORDINATE_PRECISION), round(float(y), COORDINATE_PRECISION)] for x, y in ring]
+                       for ring in polygon['coordinates']]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        # leave it to the SQL generation to reject
+        return polygon
+    return json.dumps({'type': polygon.get('type'), 'coordinates': coordinates}, separators=(',', ':'))
+
+
+def normalize_date(datestring):
+    parts = datestring.split('-')
+    if len(parts) != 3 or not all(i.isdigit() for i in parts):
+        return datestring
+    return f'{int(parts[0]):04d}-{int(parts[1]):02d}-{int(parts[2]):02d}'
+
+
+def normalize_filters(filters):
+    """
+    canonical form of the URL query parameters used as filters. Unrecognized
+    parameters are dropped since they do not affect the query
+
+    :return: dict in the same format as the query parameters
+    """
+    if not filters:
+        return {}
+
+    normalized = {}
+    if 'bbox' in filters:
+        normalized['bbox'] = normalize_bbox(filters['bbox'])
+
+    if 'polygon' in filters:
+        normalized['polygon'] = normalize_polygon(filters['polygon'])
+
+    for name in LIST_FILTERS:
+        if name in filters:
+            values = sorted(set([i.strip() for i in filters[name].split(',')]))
+            normalized[name] = ','.join(values)
+
+    for name in DATE_FILTERS:
+        if name in filters:
+            normalized[name] = normalize_date(filters[name].strip())
+
+    for name in OTHER_FILTERS:
+        if name in filters:
+            normalized[name] = filters[name].strip()
+
+    return normalized
+
+
+def cache_key(endpoint, filters):
+    canonical = json.dumps({'endpoint': endpoint, 'filters': filters}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def cache_headers(age, ttl_in_seconds=CACHE_TTL_IN_SECONDS):
+    """HTTP headers telling the client how old the result is and how long it remains valid"""
+    return {
+        'Cache-Control': f'public, max-age={max(ttl_in_seconds - age, 0)}',
+        'Age': str(age)
+    }
+
+
+class ResultCache:
+    """in-process LRU in front of a shared store. Values must be JSON serializable"""
+    def __init__(self, store=None, max_entries=CACHE_MAX_ENTRIES, ttl_in_seconds=CACHE_TTL_IN_SECONDS, clock=time.time):
+        self.store = store
+        self.max_entries = max_entries
+        self.ttl_in_seconds = ttl_in_seconds
+        self.clock = clock
+        # key -> (value, created)
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        :return: tuple of (value, age in seconds), or None if not cached or expired
+        """
+        now = self.clock()
+        if key in self.entries:
+            value, created = self.entries[key]
+            if now - created < self.ttl_in_seconds:
+                self.entries.move_to_end(key)
+                return value, int(now - created)
+            del self.entries[key]
+
+        if self.store is None:
+            return None
+
+        try:
+            item = self.store.get(key)
+        except Exception as e:
+            # cache is an optimization, never fail the request because of it
+            logger.warning(f'unable to read from result cache: {e}')
+            return None
+        if item is None:
+            return None
+
+        value, created = item
+        if now - created >= self.ttl_in_seconds:
+            return None
+        self._remember(key, value, created)
+        return value, int(now - created)
+
+    def put(self, key, value):
+        created = self.clock()
+        self._remember(key, value, created)
+        if self.store is None:
+            return
+        try:
+            self.store.put(key, value, created, created + self.ttl_in_seconds)
+        except Exception as e:
+            logger.warning(f'unable to write to result cache: {e}')
+
+    def get_many(self, keys):
+        """
+        :return: dict of key to (value, age in seconds) for the keys cached and not expired
+        """
+        now = self.clock()
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.entries and now - self.entries[key][1] < self.ttl_in_seconds:
+                self.entries.move_to_end(key)
+                value, created = self.entries[key]
+                found[key] = (value, int(now - created))
+            else:
+                missing.append(key)
+
+        if self.store is None or not missing:
+            return found
+        try:
+            items = self.store.get_many(missing)
+        except Exception as e:
+            logger.warning(f'unable to read from result cache: {e}')
+            return found
+        for key, (value, created) in items.items():
+            if now - created < self.ttl_in_seconds:
+                self._remember(key, value, created)
+                found[key] = (value, int(now - created))
+        return found
+
+    def put_many(self, values):
+        """:param values: dict of key to value"""
+        created = self.clock()
+        for key, value in values.items():
+            self._remember(key, value, created)
+        if self.store is None or not values:
+            return
+        try:
+            self.store.put_many(values, created, created + self.ttl_in_seconds)
+        except Exception as e:
+            logger.warning(f'unable to write to result cache: {e}')
+
+    def _remember(self, key, value, created):
+        self.entries[key] = (value, created)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class DynamoDBCacheStore:
+    """cached results stored as items in the orders table, removed by its TTL attribute"""
+    def __init__(self, table_name):
+        self.dynamodb = boto3.resource('dynamodb')
+        self.table = self.dynamodb.Table(table_name)
+
+    def get(self, key):
+        response = self.table.get_item(Key={'PK': 'CACHE#' + key, 'SK': 'RESULT'})
+        if 'Item' not in response:
+            return None
+        item = response['Item']
+        return json.loads(item['body']), float(item['created'])
+
+    def get_many(self, keys):
+        found = {}
+        # BatchGetItem reads at most 100 items per request
+        for i in range(0, len(keys), 100):
+            response = self.dynamodb.batch_get_item(RequestItems={
+                self.table.name: {'Keys': [{'PK': 'CACHE#' + key, 'SK': 'RESULT'} for key in keys[i:i + 100]]}
+            })
+            # unprocessed keys are left as misses
+            for item in response['Responses'].get(self.table.name, []):
+                found[item['PK'][len('CACHE#'):]] = json.loads(item['body']), float(item['created'])
+        return found
+
+    def put(self, key, value, created, expires):
+        self.table.put_item(Item=self._item(key, value, created, expires))
+
+    def put_many(self, values, created, expires):
+        with self.table.batch_writer() as batch:
+            for key, value in values.items():
+                batch.put_item(Item=self._item(key, value, created, expires))
+
+    @staticmethod
+    def _item(key, value, created, expires):
+        return {
+            'PK': 'CACHE#' + key,
+            'SK': 'RESULT',
+            'body': json.dumps(value),
+            'created': str(created),
+            'TTL': int(expires)
+        }
+
+
+class MemoryCacheStore:
+    """shared store substitute for local use and tests"""
+    def __init__(self):
+        self.items = {}
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def get_many(self, keys):
+        return {key: self.items[key] for key in keys if key in self.items}
+
+    def put(self, key, value, created, expires):
+        self.items[key] = (value, created)
+
+    def put_many(self, values, created, expires):
+        for key, value in values.items():
+            self.items[key] = (value, created)
@@ -0,0 +1,52 @@
+"""
+JSON document in S3 held in memory across warm invocations. The copy in memory
+is revalidated against S3 using its ETag, at most every revalidate_seconds.
+"""
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+REVALIDATE_SECONDS = 60
+
+
+class S3JsonSnapshot:
+    def __init__(self, s3_client, bucket, key, revalidate_seconds=REVALIDATE_SECONDS, clock=time.monotonic):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.revalidate_seconds = revalidate_seconds
+        self.clock = clock
+        self.value = None
+        self.etag = None
+        self.checked = None
+
+    def get(self):
+        """
+        :return: parsed document, or None if it has never been successfully loaded
+        """
+        now = self.clock()
+        if self.checked is not None and now - self.checked < self.revalidate_seconds:
+            return self.value
+
+        params = {'Bucket': self.bucket, 'Key': self.key}
+        if self.etag:
+            params['IfNoneMatch'] = self.etag
+        try:
+            response = self.s3_client.get_object(**params)
+            self.value = json.loads(response['Body'].read())
+            self.etag = response['ETag']
+            logger.info(f'loaded s3://{self.bucket}/{self.key} ({self.etag})')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ['304', 'NotModified']:
+                # continue with the copy in memory, if any
+                logger.warning(f'unable to load s3://{self.bucket}/{self.key}: {e}')
+        except Exception as e:
+            logger.warning(f'unable to load s3://{self.bucket}/{self.key}: {e}')
+        self.checked = now
+        return self.value
@@ -0,0 +1,131 @@
+"""
+estimate the bytes and partitions a point table query will read before it is
+started, using the manifest of partition sizes written by build_scan_manifest.
+The manifest records the bytes stored for each H3 partition and month, each file
+counted once in the month of its latest entry_date, e.g.
+    {'created': '2024-01-01T00:00:00+00:00', 'latest_entry_date': '2023-01-31',
+     'partitions': {'8126fffffffffff': {'2023-01': 1048576}}}
+
+A query reads the partitions covered by its bbox and polygon (see
+query_builder.partition_clause) for the months in its archive date range. Other
+filters are not considered, so the estimate is an upper bound.
+"""
+import json
+import logging
+import os
+
+from query_builder import parse_bbox, parse_polygon, partition_clause, date_pattern, IllegalArgumentException
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# queries estimated to read more than this are not run synchronously
+SCAN_BUDGET_BYTES = int(os.getenv('SCAN_BUDGET_BYTES', default=20 * 1024 ** 3))
+# nor at all above this, even as an asynchronous job or an order extract
+MAX_SCAN_BYTES = int(os.getenv('MAX_SCAN_BYTES', default=500 * 1024 ** 3))
+
+
+def month_of(date):
+    """:return: YYYY-MM month of a YYYY-MM-DD date, or None if the date is missing or invalid"""
+    if not date or not date_pattern.match(date):
+        return None
+    year, month, _ = date.split('-')
+    return f'{year}-{int(month):02d}'
+
+
+def filter_cells(filters: dict):
+    """:return: H3 partitions read for the filters, or None for all partitions"""
+    cells = None
+    # query_builder ignores an invalid bbox or polygon
+    for name, parse in [('bbox', parse_bbox), ('polygon', parse_polygon)]:
+        if name not in filters:
+            continue
+        try:
+            h3_clause = partition_clause(parse(filters[name]))
+        except IllegalArgumentException:
+            continue
+        if h3_clause:
+            cells = set(h3_clause[1]) if cells is None else cells & set(h3_clause[1])
+    return cells
+
+
+def estimate_scan(manifest: dict, *filter_sets) -> dict | None:
+    """
+    estimate for a query reading the rows matching any of the filter sets
+
+    :return: dict with the estimated bytes and number of partitions read, or None without a manifest
+    """
+    if not manifest:
+        return None
+    partitions = manifest['partitions']
+
+    # (cell, month) pairs read by any of the filter sets
+    reads = set()
+    for filters in filter_sets:
+        cells = filter_cells(filters)
+        start = month_of(filters.get('archive_date_start'))
+        end = month_of(filters.get('archive_date_end'))
+        if cells is None and start is None and end is None:
+            # full scan
+            reads = None
+            break
+        for cell in partitions if cells is None else cells:
+            for month in partitions.get(cell, {}):
+                if (start is None or month >= start) and (end is None or month <= end):
+                    reads.add((cell, month))
+
+    if reads is None:
+        return {
+            'bytes': sum([sum(i.values()) for i in partitions.values()]),
+            'partitions': len(partitions)
+        }
+    return {
+        'bytes': sum([partitions[cell][month] for cell, month in reads]),
+        'partitions': len(set([cell for cell, _ in reads]))
+    }
+
+
+def cell_bytes(manifest: dict, cells, filters: dict) -> dict:
+    """
+    bytes read from each of the cells for the filters' archive date range, 0 for
+    cells not in the manifest or for all cells without one
+    """
+    partitions = manifest['partitions'] if manifest else {}
+    start = month_of(filters.get('archive_date_start'))
+    end = month_of(filters.get('archive_date_end'))
+    return {cell: sum([size for month, size in partitions.get(cell, {}).items()
+                       if (start is None or month >= start) and (end is None or month <= end)])
+            for cell in cells}
+
+
+def estimate_headers(estimate):
+    if estimate is None:
+        return {}
+    return {
+        'X-Scan-Estimate-Bytes': str(estimate['bytes']),
+        'X-Scan-Estimate-Partitions': str(estimate['partitions'])
+    }
+
+
+def over_budget(estimate, budget) -> bool:
+    # without a manifest queries are not limited
+    return estimate is not None and estimate['bytes'] > budget
+
+
+def over_budget_response(estimate, budget):
+    """:return: API response rejecting a request estimated to read more than the budget"""
+    return {
+        'statusCode': 413,
+        'headers': estimate_headers(estimate),
+        'body': json.dumps({
+            'message': 'request would scan too much data, narrow the bbox or archive date range',
+            'scan_estimate': estimate,
+            'scan_budget_bytes': budget
+        })
+    }
+
+
+class ScanBudgetExceededException(Exception):
+    def __init__(self, message, estimate=None):
+        super().__init__(message)
+        self.estimate = estimate
@@ -0,0 +1,222 @@
+"""
+coalesce identical Athena queries started at about the same time. The first
+caller takes a short-lived lease keyed by the hash of the SQL and starts the
+query; concurrent callers with the same SQL find the lease and wait on the
+existing QueryExecutionId instead of starting a duplicate execution.
+
+A lease whose query has failed or been cancelled is taken over by the next
+caller. Errors talking to the lease store are logged and the query is started
+without coalescing.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import boto3
+from athena_query import start_query, execution_parameters, WORK_GROUP
+
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+# long enough to cover the slower queries. Callers attaching to a lease whose
+# query already succeeded reuse its result
+LEASE_SECONDS = int(os.getenv('SINGLE_FLIGHT_LEASE_SECONDS', default=120))
+# how long to wait for the lease holder to publish its QueryExecutionId
+LEADER_WAIT_SECONDS = 2.0
+LEADER_POLL_INTERVAL = 0.1
+MAX_ATTEMPTS = 3
+
+FAILED_STATES = ['FAILED', 'CANCELLED']
+
+
+def normalize_sql(sql):
+    """collapse whitespace outside of string literals"""
+    parts = sql.split("'")
+    # even numbered parts lie outside of the quotes, including the empty part between escaped quotes
+    return "'".join([re.sub(r'\s+', ' ', part) if i % 2 == 0 else part for i, part in enumerate(parts)]).strip()
+
+
+def query_key(sql, params=None):
+    canonical = json.dumps([normalize_sql(sql), execution_parameters(params or [])], separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self, store, lease_seconds=LEASE_SECONDS, sleep=time.sleep, clock=time.time):
+        self.store = store
+        self.lease_seconds = lease_seconds
+        self.sleep = sleep
+        self.clock = clock
+
+    def start_query(self, client, sql, work_group=WORK_GROUP, params=None):
+        """
+        start the query or attach to an identical one (same SQL and parameters) already in progress
+
+        :return: QueryExecutionId
+        """
+        key = query_key(sql, params)
+        token = str(uuid.uuid4())
+        try:
+            query_execution_id = self._attach(client, key, token)
+        except Exception as e:
+            logger.warning(f'unable to coalesce query {key}: {e}')
+            return start_query(client, sql, work_group, params)
+        if query_execution_id:
+            logger.info(f'attached to query {query_execution_id}')
+            return query_execution_id
+
+        # this caller holds the lease
+        try:
+            query_execution_id = start_query(client, sql, work_group, params)
+        except Exception:
+            self._release(key, token)
+            raise
+        try:
+            self.store.publish(key, token, query_execution_id)
+        except Exception as e:
+            logger.warning(f'unable to publish query {query_execution_id} for {key}: {e}')
+        return query_execution_id
+
+    def _attach(self, client, key, token):
+        """
+        :return: QueryExecutionId of an existing query or None once the lease is held by this caller
+        """
+        previous_token = None
+        for _ in range(MAX_ATTEMPTS):
+            if self.store.claim(key, token, self.clock() + self.lease_seconds, self.clock(), previous_token):
+                return None
+
+            lease = self._wait_for_leader(key)
+            if lease is None:
+                # lease expired or was released in the meantime
+                previous_token = None
+                continue
+            if lease['query_execution_id'] is None:
+                # holder never published a query, e.g. its Lambda timed out. Replace the lease
+                previous_token = lease['token']
+                continue
+
+            response = client.get_query_execution(QueryExecutionId=lease['query_execution_id'])
+            if response['QueryExecution']['Status']['State'] not in FAILED_STATES:
+                return lease['query_execution_id']
+            # start over rather than share the failure
+            previous_token = lease['token']
+
+        raise LeaseContentionException(f'no lease or query available for {key} after {MAX_ATTEMPTS} attempts')
+
+    def _wait_for_leader(self, key):
+        deadline = self.clock() + LEADER_WAIT_SECONDS
+        lease = self.store.get(key, self.clock())
+        while lease and lease['query_execution_id'] is None and self.clock() < deadline:
+            self.sleep(LEADER_POLL_INTERVAL)
+            lease = self.store.get(key, self.clock())
+        return lease
+
+    def _release(self, key, token):
+        try:
+            self.store.release(key, token)
+        except Exception as e:
+            logger.warning(f'unable to release lease {key}: {e}')
+
+
+class DynamoDBLeaseStore:
+    """leases stored as items in the orders table, removed by its TTL attribute"""
+    def __init__(self, table_name):
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.exceptions = self.table.meta.client.exceptions
+
+    def claim(self, key, token, expires, now, previous_token=None):
+        """
+        take the lease if it is free, expired or still held under previous_token
+
+        :return: whether the lease was taken
+        """
+        condition = 'attribute_not_exists(PK) OR #ttl < :now'
+        values = {':now': int(now)}
+        if previous_token:
+            condition += ' OR #token = :previous'
+            values[':previous'] = previous_token
+        try:
+            self.table.put_item(
+                Item={'PK': 'LEASE#' + key, 'SK': 'LEASE', 'token': token, 'TTL': int(expires)},
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#ttl': 'TTL', '#token': 'token'} if previous_token else {'#ttl': 'TTL'},
+                ExpressionAttributeValues=values
+            )
+        except self.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+
+    def publish(self, key, token, query_execution_id):
+        self.table.update_item(
+            Key={'PK': 'LEASE#' + key, 'SK': 'LEASE'},
+            UpdateExpression='SET query_execution_id = :qid',
+            ConditionExpression='#token = :token',
+            ExpressionAttributeNames={'#token': 'token'},
+            ExpressionAttributeValues={':qid': query_execution_id, ':token': token}
+        )
+
+    def get(self, key, now):
+        """
+        :return: dict with token and query_execution_id (None until published), or None if there is no current lease
+        """
+        response = self.table.get_item(Key={'PK': 'LEASE#' + key, 'SK': 'LEASE'}, ConsistentRead=True)
+        item = response.get('Item')
+        # expired items are only removed by TTL eventually
+        if item is None or int(item['TTL']) < now:
+            return None
+        return {'token': item['token'], 'query_execution_id': item.get('query_execution_id')}
+
+    def release(self, key, token):
+        try:
+            self.table.delete_item(
+                Key={'PK': 'LEASE#' + key, 'SK': 'LEASE'},
+                ConditionExpression='#token = :token',
+                ExpressionAttributeNames={'#token': 'token'},
+                ExpressionAttributeValues={':token': token}
+            )
+        except self.exceptions.ConditionalCheckFailedException:
+            pass
+
+
+class MemoryLeaseStore:
+    """lease store substitute for local use and tests. Safe for use from multiple threads"""
+    def __init__(self):
+        self.leases = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key, token, expires, now, previous_token=None):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease['expires'] < now or (previous_token and lease['token'] == previous_token):
+                self.leases[key] = {'token': token, 'query_execution_id': None, 'expires': expires}
+                return True
+            return False
+
+    def publish(self, key, token, query_execution_id):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease and lease['token'] == token:
+                lease['query_execution_id'] = query_execution_id
+
+    def get(self, key, now):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease is None or lease['expires'] < now:
+                return None
+            return {'token': lease['token'], 'query_execution_id': lease['query_execution_id']}
+
+    def release(self, key, token):
+        with self.lock:
+            lease = self.leases.get(key)
+            if lease and lease['token'] == token:
+                del self.leases[key]
+
+
+class LeaseContentionException(Exception):
+    pass
@@ -0,0 +1,99 @@
+"""
+decompose a bbox into aligned quadtree tiles plus the remainder strips along
+its edges, so that point counts of the tiles can be cached and reused by any
+other bbox containing them.
+
+Level z divides the globe into 2^z by 2^z tiles of 360/2^z by 180/2^z degrees.
+Tiles are identified as "z/x/y" with x and y counted from -180, -90. Tiles are
+half-open, including their west and south edges, so the tiles and remainder of
+a bbox count every point inside it exactly once.
+"""
+import math
+
+# finest level used, tiles of ~0.09 by 0.04 degrees
+MAX_TILE_LEVEL = 12
+# finest tiles are no larger than this fraction of the bbox's width and height,
+# which limits the remainder strips to a small part of the bbox
+TILE_DIVISIONS = 8
+# limits the length of the SQL statement
+MAX_TILES = 128
+
+
+def tile_id(z, x, y):
+    return f'{z}/{x}/{y}'
+
+
+def tile_bounds(tile):
+    """:return: bbox of the tile given as z/x/y"""
+    z, x, y = [int(i) for i in tile.split('/')]
+    width = 360.0 / 2 ** z
+    height = 180.0 / 2 ** z
+    return [-180.0 + x * width, -90.0 + y * height, -180.0 + (x + 1) * width, -90.0 + (y + 1) * height]
+
+
+def tile_level(bbox):
+    """:return: level of the finest tiles used for the bbox, or None if it is too small to tile"""
+    minx, miny, maxx, maxy = bbox
+    for z in range(MAX_TILE_LEVEL + 1):
+        if 360.0 / 2 ** z <= (maxx - minx) / TILE_DIVISIONS and 180.0 / 2 ** z <= (maxy - miny) / TILE_DIVISIONS:
+            return z
+    return None
+
+
+def decompose(bbox):
+    """
+    largest aligned tiles covering the interior of the bbox. The interior's west
+    and south edges lie strictly inside the bbox since its predicate excludes
+    points on the edges, which the tiles would include
+
+    :return: tuple of (interior bbox, list of tile ids), or None if the bbox cannot be tiled within the limits
+    """
+    level = tile_level(bbox)
+    if level is None:
+        return None
+    width = 360.0 / 2 ** level
+    height = 180.0 / 2 ** level
+    minx, miny, maxx, maxy = bbox
+    x0 = math.floor((minx + 180) / width) + 1
+    y0 = math.floor((miny + 90) / height) + 1
+    x1 = math.floor((maxx + 180) / width)
+    y1 = math.floor((maxy + 90) / height)
+
+    tiles = []
+
+    def visit(z, x, y):
+        # extent of the tile in units of the finest tiles
+        size = 2 ** (level - z)
+        tx0, ty0 = x * size, y * size
+        tx1, ty1 = tx0 + size, ty0 + size
+        if tx1 <= x0 or tx0 >= x1 or ty1 <= y0 or ty0 >= y1:
+            return
+        if x0 <= tx0 and tx1 <= x1 and y0 <= ty0 and ty1 <= y1:
+            tiles.append(tile_id(z, x, y))
+            return
+        for i in range(2):
+            for j in range(2):
+                visit(z + 1, 2 * x + i, 2 * y + j)
+
+    visit(0, 0, 0)
+    if not tiles or len(tiles) > MAX_TILES:
+        return None
+    interior = [-180.0 + x0 * width, -90.0 + y0 * height, -180.0 + x1 * width, -90.0 + y1 * height]
+    return interior, tiles
+
+
+def tile_clause(bounds):
+    """
+    predicate matching the points in the half-open tile or interior
+
+    :return: tuple of (SQL, parameters)
+    """
+    minx, miny, maxx, maxy = bounds
+    return "(lon >= ? and lon < ? and lat >= ? and lat < ?)", [minx, maxx, miny, maxy]
+
+
+def remainder_strips(bbox, interior):
+    """:return: bboxes of the strips of the bbox outside of its interior, west and east between the others"""
+    minx, miny, maxx, maxy = bbox
+    x0, y0, x1, y1 = interior
+    return [[minx, miny, maxx, y0], [minx, y1, maxx, maxy], [minx, y0, x0, y1], [x1, y0, maxx, y1]]
@@ -0,0 +1,64 @@
+"""
+estimate the size of a dataset's point extract before it is started and store
+it on the dataset record. The state machine uses the class to choose the
+extract's query slots, verify_dataset_status sizes the whole order from its
+datasets' records to choose the grid queue, see order_size
+"""
+import logging
+import os
+from datetime import datetime
+from datetime import timezone
+import boto3
+from count_cube import load_snapshot
+from h3_cells import polygon_bounds
+from order_size import classify
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
+dynamodb = boto3.resource('dynamodb')
+table = dynamodb.Table(TABLE)
+s3 = boto3.client('s3')
+
+# loaded once per container. see count_cube for rebuilding the snapshot
+COUNT_CUBE_URI = os.getenv('COUNT_CUBE_URI')
+count_cube = load_snapshot(s3, COUNT_CUBE_URI) if COUNT_CUBE_URI else None
+
+
+def update_dataset(order_id, label, order_size):
+    now = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    attributes = {'size_class': order_size['size_class'], 'last_update': now}
+    if order_size['estimated_points'] is not None:
+        attributes['estimated_points'] = order_size['estimated_points']
+        attributes['estimate_method'] = order_size['estimate_method']
+    # TODO add constraint to reject update if item does not already exist
+    response = table.update_item(
+        Key={
+            'PK': 'ORDER#' + order_id,
+            'SK': 'DATASET#' + label
+        },
+        UpdateExpression='SET ' + ', '.join([f'{i} = :{i}' for i in attributes]),
+        ExpressionAttributeValues={f':{i}': value for i, value in attributes.items()}
+    )
+    if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+        raise Exception("failed to update dataset")
+
+
+def lambda_handler(event, context):
+    """
+    expects the order_id and bbox of the order and the label, filters and scan_estimate from format_point_query
+
+    :return: dict with the size_class, estimated_points, estimate_method and query_class
+    """
+    order_id = event['order_id']
+    label = event['label']
+    filters = event['filters']
+    # a polygon limits the points to within its bounds
+    bbox = polygon_bounds(filters['polygon']) if filters.get('polygon') else event['bbox']
+    order_size = classify(bbox, filters, count_cube, event.get('scan_estimate'))
+    logger.info(f"dataset {label} of order {order_id} estimated at {order_size['estimated_points']} points, "
+                f"{order_size['size_class']}")
+
+    update_dataset(order_id, label, order_size)
+    return order_size
@@ -1,7 +1,7 @@
 """
 generate_grid.py
 
-monitors SQS queue for messages requesting grid generation. Orchestrates the staging of data, execution of mbgrid,
+monitors SQS queues for messages requesting grid generation. Orchestrates the staging of data, execution of mbgrid,
 staging of output, update of orders database table, and responding to step function
 """
 import boto3
@@ -13,10 +13,32 @@ from datetime import datetime
 import argparse
 from os import path
 from os import remove
+from os import listdir
+from os import makedirs
+from shutil import rmtree
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 from zipfile import ZipFile, ZIP_DEFLATED
 from grid_task import GridTask
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+
+def next_messages():
+    """
+    messages from the first of the queues with any, in priority order. Only the
+    last queue is long polled so an empty priority queue does not delay the others
+
+    :return: tuple of (index of the queue, list of messages)
+    """
+    for n, queue in enumerate(queues):
+        # WaitTimeSeconds enables Long Polling
+        messages = queue.receive_messages(WaitTimeSeconds=10 if n == len(queues) - 1 else 0)
+        if messages:
+            return n, messages
+    return len(queues) - 1, []
 
 
 def main():
@@ -24,9 +46,8 @@ def main():
 
     # run forever
     while True:
-        # WaitTimeSeconds enables Long Polling
-        messages = queue.receive_messages(WaitTimeSeconds=10)
-        logger.debug(f"found {len(messages)} notifications in queue to process...")
+        n, messages = next_messages()
+        logger.debug(f"found {len(messages)} notifications in queue {QUEUE_NAMES[n]} to process...")
 
         for message in messages:
             body = json.loads(message.body)
@@ -90,6 +111,9 @@ def main():
             finally:
                 cleanup(order_id, data_files)
 
+        # small orders are waiting, don't sleep
+        if messages and n < len(queues) - 1:
+            continue
         # wait before getting the next batch from the queue
         logger.debug(f"all messages processed. waiting for {SLEEP_MINUTES} minutes before checking again...")
         time.sleep(SLEEP_MINUTES*60)
@@ -103,8 +127,13 @@ def stage_data_files(output_locations):
 
     # stage CSB data
     if 'csb' in output_locations:
-        csv_file = download_file_from_s3(output_locations['csb'])
-        data_files['csb'] = convert_csv_to_xyz(csv_file)
+        # Parquet extracts are written by UNLOAD in parts listed in a manifest
+        if output_locations['csb'].endswith('manifest.json'):
+            parquet_dir = download_manifest_from_s3(output_locations['csb'])
+            data_files['csb'] = convert_parquet_to_xyz(parquet_dir)
+        else:
+            csv_file = download_file_from_s3(output_locations['csb'])
+            data_files['csb'] = convert_csv_to_xyz(csv_file)
 
     # stage MB data
     if 'multibeam' in output_locations:
@@ -188,6 +217,36 @@ def download_file_from_s3(file_uri):
     return file_path
 
 
+def download_manifest_from_s3(manifest_uri):
+    """
+    download the files of each part listed in an extract's manifest into a
+    directory named for the extract's prefix
+    :param manifest_uri: S3 URI of the manifest.json written by write_extract_manifest
+    :return: fully-qualified directory name of downloaded files
+    """
+    bucket, key = manifest_uri.removeprefix('s3://').split('/', 1)
+    manifest = json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    if manifest['failed_parts']:
+        logger.warning(f"WARNING: {len(manifest['failed_parts'])} parts of the extract failed")
+
+    # e.g. s3://order-pickup/extracts/<order_id>/csb/<uuid>/manifest.json
+    dir_path = INCOMING_DIR + key.split('/')[-2] + '/'
+    makedirs(dir_path, exist_ok=True)
+    total_size = 0
+    for part in manifest['parts']:
+        for file_uri in part['files']:
+            file_bucket, file_key = file_uri.removeprefix('s3://').split('/', 1)
+            # the names written by each part's UNLOAD are not guaranteed to be distinct
+            filename = f"part-{part['part']:03d}-{file_key.split('/')[-1]}"
+            if path.exists(dir_path + filename):
+                continue
+            logger.debug(f'downloading file {filename}...')
+            s3.download_file(file_bucket, file_key, dir_path + filename)
+            total_size += path.getsize(dir_path + filename)
+    logger.info(f'downloaded {round(total_size / 1048576, 2)} MB')
+    return dir_path
+
+
 def upload_file_to_s3(filename):
     """
     upload file to S3 using file basename as key
@@ -252,22 +311,58 @@ def convert_csv_to_xyz(filename):
     return output_filename
 
 
+def convert_parquet_to_xyz(dir_path):
+    """
+    Convert the Parquet files of an UNLOAD extract to XYZ optimized for MB-System processing.
+
+    Reads only the lon, lat, depth columns a batch at a time and standardizes
+    their precision with vectorized compute functions rather than per line
+
+    :param dir_path: fully-qualified directory of Parquet files downloaded from S3
+    :return: fully-qualified file name of XYZ file
+    """
+    output_filename = dir_path.rstrip('/') + '.xyz'
+    if path.exists(output_filename):
+        logger.warning(f'WARNING: file {output_filename} already exists, no action taken')
+        return output_filename
+
+    # limit lon, lat precision to ~1.1m at equator
+    precision = {'lon': 5, 'lat': 5, 'depth': 1}
+    schema = pa.schema([(i, pa.float64()) for i in precision])
+    write_options = pa_csv.WriteOptions(include_header=False)
+    with pa_csv.CSVWriter(output_filename, schema, write_options=write_options) as writer:
+        for filename in sorted(listdir(dir_path)):
+            parquet_file = pq.ParquetFile(dir_path + filename)
+            for batch in parquet_file.iter_batches(columns=list(precision)):
+                columns = [pc.round(pc.cast(batch.column(i), pa.float64()), ndigits=precision[i]) for i in precision]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema).drop_null())
+    return output_filename
+
+
 def zip_files(order_id, data_files):
     """package specific processing artifacts for delivery to user
-       includes CSB CSV file and any grid files with names in format <order_id>.[asc | grd]
+       includes CSB CSV or Parquet files and any grid files with names in format <order_id>.[asc | grd]
        TODO add README file and potential other grid format extensions"""
     zip_filename = INCOMING_DIR + order_id + '.zip'
 
     file_list = [ f"{INCOMING_DIR}{order_id}.{i}" for i in ['asc', 'grd']]
+    parquet_dir = None
     if 'csb' in data_files:
         # fully-qualified filename. replace xyz file with csv version
         file_list.append(f"{data_files['csb'].split('.')[0]}.csv")
+        # or the directory of Parquet files it was converted from
+        parquet_dir = f"{data_files['csb'].split('.')[0]}/"
     with ZipFile(zip_filename, 'w') as zip_file:
         for file_path in file_list:
             archived_filename = file_path.split('/')[-1]
             if path.exists(file_path):
                 # specify with relative path use unqualified filename in Zip
                 zip_file.write(file_path, arcname=archived_filename, compress_type=ZIP_DEFLATED)
+        if parquet_dir and path.isdir(parquet_dir):
+            # already ZSTD-compressed
+            for filename in sorted(listdir(parquet_dir)):
+                archived_filename = filename if filename.endswith('.parquet') else f'{filename}.parquet'
+                zip_file.write(parquet_dir + filename, arcname=f'csb/{archived_filename}')
 
     return zip_filename
 
@@ -309,6 +404,11 @@ def cleanup(order_id, data_files):
             logger.debug(f"removing file {filename}...")
             removed_files.append(filename)
             remove(filename)
+        dir_path = data_files['csb'].split('.')[0] + '/'
+        if path.isdir(dir_path):
+            logger.debug(f"removing directory {dir_path}...")
+            removed_files.append(dir_path)
+            rmtree(dir_path)
     for i in data_files:
         filename = data_files[i]
         if path.exists(filename):
@@ -334,10 +434,14 @@ if __name__ == '__main__':
         description="""monitor AWS queue and generate grid from CSB points and/or multibeam FBT files. Notify Step function when complete"""
     )
     arg_parser.add_argument("--profile", default="default", help="AWS profile")
+    # small orders are sent to GridDataFastQueue, see order_size
+    arg_parser.add_argument("--queue", nargs="+", default=["GridDataFastQueue", "GridDataQueue"],
+                            help="names of the SQS queues to monitor, in priority order")
+    arg_parser.add_argument("--sleep-minutes", type=float, default=1, help="wait time before checking queue again")
     args = arg_parser.parse_args()
 
-    SLEEP_MINUTES = 1                     # wait time before checking queue again
-    QUEUE_NAME = 'GridDataQueue'
+    SLEEP_MINUTES = args.sleep_minutes
+    QUEUE_NAMES = args.queue
     ORDERS_TABLE = 'bathy-orders'
     # INCOMING_DIR = '/Users/jcc/Downloads/'
     INCOMING_DIR = '/home/ec2-user/incoming/'
@@ -348,7 +452,7 @@ if __name__ == '__main__':
     dynamodb = session.resource('dynamodb')
     s3 = session.client('s3')
     sfn = boto3.client('stepfunctions')
-    queue = sqs.get_queue_by_name(QueueName=QUEUE_NAME)
+    queues = [sqs.get_queue_by_name(QueueName=i) for i in QUEUE_NAMES]
     table = dynamodb.Table(ORDERS_TABLE)
 
     main()
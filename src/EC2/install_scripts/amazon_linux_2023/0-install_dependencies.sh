@@ -2,4 +2,6 @@ sudo dnf -y \
   install gcc-c++ cpp sqlite sqlite-devel libtiff cmake python3-pip python-devel \
   openssl-devel tcl libtiff-devel libcurl-devel swig libpng-devel libjpeg-turbo-devel \
   expat-devel zlib-devel libxml2 libxml2-devel m4 gtest gtest-devel python3-pyyaml \
-  python3-numpy libtirpc libtirpc-devel
\ No newline at end of file
+  python3-numpy libtirpc libtirpc-devel
+
+pip3 install pyarrow
@@ -0,0 +1,112 @@
+"""
+simulate interactive count queries competing with bulk extracts for a limited
+number of concurrent Athena queries, with and without the query_governor, e.g.
+    PYTHONPATH=../../shared python benchmark_governor.py
+
+Athena is modeled as a fixed number of query slots with queuing beyond them.
+Times are scaled down, one simulated second per 10 ms
+"""
+import random
+import threading
+import time
+
+from query_governor import QueryGovernor, ConcurrencyLimitException, INTERACTIVE, EXTRACT
+from query_stats import percentile
+from single_flight import MemoryLeaseStore
+
+SCALE = 0.01
+ATHENA_CONCURRENCY = 20
+INTERACTIVE_TIMEOUT = 25
+INTERACTIVE_SECONDS = (1, 4)
+EXTRACT_SECONDS = (60, 180)
+EXTRACT_WORKERS = 40
+INTERACTIVE_WORKERS = 20
+DURATION = 600
+
+
+class SimulatedAthena:
+    """queries beyond the concurrency limit wait for a free slot"""
+    def __init__(self, concurrency):
+        self.slots = threading.Semaphore(concurrency)
+
+    def run(self, seconds, timeout=None):
+        """:return: whether the query completed within the timeout"""
+        start = time.monotonic()
+        if not self.slots.acquire(timeout=timeout * SCALE if timeout else None):
+            return False
+        try:
+            elapsed = time.monotonic() - start
+            if timeout and elapsed + seconds * SCALE > timeout * SCALE:
+                time.sleep(timeout * SCALE - elapsed)
+                return False
+            time.sleep(seconds * SCALE)
+            return True
+        finally:
+            self.slots.release()
+
+
+def simulate(governor):
+    athena = SimulatedAthena(ATHENA_CONCURRENCY)
+    deadline = time.monotonic() + DURATION * SCALE
+    lock = threading.Lock()
+    results = {'latency': [], 'timeouts': 0, 'throttled': 0, 'extracts': 0}
+
+    def extract_worker(rng):
+        while time.monotonic() < deadline:
+            try:
+                with governor.slot(EXTRACT) if governor else nullslot():
+                    athena.run(rng.uniform(*EXTRACT_SECONDS))
+                with lock:
+                    results['extracts'] += 1
+            except ConcurrencyLimitException as e:
+                # the state machine retries later
+                time.sleep(e.retry_after * SCALE)
+
+    def interactive_worker(rng):
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            try:
+                with governor.slot(INTERACTIVE) if governor else nullslot():
+                    completed = athena.run(rng.uniform(*INTERACTIVE_SECONDS), timeout=INTERACTIVE_TIMEOUT)
+            except ConcurrencyLimitException:
+                with lock:
+                    results['throttled'] += 1
+                completed = None
+            latency = (time.monotonic() - start) / SCALE
+            with lock:
+                if completed:
+                    results['latency'].append(latency)
+                elif completed is False:
+                    results['timeouts'] += 1
+            # think time between requests
+            time.sleep(rng.uniform(1, 5) * SCALE)
+
+    threads = [threading.Thread(target=extract_worker, args=(random.Random(i),)) for i in range(EXTRACT_WORKERS)]
+    threads += [threading.Thread(target=interactive_worker, args=(random.Random(1000 + i),))
+                for i in range(INTERACTIVE_WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class nullslot:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+def report(label, results):
+    latency = results['latency']
+    print(f"{label}: {len(latency)} interactive queries completed, {results['timeouts']} timed out, "
+          f"{results['throttled']} throttled, {results['extracts']} extracts completed")
+    if latency:
+        print('  interactive latency ' + ', '.join([f'p{p} {percentile(latency, p):.1f}s' for p in [50, 90, 99]]))
+
+
+if __name__ == '__main__':
+    report('ungoverned', simulate(None))
+    report('governed', simulate(QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 15, EXTRACT: 5})))
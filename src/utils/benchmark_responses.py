@@ -0,0 +1,46 @@
+"""
+compare serialization time and payload size of a list_platforms response body
+built from the sample Athena result in loop.py, e.g.
+    PYTHONPATH=../../shared python benchmark_responses.py
+"""
+import json
+import timeit
+
+import http_response
+from loop import a
+
+REPEAT = 200
+
+
+def platforms_body(copies=1):
+    rows = [[i['VarCharValue'] for i in row['Data']] for row in a['Rows'][1:]] * copies
+    return {
+        'count': len(rows),
+        'data': [{'provider': i[0], 'platform': i[1]} for i in rows]
+    }
+
+
+def report(label, body):
+    data = http_response.dumps(body).encode('utf-8')
+    print(f"{label}: {body['count']} platforms")
+    for name, serialize in [('json.dumps', lambda: json.dumps(body)), ('http_response.dumps', lambda: http_response.dumps(body))]:
+        elapsed = timeit.timeit(serialize, number=REPEAT) / REPEAT
+        print(f"  {name:20s} {elapsed * 1e6:10.1f} us")
+
+    print(f"  {'json.dumps size':20s} {len(json.dumps(body).encode('utf-8')):10d} bytes")
+    print(f"  {'compact size':20s} {len(data):10d} bytes")
+    codings = ['gzip', 'br'] if http_response.brotli else ['gzip']
+    for coding in codings:
+        elapsed = timeit.timeit(lambda: http_response.compress(data, coding), number=REPEAT) / REPEAT
+        size = len(http_response.compress(data, coding))
+        print(f"  {coding + ' size':20s} {size:10d} bytes ({size / len(data):.0%}), {elapsed * 1e6:.1f} us")
+    if not http_response.brotli:
+        print('  brotli not installed')
+    if not http_response.orjson:
+        print('  orjson not installed, http_response.dumps uses json')
+
+
+if __name__ == '__main__':
+    report('sample', platforms_body())
+    # serialization time for a larger listing. Its repeated rows overstate compression
+    report('sample x10', platforms_body(10))
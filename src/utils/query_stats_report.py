@@ -0,0 +1,54 @@
+"""
+summarize the Athena query statistics recorded by the API and order Lambdas
+(see shared/query_stats.py) into cost and latency percentiles per query shape.
+Reads log lines from the given files or stdin, e.g.
+    aws logs filter-log-events --log-group-name /aws/lambda/<count points function> \
+        --filter-pattern '{ $.record_type = "athena_query" }' --query 'events[].message' --output text \
+        | tr '\t' '\n' > stats.log
+    PYTHONPATH=../../shared python query_stats_report.py stats.log --by endpoint shape method
+"""
+import argparse
+import fileinput
+
+from query_stats import parse_records, summarize, PERCENTILES
+
+
+def format_bytes(value):
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if value < 1024 or unit == 'TiB':
+            return f'{value:.1f} {unit}'
+        value /= 1024
+
+
+def format_seconds(millis):
+    return '-' if millis is None else f'{millis / 1000:.1f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='log files, stdin if none')
+    parser.add_argument('--by', nargs='+', default=['endpoint', 'shape'], help='tags to group queries by')
+    args = parser.parse_args()
+
+    with fileinput.input(args.files) as lines:
+        records = parse_records(lines)
+    summaries = summarize(records, keys=tuple(args.by))
+
+    columns = [' / '.join(args.by), 'queries', 'failed', 'reused', 'scanned', 'cost $'] + \
+              [f'total p{p} s' for p in PERCENTILES] + [f'queue p{p} s' for p in PERCENTILES]
+    rows = []
+    for summary in summaries:
+        rows.append([' / '.join([str(summary[i]) for i in args.by]), str(summary['queries']), str(summary['failed']),
+                     str(summary['reused']), format_bytes(summary['DataScannedInBytes']), f"{summary['cost']:.4f}"] +
+                    [format_seconds(summary[f'TotalExecutionTimeInMillis_p{p}']) for p in PERCENTILES] +
+                    [format_seconds(summary[f'QueryQueueTimeInMillis_p{p}']) for p in PERCENTILES])
+
+    widths = [max([len(i[n]) for i in rows + [columns]]) for n in range(len(columns))]
+    for row in [columns] + rows:
+        print('  '.join([value.ljust(width) if n == 0 else value.rjust(width)
+                         for n, (value, width) in enumerate(zip(row, widths))]))
+    print(f'{len(records)} queries, ${sum([i["cost"] for i in summaries]):.4f} estimated cost')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import io
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+# functions import modules from the shared Lambda layer as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'shared'))
+
+# boto3 clients are created at import time in several functions
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+
+class StubAthenaClient:
+    """
+    stands in for the boto3 Athena client. Every query succeeds, get_query_results
+    returns a single row of the given number of columns counting up from count
+    """
+    class exceptions:
+        InvalidRequestException = type('InvalidRequestException', (Exception,), {})
+
+    def __init__(self, count='1234', columns=1):
+        self.count = count
+        self.columns = columns
+        # most recent query
+        self.query_string = None
+        self.execution_parameters = None
+        # every query started
+        self.queries = []
+        self.parameters = []
+
+    def start_query_execution(self, QueryString, WorkGroup, ExecutionParameters=None):
+        self.query_string = QueryString
+        self.execution_parameters = ExecutionParameters
+        self.queries.append(QueryString)
+        self.parameters.append(ExecutionParameters)
+        return {'QueryExecutionId': 'abc-123'}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Query': self.query_string or '',
+            'Status': {'State': 'SUCCEEDED'},
+            'Statistics': {'TotalExecutionTimeInMillis': 300},
+            'ResultConfiguration': {'OutputLocation': f's3://order-pickup/{QueryExecutionId}.csv'}
+        }}
+
+    def get_query_results(self, QueryExecutionId):
+        return {'ResultSet': {'Rows': [
+            {'Data': [{'VarCharValue': f'c{i}'} for i in range(self.columns)]},
+            {'Data': [{'VarCharValue': str(int(self.count) + i)} for i in range(self.columns)]}
+        ]}}
+
+
+class StubS3Client:
+    """serves the content as every object read, the objects are those which exist"""
+    def __init__(self, content='', objects=None):
+        self.content = content
+        self.objects = set(objects or [])
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.content.encode('utf-8'))}
+
+    def head_object(self, Bucket, Key):
+        if f's3://{Bucket}/{Key}' not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+
+class StubSnapshot:
+    """stands in for an S3JsonSnapshot holding the value"""
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+@pytest.fixture()
+def athena_client():
+    return StubAthenaClient()
+
+
+@pytest.fixture()
+def s3_client():
+    return StubS3Client()
+
+
+@pytest.fixture()
+def stub_snapshot():
+    """:return: StubSnapshot, called with the snapshot's value"""
+    return StubSnapshot
@@ -0,0 +1,56 @@
+import io
+import json
+import pytest
+from copy_extract import app
+
+EARLIER = 's3://order-pickup/extracts/abc-123/csb/6f1c/'
+LOCATION = 's3://order-pickup/extracts/def-456/csb/9e2d/'
+
+
+class StubS3Client:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[f's3://{Bucket}/{Key}'])}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.objects[f's3://{Bucket}/{Key}'] = Body
+
+    def copy(self, CopySource, Bucket, Key):
+        self.objects[f's3://{Bucket}/{Key}'] = self.objects[f"s3://{CopySource['Bucket']}/{CopySource['Key']}"]
+
+
+@pytest.fixture()
+def s3(monkeypatch):
+    manifest = {
+        'order_id': 'abc-123', 'label': 'csb', 'format': 'parquet', 'created': '2024-01-01T00:00:00+00:00',
+        'parts': [{'part': 0, 'cells': ['cell0'], 'files': [f'{EARLIER}part-000/a1/20240101_00001']}],
+        'failed_parts': []
+    }
+    s3 = StubS3Client({
+        f'{EARLIER}manifest.json': json.dumps(manifest).encode('utf-8'),
+        f'{EARLIER}part-000/a1/20240101_00001': b'PAR1',
+        's3://order-pickup/0a1b.csv': b'"lon","lat","depth"\n'
+    })
+    monkeypatch.setattr(app, 's3', s3)
+    return s3
+
+
+class TestApp:
+    def test_copy_manifest(self, s3):
+        result = app.lambda_handler({'order_id': 'def-456', 'label': 'csb', 'output_format': 'parquet',
+                                     'reuse_location': f'{EARLIER}manifest.json', 'unload_location': LOCATION}, None)
+
+        assert result == {'label': 'csb', 'output_location': f'{LOCATION}manifest.json'}
+        manifest = json.loads(s3.objects[f'{LOCATION}manifest.json'])
+        assert manifest['parts'][0]['files'] == [f'{LOCATION}part-000/reused/20240101_00001']
+        assert manifest['reused_from'] == f'{EARLIER}manifest.json'
+        assert s3.objects[f'{LOCATION}part-000/reused/20240101_00001'] == b'PAR1'
+
+    def test_copy_csv(self, s3):
+        result = app.lambda_handler({'order_id': 'def-456', 'label': 'csb', 'output_format': 'csv',
+                                     'reuse_location': 's3://order-pickup/0a1b.csv', 'unload_location': None}, None)
+
+        assert result['output_location'] == 's3://order-pickup/def-456-csb.csv'
+        assert s3.objects['s3://order-pickup/def-456-csb.csv'] == b'"lon","lat","depth"\n'
@@ -1,7 +1,17 @@
+import json
 import unittest
 import pytest
 import re
+import h3
 from count_points import app
+from query_jobs import MemoryJobStore
+from result_cache import ResultCache, MemoryCacheStore
+from single_flight import SingleFlight, MemoryLeaseStore
+from query_governor import QueryGovernor, INTERACTIVE, EXTRACT, ASYNC_JOB
+from h3_cells import interior_cells, inner_bbox
+from query_builder import partition_clause
+from tile_counts import decompose, tile_bounds
+from count_cube import CountCube, month_index
 
 platform_name_pattern = re.compile("^[- .a-zA-Z0-9_/()',!]+$")
 provider_name_pattern = re.compile("^[a-zA-Z0-9 ,]+$")
@@ -9,45 +19,40 @@ date_pattern = re.compile("^[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}$")
 unique_id_pattern = re.compile("^[a-zA-Z0-9-]+$")
 
 
-class TestApp:
-    def test_valid_bbox(self):
-        assert app.valid_bbox([-180, -90, 180, 90]) is True, "coordinates should be in range"
-        assert app.valid_bbox([-180, -90, 180, 91]) is False, "coordinates should be out of range"
-        assert app.valid_bbox([-181, -90, 180, 90]) is False, "coordinates should be out of range"
-        assert app.valid_bbox([170, 0, -170, 10]) is False, "bbox crosses the antimeridian"
-        assert app.valid_bbox([-10, -10, -10, -10]) is False, "bbox area is zero"
-
-    def test_create_sql_from_bbox_with_out_of_range_coords(self):
-        with pytest.raises(app.IllegalArgumentException):
-            app.create_sql_from_bbox("-180,-90,180,901")
+HISTOGRAM_CSV = """"_col0","month","provider","lon","lat","_col5"
+"7","2023-01",,,,"10"
+"7","2023-02",,,,"20"
+"11",,"PGS",,,"30"
+"12",,,"-97","27","25"
+"12",,,"-96","27","5"
+"""
 
-    def test_create_sql_from_bbox_with_non_numeric_coords(self):
-        with pytest.raises(app.IllegalArgumentException):
-            app.create_sql_from_bbox("null,-90,180,90")
 
-    def test_create_sql_from_bbox(self):
-        expected = [
-            '(lon > -180.0 and lon < 180.0)',
-            '(lat > -90.0 and lat < 90.0)'
-        ]
-        bbox_string = '-180, -90, 180, 90'
-        assert app.create_sql_from_bbox(bbox_string) == expected
-
-    def test_filters_to_where_clause(self):
-        expected = [
-            "platform_name in ('Ramform Vanguard','Anonymous')",
-            "provider in ('PGS','MacGregor')",
-            "time >= date('2022-01-01')",
-            "entry_date >= date('2022-01-01')"
-        ]
-        query_params = {
-            "providers": "PGS,MacGregor",
-            "platforms": "Ramform Vanguard,Anonymous",
-            "collection_date_start": "2022-01-01",
-            "archive_date_start": "2022-01-01"
-        }
-        assert app.filters_to_where_clause(query_params) == expected
+@pytest.fixture(autouse=True)
+def no_scan_manifest(monkeypatch, stub_snapshot):
+    monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+
 
+@pytest.fixture(autouse=True)
+def tile_cache(monkeypatch):
+    tile_cache = ResultCache(MemoryCacheStore())
+    monkeypatch.setattr(app, 'tile_cache', tile_cache)
+    return tile_cache
+
+
+@pytest.fixture(autouse=True)
+def governor(monkeypatch):
+    governor = QueryGovernor(MemoryLeaseStore())
+    monkeypatch.setattr(app, 'governor', governor)
+    return governor
+
+
+def scan_manifest(size):
+    # a single partition covering the Gulf of Mexico
+    return {'partitions': {h3.geo_to_h3(28.5, -93.5, 1): {'2023-01': size}}}
+
+
+class TestApp:
     def test_platform_whitelist(self):
         bad_names = [
             '"Airwaves "',
@@ -126,30 +131,552 @@ class TestApp:
         for i in good_names:
             assert date_pattern.match(i), "should accept dates with valid character(s) and format"
 
-    def test_build_sql(self):
-        expected = "(lon > -97.0 and lon < -90.0) and (lat > 27.0 and lat < 30.0) " \
-            "and platform_name in ('Ramform Vanguard','Anonymous') " \
-            "and provider in ('PGS','MacGregor') " \
-            "and time >= date('2023-08-01') and entry_date >= date('2023-01-01')"
-
-        query_params = {
-            'bbox': '-97,27,-90,30',
-            'collection_date_start': '2023-08-01',
-            'platforms': 'Ramform Vanguard,Anonymous',
-            'providers': 'PGS,MacGregor',
-            "archive_date_start": '2023-01-01'
+    def test_lambda_handler(self, monkeypatch, athena_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'providers': 'PGS', 'collection_date_start': '2023-08-01'}
         }
 
-        where_clauses = app.filters_to_where_clause(query_params)
+        response = app.lambda_handler(event, None)
+
+        assert response['statusCode'] == 200
+        assert json.loads(response['body']) == {'count': '1234'}
+        assert response['headers']['Age'] == '0'
+        assert client.query_string.endswith("where provider in (?) and time >= date(?)")
+        assert client.execution_parameters == ["'PGS'", "'2023-08-01'"]
+
+        # repeat request answered from cache
+        client.query_string = None
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '1234'}
+        assert client.query_string is None
+
+        # a malformed date is rejected rather than counting every date
+        for date in ['2023-08', '2023-02-30']:
+            event['queryStringParameters'] = {'providers': 'PGS', 'collection_date_start': date}
+            response = app.lambda_handler(event, None)
+            assert response['statusCode'] == 400
+            assert 'invalid date' in json.loads(response['body'])['message']
+        assert client.query_string is None
+
+    def test_lambda_handler_count_cube(self, monkeypatch, athena_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        cube = CountCube.from_rows([(-97, 27, month_index(2023, 1), 'PGS', 'Ramform Vanguard', 100)])
+        monkeypatch.setattr(app, 'count_cube', cube)
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-90,30', 'providers': 'PGS'}
+        }
+
+        # dated by the snapshot
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '100', 'as_of': cube.created}
+        assert 'Last-Modified' in response['headers']
+        assert client.query_string is None
+
+        # an old snapshot is passed over for Athena
+        cube.created = '2024-01-01T00:00:00+00:00'
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '1234'}
+        assert client.query_string is not None
+
+    def test_create_summary_sql(self):
+        filters = {'bbox': '-97,27,-90,30', 'providers': 'PGS', 'archive_date_start': '2023-01-01'}
+        sql, params = app.create_summary_sql(filters)
+        cells = interior_cells([-97, 27, -90, 30], app.SUMMARY_H3_RESOLUTION)
+        cell_list = ','.join([str(int(i, 16)) for i in cells])
+        h3_clause, partitions = partition_clause([-97, 27, -90, 30])
+
+        assert len(cells) > 0
+        assert f"from dcdb.csb_h3_daily_counts where h3_cell in ({cell_list}) " \
+               f"and provider in (?) and entry_date >= date(?)" in sql
+        # edge area counted exactly from the point table
+        assert f"from dcdb.csb_parquet where (lon > ? and lon < ?) and (lat > ? and lat < ?) " \
+               f"and {h3_clause} and provider in (?) and entry_date >= date(?) " \
+               f"and h3_latlng_to_cell(lat, lon, 3) not in ({cell_list}) and entry_date <= " in sql
+        # as are points archived since the summary was updated
+        assert f"from dcdb.csb_parquet where (lon > ? and lon < ?) and (lat > ? and lat < ?) " \
+               f"and {h3_clause} and provider in (?) and entry_date >= date(?) and entry_date > " in sql
+        bbox_params = [-97, -90, 27, 30] + partitions + ['PGS', '2023-01-01']
+        assert params == ['PGS', '2023-01-01'] + bbox_params + bbox_params
+
+    def test_create_summary_sql_bounds_edge(self):
+        bbox = [-120, 0, -60, 40]
+        sql, params = app.create_summary_sql({'bbox': '-120,0,-60,40'})
+        inner = inner_bbox(bbox, app.SUMMARY_H3_RESOLUTION)
+        _, partitions = partition_clause(bbox)
+        _, edge_partitions = partition_clause([-120, 0, -60, inner[1]], [-120, inner[3], -60, 40],
+                                              [-120, inner[1], inner[0], inner[3]], [inner[2], inner[1], -60, inner[3]])
+
+        # the edge count skips the inner bbox and the partitions only it covers
+        assert "not (lon > ? and lon < ? and lat > ? and lat < ?) and h3_latlng_to_cell(lat, lon, 3) not in (" in sql
+        assert len(edge_partitions) < len(partitions)
+        assert params == [-120, -60, 0, 40] + edge_partitions + [inner[0], inner[2], inner[1], inner[3]] + \
+               [-120, -60, 0, 40] + partitions
+
+    def test_create_summary_sql_without_bbox(self):
+        sql, params = app.create_summary_sql({})
+        assert 'from dcdb.csb_h3_daily_counts where entry_date <= ' in sql
+        assert 'from dcdb.csb_parquet where entry_date > ' in sql
+
+    def test_create_summary_sql_not_applicable(self):
+        # collection date is not in the summary table
+        assert app.create_summary_sql({'bbox': '-97,27,-90,30', 'collection_date_start': '2023-01-01'}) is None
+        # no H3 cell fits entirely within a small bbox
+        assert app.create_summary_sql({'bbox': '-97,27,-96.9,27.1'}) is None
+        assert app.create_summary_sql({'bbox': '-97,27,-100,30'}) is None
+
+    def test_sample_percent(self):
+        # small boxes stay exact
+        assert app.sample_percent({'bbox': '-97,27,-95,29'}) == 100
+        assert app.sample_percent({'bbox': '-97,27,-87,37'}) == 4.0
+        assert app.sample_percent({}) == app.MIN_SAMPLE_PERCENT
+        assert app.sample_percent({'bbox': 'bad'}) == app.MIN_SAMPLE_PERCENT
+
+    def test_create_sample_sql(self):
+        sql, params = app.create_sample_sql({'bbox': '-97,27,-87,37', 'providers': 'PGS'}, 4.0)
+        h3_clause, partitions = partition_clause([-97, 27, -87, 37])
+        assert sql == "select count(*) from dcdb.csb_parquet tablesample bernoulli (4.0) " \
+                      "where (lon > ? and lon < ?) and (lat > ? and lat < ?) " \
+                      f"and {h3_clause} and provider in (?)"
+        assert params == [-97, -87, 27, 37] + partitions + ['PGS']
+
+    def test_estimate_from_sample(self):
+        body = app.estimate_from_sample(400, 4.0)
+        assert body['count'] == '10000'
+        assert body['sample_percent'] == 4.0
+        # standard error sqrt(400 * 0.96) / 0.04 = ~490
+        low, high = body['confidence_interval']
+        assert 9030 < low < 9050
+        assert 10950 < high < 10970
+
+        body = app.estimate_from_sample(0, 1.0)
+        assert body['count'] == '0'
+        assert body['confidence_interval'] == [0, 300]
+
+    def test_lambda_handler_approx(self, monkeypatch, athena_client):
+        client = athena_client
+        client.count = '50'
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-87,37', 'collection_date_start': '2023-08-01', 'mode': 'approx'}
+        }
+
+        response = app.lambda_handler(event, None)
+
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 200
+        assert body['count'] == '1250'
+        assert body['approximate'] is True
+        assert 'tablesample bernoulli (4.0)' in client.query_string
+
+        # approximate result is not returned for an exact request
+        del event['queryStringParameters']['mode']
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '50'}
+        assert 'tablesample' not in client.query_string
+
+    def test_lambda_handler_approx_small_bbox_is_exact(self, monkeypatch, athena_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-96,28', 'collection_date_start': '2023-08-01', 'mode': 'approx'}
+        }
+
+        response = app.lambda_handler(event, None)
+
+        assert json.loads(response['body']) == {'count': '1234'}
+        assert 'tablesample' not in client.query_string
+
+    def test_parse_filter_sets(self):
+        body = json.dumps({'filter_sets': [
+            {'name': 'gulf', 'bbox': '-97,27,-90,30', 'providers': 'PGS'},
+            {'name': 'all'}
+        ]})
+        names, filter_sets = app.parse_filter_sets(body)
+        assert names == ['gulf', 'all']
+        assert filter_sets == [{'bbox': '-97.0,27.0,-90.0,30.0', 'providers': 'PGS'}, {}]
+
+    def test_parse_filter_sets_invalid(self):
+        invalid = [
+            None,
+            'not json',
+            json.dumps({'filter_sets': []}),
+            json.dumps({'filter_sets': [{'name': 'a'}] * 2}),
+            json.dumps({'filter_sets': [{'name': 'a;drop'}]}),
+            json.dumps({'filter_sets': [{'name': 'a', 'bbox': [-97, 27, -90, 30]}]}),
+            json.dumps({'filter_sets': [{'name': 'a', 'bbox': '-97,27,-100,30'}]}),
+            json.dumps({'filter_sets': [{'name': 'a', 'archive_date_end': '2023'}]}),
+            json.dumps({'filter_sets': [{'name': str(i)} for i in range(app.MAX_FILTER_SETS + 1)]})
+        ]
+        for body in invalid:
+            with pytest.raises(app.IllegalArgumentException):
+                app.parse_filter_sets(body)
+
+    def test_create_batch_sql(self):
+        filter_sets = [{'bbox': '-97,27,-90,30', 'providers': 'PGS'}, {'bbox': '-95,28,-94,29'}]
+        sql, params = app.create_batch_sql(filter_sets)
+        h3_clause, partitions = partition_clause([-97, 27, -90, 30], [-95, 28, -94, 29])
+
+        assert sql.startswith("select count_if((lon > ? and lon < ?) and (lat > ? and lat < ?) ")
+        assert "and provider in (?)) as c0, count_if((lon > ? and lon < ?) " in sql
+        assert sql.endswith(f"as c1 from dcdb.csb_parquet where {h3_clause}")
+        # parameters in placeholder order: each filter set, then the partitions
+        assert params[-len(partitions):] == partitions
+        assert params[:-len(partitions)].count('PGS') == 1
+        # a filter set without a bbox needs every partition
+        sql, params = app.create_batch_sql([{}, {'bbox': '-95,28,-94,29'}])
+        assert sql.startswith('select count_if(true) as c0')
+        assert ' where ' not in sql.split('as c1')[1]
+
+    def test_lambda_handler_batch(self, monkeypatch, athena_client):
+        client = athena_client
+        client.count = '10'
+        client.columns = 2
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'POST'}},
+            'body': json.dumps({'filter_sets': [
+                {'name': 'gulf', 'bbox': '-97,27,-90,30'},
+                {'name': 'pgs', 'providers': 'PGS'}
+            ]})
+        }
+
+        response = app.lambda_handler(event, None)
+
+        assert response['statusCode'] == 200
+        assert json.loads(response['body']) == {'counts': {'gulf': '10', 'pgs': '11'}}
+        assert client.query_string.count('count_if') == 2
+
+        event['body'] = json.dumps({'filter_sets': 'gulf'})
+        assert app.lambda_handler(event, None)['statusCode'] == 400
+
+    def test_parse_facets(self):
+        assert app.parse_facets(None) == ['month', 'provider', 'cell']
+        assert app.parse_facets({'facets': 'cell, month'}) == ['month', 'cell']
+        with pytest.raises(app.IllegalArgumentException):
+            app.parse_facets({'facets': 'month,depth'})
+
+    def test_grouping_id(self):
+        # grouping() sets a bit for each column outside of the grouping set
+        assert app.grouping_id('month') == 0b0111
+        assert app.grouping_id('provider') == 0b1011
+        assert app.grouping_id('cell') == 0b1100
 
-        assert ' and '.join(where_clauses) == expected
+    def test_create_histogram_sql(self):
+        sql, params = app.create_histogram_sql({'providers': 'PGS'}, ['month', 'cell'])
+
+        assert "from dcdb.csb_parquet where provider in (?))" in sql
+        assert params == ['PGS']
+        assert sql.endswith("group by grouping sets ((month), (lon, lat)) order by 1, 2, 3, 4, 5")
+
+    def test_lambda_handler_histogram(self, monkeypatch, athena_client, s3_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        s3_client.content = HISTOGRAM_CSV
+        monkeypatch.setattr(app, 's3', s3_client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'rawPath': '/count/histogram',
+            'queryStringParameters': {'providers': 'PGS'}
+        }
+
+        response = app.lambda_handler(event, None)
+
+        assert response['statusCode'] == 200
+        assert json.loads(response['body']) == {
+            'month': {'month': ['2023-01', '2023-02'], 'count': [10, 20]},
+            'provider': {'provider': ['PGS'], 'count': [30]},
+            'cell': {'lon': [-97, -96], 'lat': [27, 27], 'count': [25, 5]}
+        }
+        assert 'grouping sets ((month), (provider), (lon, lat))' in client.query_string
+
+        event['queryStringParameters']['facets'] = 'depth'
+        assert app.lambda_handler(event, None)['statusCode'] == 400
+
+        # a self-intersecting polygon is rejected before querying
+        client.query_string = None
+        bowtie = {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 30], [-90, 27], [-97, 30], [-97, 27]]]}
+        event['queryStringParameters'] = {'polygon': json.dumps(bowtie)}
+        response = app.lambda_handler(event, None)
+        assert response['statusCode'] == 400
+        assert 'intersect' in json.loads(response['body'])['message']
+        event['queryStringParameters'] = {'archive_date_start': 'yesterday'}
+        assert app.lambda_handler(event, None)['statusCode'] == 400
+        assert client.query_string is None
+
+    def test_lambda_handler_scan_estimate(self, monkeypatch, athena_client, stub_snapshot):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(scan_manifest(1024)))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-90,30', 'collection_date_start': '2023-08-01'}
+        }
+
+        response = app.lambda_handler(event, None)
+
+        assert response['statusCode'] == 200
+        assert response['headers']['X-Scan-Estimate-Bytes'] == '1024'
+        assert response['headers']['X-Scan-Estimate-Partitions'] == '1'
+
+    def test_lambda_handler_over_scan_budget(self, monkeypatch, athena_client, stub_snapshot):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        monkeypatch.setattr(app, 'job_store', MemoryJobStore())
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(scan_manifest(app.SCAN_BUDGET_BYTES + 1)))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-90,30'}
+        }
+
+        # run as a job rather than synchronously
+        response = app.lambda_handler(event, None)
+        assert response['statusCode'] == 202
+        assert response['headers']['X-Scan-Estimate-Bytes'] == str(app.SCAN_BUDGET_BYTES + 1)
+        assert 'job_id' in json.loads(response['body'])
+
+        # sampling reads every partition, so an approximate count is not started as a job
+        client.query_string = None
+        event['queryStringParameters'] = {'bbox': '-97,27,-87,37', 'mode': 'approx'}
+        response = app.lambda_handler(event, None)
+        assert response['statusCode'] == 413
+        assert json.loads(response['body'])['scan_budget_bytes'] == app.SCAN_BUDGET_BYTES
+        assert client.query_string is None
+
+    def test_lambda_handler_throttled(self, monkeypatch, governor, athena_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        governor.limits[INTERACTIVE] = 1
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'providers': 'PGS', 'collection_date_start': '2023-08-01'}
+        }
+
+        # answered right away while another query holds the only slot
+        slot = governor.acquire(INTERACTIVE)
+        response = app.lambda_handler(event, None)
+        assert response['statusCode'] == 429
+        assert response['headers']['Retry-After']
+        assert client.query_string is None
+
+        governor.release(slot)
+        assert app.lambda_handler(event, None)['statusCode'] == 200
+        # released once the query completes
+        assert governor.acquire(INTERACTIVE)
+
+    def test_job_holds_async_slot_until_complete(self, monkeypatch, governor, athena_client):
+        monkeypatch.setattr(app, 'athena', athena_client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        monkeypatch.setattr(app, 'job_store', MemoryJobStore())
+        governor.limits[ASYNC_JOB] = 1
+
+        def request(bbox):
+            return {
+                'requestContext': {'http': {'method': 'GET'}},
+                'queryStringParameters': {'bbox': bbox, 'async': 'true'}
+            }
+
+        response = app.lambda_handler(request('-97,27,-90,30'), None)
+        assert response['statusCode'] == 202
+        assert app.lambda_handler(request('-97,27,-91,30'), None)['statusCode'] == 429
+        # orders are not blocked by API jobs
+        assert governor.acquire(EXTRACT)
+
+        job_id = json.loads(response['body'])['job_id']
+        poll = {'requestContext': {'http': {'method': 'GET'}}, 'pathParameters': {'job_id': job_id}}
+        assert app.lambda_handler(poll, None)['statusCode'] == 200
+        assert app.lambda_handler(request('-97,27,-91,30'), None)['statusCode'] == 202
+
+    def test_lambda_handler_over_max_scan(self, monkeypatch, athena_client, stub_snapshot):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(scan_manifest(app.MAX_SCAN_BYTES + 1)))
+        event = {
+            'requestContext': {'http': {'method': 'POST'}},
+            'body': json.dumps({'filter_sets': [{'name': 'gulf', 'bbox': '-97,27,-90,30'}]})
+        }
+
+        response = app.lambda_handler(event, None)
+
+        body = json.loads(response['body'])
+        assert response['statusCode'] == 413
+        assert body['scan_estimate'] == {'bytes': app.MAX_SCAN_BYTES + 1, 'partitions': 1}
+        assert client.query_string is None
+
+    def test_lambda_handler_polygon(self, monkeypatch, athena_client):
+        client = athena_client
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        polygon = {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 30], [-97, 27]]]}
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'polygon': json.dumps(polygon)}
+        }
+
+        response = app.lambda_handler(event, None)
+
+        assert response['statusCode'] == 200
+        h3_clause, cells = partition_clause(polygon)
+        assert f"and {h3_clause} and ST_Contains(ST_GeometryFromText('POLYGON ((-97.0 27.0, " in client.query_string
+        assert client.execution_parameters[4:] == [f"'{i}'" for i in cells]
+
+        event['queryStringParameters']['polygon'] = json.dumps({'type': 'Polygon', 'coordinates': [[[-97, 27]]]})
+        assert app.lambda_handler(event, None)['statusCode'] == 400
+
+    def test_create_batch_sql_polygon(self):
+        polygon = {'type': 'Polygon', 'coordinates': [[[-60, -40], [-59.5, -40], [-20, 0], [-20.5, 0], [-60, -40]]]}
+        filter_sets = [{'polygon': json.dumps(polygon)}, {'bbox': '-95,28,-94,29'}]
+        sql, params = app.create_batch_sql(filter_sets)
+
+        assert 'ST_Contains' in sql.split(' as c0')[0]
+        assert sql.endswith(f"as c1 from dcdb.csb_parquet where {partition_clause(polygon, [-95, 28, -94, 29])[0]}")
+        with pytest.raises(app.IllegalArgumentException):
+            app.parse_filter_sets(json.dumps({'filter_sets': [{'name': 'a', 'polygon': '[]'}]}))
+
+    def test_sample_percent_polygon(self):
+        polygon = {'type': 'Polygon', 'coordinates': [[[-97, 27], [-87, 27], [-87, 37], [-97, 27]]]}
+        assert app.sample_percent({'polygon': json.dumps(polygon)}) == 4.0
+
+    def test_create_tile_sql(self, tile_cache, monkeypatch, stub_snapshot):
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot({'latest_entry_date': '2023-01-31', 'partitions': {}}))
+        filters = {'bbox': '-97.0,27.0,-90.0,30.0', 'providers': 'PGS'}
+        interior, tiles = decompose([-97, 27, -90, 30])
+        remainder = 'remainder/-97.0,27.0,-90.0,30.0'
+
+        sql, params, fetch_params = app.create_tile_sql(filters)
+        assert sql.startswith("select count_if(not (lon >= ? and lon < ? and lat >= ? and lat < ?)), "
+                              "count_if((lon >= ? and lon < ? and lat >= ? and lat < ?))")
+        assert sql.count('count_if') == len(tiles) + 1
+        assert 'and provider in (?) and (not (lon >= ? and lon < ? and lat >= ? and lat < ?) or ' in sql
+        assert params[:4] == [interior[0], interior[2], interior[1], interior[3]]
+        assert fetch_params['tile_counts']['tiles'] == [remainder] + tiles
+
+        # tiles counted by another bbox with the same filters are not read
+        tile_cache.put_many({app.tile_key({'providers': 'PGS'}, i, '2023-01-31'): 10 for i in tiles[1:]})
+        sql, params, fetch_params = app.create_tile_sql(filters)
+        assert sql.count('count_if') == 2
+        assert sql.endswith("and provider in (?) and (not (lon >= ? and lon < ? and lat >= ? and lat < ?) "
+                            "or (lon >= ? and lon < ? and lat >= ? and lat < ?))")
+        bounds = tile_bounds(tiles[0])
+        column_params = [interior[0], interior[2], interior[1], interior[3], bounds[0], bounds[2], bounds[1], bounds[3]]
+        assert params[:8] == column_params
+        assert params[-9:] == ['PGS'] + column_params
+        assert fetch_params['tile_counts'] == {'cached': 10 * (len(tiles) - 1), 'tiles': [remainder, tiles[0]],
+                                               'filters': filters, 'version': '2023-01-31'}
+
+        # answered without a query once every part is cached
+        tile_cache.put_many({app.tile_key({'providers': 'PGS'}, i, '2023-01-31'): 1 for i in [remainder, tiles[0]]})
+        sql, params, fetch_params = app.create_tile_sql(filters)
+        assert sql is None
+        assert fetch_params['tile_counts']['cached'] == 10 * (len(tiles) - 1) + 2
+
+        # counts are not reused once more data is ingested
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot({'latest_entry_date': '2023-02-01', 'partitions': {}}))
+        sql, params, fetch_params = app.create_tile_sql(filters)
+        assert sql.count('count_if') == len(tiles) + 1
+
+        # nor without a data version
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+        sql, params, fetch_params = app.create_tile_sql(filters)
+        assert sql.count('count_if') == len(tiles) + 1
+        assert fetch_params['tile_counts']['version'] is None
+
+    def test_create_tile_sql_not_applicable(self):
+        assert app.create_tile_sql({}) is None
+        assert app.create_tile_sql({'bbox': '-97,27,-96.9,27.1'}) is None
+        assert app.create_tile_sql({'bbox': '-97,27,-100,30'}) is None
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 30], [-97, 27]]]})
+        assert app.create_tile_sql({'bbox': '-97,27,-90,30', 'polygon': polygon}) is None
+
+    def test_lambda_handler_tile_counts(self, monkeypatch, tile_cache, athena_client, stub_snapshot):
+        client = athena_client
+        client.count = '5'
+        client.columns = 3
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot({'latest_entry_date': '2023-01-31', 'partitions': {}}))
+        # a bbox of two tiles
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-0.1,-0.1,90,90', 'collection_date_start': '2023-08-01'}
+        }
+        assert decompose([-0.1, -0.1, 90, 90])[1] == ['2/2/2', '2/2/3']
+
+        response = app.lambda_handler(event, None)
+
+        # remainder of 5 and tiles of 6 and 7
+        assert json.loads(response['body']) == {'count': '18'}
+        filters = {'collection_date_start': '2023-08-01'}
+        assert tile_cache.get(app.tile_key(filters, '2/2/2', '2023-01-31'))[0] == 6
+        assert tile_cache.get(app.tile_key(filters, '2/2/3', '2023-01-31'))[0] == 7
+
+        # overlapping bbox reuses the tile counts, counting only its remainder
+        client.columns = 1
+        event['queryStringParameters']['bbox'] = '-0.2,-0.1,90,90'
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '18'}
+        assert client.query_string.count('count_if') == 1
+
+        # and once its result is no longer cached, the same bbox is answered without a query
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        client.query_string = None
+        response = app.lambda_handler(event, None)
+        assert json.loads(response['body']) == {'count': '18'}
+        assert client.query_string is None
+
+    def test_lambda_handler_summary_before_tiles(self, monkeypatch, athena_client):
+        client = athena_client
+        client.count = '5'
+        client.columns = 3
+        monkeypatch.setattr(app, 'athena', client)
+        monkeypatch.setattr(app, 'result_cache', ResultCache(MemoryCacheStore()))
+        monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+        event = {
+            'requestContext': {'http': {'method': 'GET'}},
+            'queryStringParameters': {'bbox': '-97,27,-90,30'}
+        }
+        # the bbox could be answered either way
+        assert app.create_summary_sql({'bbox': '-97,27,-90,30'})
+        assert app.create_tile_sql({'bbox': '-97,27,-90,30'})
 
-    def test_sql_quote_and_escape(self):
-        platforms = ["Hi'ialakai", "Surveyor"]
-        expected = ["'Hi''ialakai'", "'Surveyor'"]
+        app.lambda_handler(event, None)
+        assert app.SUMMARY_TABLE in client.query_string
+        assert 'count_if' not in client.query_string
 
-        assert app.sql_quote_and_escape(platforms[0]) == expected[0]
-        assert app.sql_quote_and_escape(platforms[1]) == expected[1]
+        # collection dates are not in the summary table
+        event['queryStringParameters']['collection_date_start'] = '2023-08-01'
+        app.lambda_handler(event, None)
+        assert app.SUMMARY_TABLE not in client.query_string
+        assert 'count_if' in client.query_string
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+import base64
+import gzip
+import json
+import pytest
+from count_cube import CountCube, month_index
+from extract_points import app
+from query_governor import QueryGovernor, INTERACTIVE
+from single_flight import MemoryLeaseStore
+
+POINTS_CSV = """"lon","lat","depth","time","platform_name","provider","unique_id","file_uuid"
+"-90.05","29.95","12.5","2023-01-02 03:04:05.000","Ramform Vanguard","PGS","abc","f1"
+"-90.04","29.96","","2023-01-02 03:04:06.000","Ramform Vanguard","PGS","abc","f1"
+"-90.03","29.97","13.0","2023-01-02 03:04:07.000","Ramform Vanguard","PGS","abc","f1"
+"""
+
+
+@pytest.fixture()
+def athena(monkeypatch, athena_client, s3_client, stub_snapshot):
+    monkeypatch.setattr(app, 'athena', athena_client)
+    s3_client.content = POINTS_CSV
+    monkeypatch.setattr(app, 's3', s3_client)
+    monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+    monkeypatch.setattr(app, 'count_cube', None)
+    monkeypatch.setattr(app, 'governor', QueryGovernor(MemoryLeaseStore()))
+    return athena_client
+
+
+def request(accept_encoding='gzip', **query_params):
+    return {
+        'requestContext': {'http': {'method': 'GET'}},
+        'headers': {'accept-encoding': accept_encoding},
+        'queryStringParameters': query_params
+    }
+
+
+def points(response):
+    return gzip.decompress(base64.b64decode(response['body'])).decode('utf-8')
+
+
+class TestApp:
+    def test_csv(self, athena):
+        response = app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0', providers='PGS'), None)
+
+        assert response['statusCode'] == 200
+        assert response['isBase64Encoded']
+        assert response['headers']['Content-Type'] == 'text/csv'
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        assert response['headers']['X-Point-Count'] == '3'
+        lines = points(response).splitlines()
+        assert lines[0] == 'lon,lat,depth,time,platform_name,provider,unique_id,file_uuid'
+        assert lines[2] == '-90.04,29.96,,2023-01-02 03:04:06.000,Ramform Vanguard,PGS,abc,f1'
+
+        assert athena.query_string.endswith(f' limit {app.MAX_POINTS + 1}')
+        assert 'provider in (?)' in athena.query_string
+        assert athena.execution_parameters[-1] == "'PGS'"
+
+    def test_ndjson(self, athena):
+        response = app.lambda_handler(request(accept_encoding='', bbox='-90.1,29.9,-90.0,30.0', format='ndjson'), None)
+
+        assert response['headers']['Content-Type'] == 'application/gzip'
+        assert 'Content-Encoding' not in response['headers']
+        assert response['headers']['Content-Disposition'] == 'attachment; filename="points.ndjson.gz"'
+        records = [json.loads(i) for i in points(response).splitlines()]
+        assert len(records) == 3
+        assert records[0]['lon'] == -90.05
+        assert records[0]['provider'] == 'PGS'
+        assert records[1]['depth'] is None
+
+    def test_compact(self, athena):
+        app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0', compact='true'), None)
+        assert athena.query_string.startswith('select lon,lat,depth,time from ')
+
+    def test_too_many_points(self, athena, monkeypatch):
+        monkeypatch.setattr(app, 'MAX_POINTS', 2)
+        response = app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0'), None)
+
+        assert response['statusCode'] == 413
+        assert json.loads(response['body'])['max_points'] == 2
+        assert athena.query_string.endswith(' limit 3')
+
+    def test_precount_rejects(self, athena, monkeypatch):
+        cube = CountCube.from_rows([(-91, 29, month_index(2023, 1), 'PGS', 'Ramform Vanguard', 200_000)])
+        monkeypatch.setattr(app, 'count_cube', cube)
+
+        response = app.lambda_handler(request(bbox='-91,29,-90,30'), None)
+        assert response['statusCode'] == 413
+        assert json.loads(response['body'])['count'] == 200_000
+        # rejected without querying Athena
+        assert athena.query_string is None
+
+        # most of the cell
+        response = app.lambda_handler(request(bbox='-90.9,29.1,-90.05,29.95'), None)
+        assert response['statusCode'] == 413
+        assert json.loads(response['body'])['count'] == 144_500
+        assert athena.query_string is None
+
+        # a small part of the cell is limited by the query
+        assert app.precount({'bbox': '-90.1,29.9,-90.0,30.0'}) == 2000
+        response = app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0'), None)
+        assert response['statusCode'] == 200
+
+    def test_precount(self, monkeypatch):
+        cube = CountCube.from_rows([
+            (-91, 29, month_index(2023, 1), 'PGS', 'Ramform Vanguard', 200_000),
+            (-90, 29, month_index(2023, 1), 'MacGregor', 'Anonymous', 50)
+        ])
+        monkeypatch.setattr(app, 'count_cube', cube)
+
+        # exact
+        assert app.precount({'bbox': '-91,29,-89,30', 'providers': 'MacGregor'}) == 50
+        # upper bound within the budget
+        assert app.precount({'bbox': '-89.5,29.1,-89.4,29.2'}) == 50
+        # upper bound over the budget, scaled by area
+        assert app.precount({'bbox': '-91,29.5,-89,29.6'}) == 20_005
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [[[-91, 29], [-90.5, 29], [-90.5, 29.5], [-91, 29]]]})
+        assert app.precount({'bbox': '-91,29,-90,30', 'polygon': polygon}) == 50_000
+        # not counted by the cube
+        assert app.precount({'bbox': '-90.5,29.5,-89.5,29.6', 'unique_id': 'abc'}) is None
+        assert app.precount({'bbox': '-89.5,29.1,-89.4,29.2', 'unique_id': 'abc'}) == 50
+        monkeypatch.setattr(app, 'count_cube', None)
+        assert app.precount({'bbox': '-91,29,-89,30'}) is None
+
+    def test_over_query_limit(self, athena, monkeypatch):
+        monkeypatch.setattr(app, 'MAX_POINTS', 2)
+        body = json.loads(app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0'), None)['body'])
+        # the query only tells there are more than max_points
+        assert body == {'message': 'request matches more than 2 points, place an order instead', 'max_points': 2}
+
+    def test_invalid_request(self, athena):
+        assert app.lambda_handler(request(providers='PGS'), None)['statusCode'] == 400
+        assert app.lambda_handler(request(bbox='-90.1,29.9,-90.0'), None)['statusCode'] == 400
+        assert app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0', format='xml'), None)['statusCode'] == 400
+        assert app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0', collection_date_end='2023-13-01'),
+                                  None)['statusCode'] == 400
+        assert athena.query_string is None
+
+    def test_throttled(self, athena, monkeypatch):
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 0})
+        monkeypatch.setattr(app, 'governor', governor)
+        response = app.lambda_handler(request(bbox='-90.1,29.9,-90.0,30.0'), None)
+        assert response['statusCode'] == 429
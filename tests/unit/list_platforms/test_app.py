@@ -0,0 +1,204 @@
+import base64
+import gzip
+import json
+import h3
+import pytest
+import http_response
+from list_platforms import app
+from query_jobs import MemoryJobStore
+from query_builder import partition_clause
+from result_cache import ResultCache
+from single_flight import SingleFlight, MemoryLeaseStore
+from query_governor import QueryGovernor
+from platform_index import CatalogIndex
+
+CSV_OUTPUT = '"provider","platform_name"\n' + ''.join([f'"PGS","Vessel {i:04d}"\n' for i in range(2500)])
+
+
+CATALOG = {
+    'created': '2024-01-01T00:00:00+00:00',
+    'platforms': [
+        {'provider': 'MacGregor', 'platform': 'AIDAdiva', 'point_count': 10, 'first_date': '2020-01-01', 'last_date': '2021-01-01'},
+        {'provider': 'PGS', 'platform': 'Ramform Atlas', 'point_count': 20, 'first_date': '2020-01-01', 'last_date': '2021-01-01'}
+    ]
+}
+
+
+@pytest.fixture()
+def client(monkeypatch, athena_client, s3_client, stub_snapshot):
+    monkeypatch.setattr(app, 'athena', athena_client)
+    s3_client.content = CSV_OUTPUT
+    monkeypatch.setattr(app, 's3', s3_client)
+    monkeypatch.setattr(app, 'result_cache', ResultCache())
+    monkeypatch.setattr(app, 'single_flight', SingleFlight(MemoryLeaseStore()))
+    monkeypatch.setattr(app, 'governor', QueryGovernor(MemoryLeaseStore()))
+    monkeypatch.setattr(app, 'platform_catalog', stub_snapshot())
+    monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+    return athena_client
+
+
+def request(query_params):
+    return {
+        'requestContext': {'http': {'method': 'GET'}},
+        'queryStringParameters': query_params
+    }
+
+
+class TestApp:
+    def test_catalog_snapshot(self, client, monkeypatch, stub_snapshot):
+        monkeypatch.setattr(app, 'platform_catalog', stub_snapshot(CATALOG))
+
+        body = json.loads(app.lambda_handler(request({}), None)['body'])
+        assert body == {'count': 2, 'data': [
+            {'provider': 'MacGregor', 'platform': 'AIDAdiva'},
+            {'provider': 'PGS', 'platform': 'Ramform Atlas'}
+        ]}
+
+        body = json.loads(app.lambda_handler(request({'providers': 'PGS'}), None)['body'])
+        assert body == {'count': 1, 'data': [{'provider': 'PGS', 'platform': 'Ramform Atlas'}]}
+        assert client.queries == []
+
+        # other filters still require Athena
+        app.lambda_handler(request({'providers': 'PGS', 'collection_date_start': '2020-01-01'}), None)
+        assert len(client.queries) == 1
+
+    def test_catalog_snapshot_is_paged(self, client, monkeypatch, stub_snapshot):
+        catalog = {
+            'created': CATALOG['created'],
+            'platforms': [{'provider': 'PGS', 'platform': f'Vessel {i:04d}'} for i in range(2500)] +
+                         [{'provider': 'MacGregor', 'platform': 'AIDAdiva'}]
+        }
+        snapshot = stub_snapshot(catalog)
+        monkeypatch.setattr(app, 'platform_catalog', snapshot)
+
+        body = json.loads(app.lambda_handler(request({}), None)['body'])
+        assert body['count'] == app.MAX_PAGE_SIZE
+
+        query_params = {'providers': 'PGS', 'limit': '1000'}
+        platforms = []
+        while True:
+            body = json.loads(app.lambda_handler(request(query_params), None)['body'])
+            platforms += [i['platform'] for i in body['data']]
+            if 'next_cursor' not in body:
+                break
+            query_params = {'cursor': body['next_cursor'], 'limit': '1000'}
+        assert platforms == [f'Vessel {i:04d}' for i in range(2500)]
+        assert client.queries == []
+
+        # a cursor into an older snapshot is rejected rather than skipping platforms
+        cursor = json.loads(app.lambda_handler(request({}), None)['body'])['next_cursor']
+        snapshot.value = catalog | {'created': '2024-01-02T00:00:00+00:00'}
+        assert app.lambda_handler(request({'cursor': cursor}), None)['statusCode'] == 400
+
+    def test_search(self, client, monkeypatch, stub_snapshot):
+        monkeypatch.setattr(app, 'platform_index', CatalogIndex(stub_snapshot(CATALOG)))
+
+        def search(query_params):
+            event = request(query_params)
+            event['rawPath'] = '/platforms/search'
+            return app.lambda_handler(event, None)
+
+        response = search({'q': 'atl'})
+        assert response['statusCode'] == 200
+        assert json.loads(response['body']) == {'count': 1, 'data': [{'provider': 'PGS', 'platform': 'Ramform Atlas'}]}
+        assert json.loads(search({'q': 'a', 'providers': 'MacGregor'})['body'])['count'] == 1
+        assert search({'q': 'a', 'limit': '1000'})['statusCode'] == 400
+        assert search({})['statusCode'] == 400
+        assert client.queries == []
+
+        monkeypatch.setattr(app, 'platform_index', CatalogIndex(stub_snapshot()))
+        assert search({'q': 'atl'})['statusCode'] == 503
+
+    def test_listing_is_not_truncated(self, client):
+        response = app.lambda_handler(request({}), None)
+        body = json.loads(response['body'])
+
+        # pages of the default size when no limit is given
+        assert response['statusCode'] == 200
+        assert body['count'] == app.MAX_PAGE_SIZE
+        assert body['data'][0] == {'provider': 'PGS', 'platform': 'Vessel 0000'}
+
+        platforms = [i['platform'] for i in body['data']]
+        while 'next_cursor' in body:
+            body = json.loads(app.lambda_handler(request({'cursor': body['next_cursor']}), None)['body'])
+            platforms += [i['platform'] for i in body['data']]
+        assert platforms == [f'Vessel {i:04d}' for i in range(2500)]
+
+    def test_job_result_is_paged(self, client, monkeypatch):
+        monkeypatch.setattr(app, 'job_store', MemoryJobStore())
+        response = app.lambda_handler(request({'bbox': '-97,27,-90,30', 'async': 'true'}), None)
+        job_id = json.loads(response['body'])['job_id']
+
+        poll = {'requestContext': {'http': {'method': 'GET'}}, 'pathParameters': {'job_id': job_id}}
+        body = json.loads(app.lambda_handler(poll, None)['body'])
+        # stored in the job and cache items
+        assert body['count'] == app.MAX_PAGE_SIZE
+        assert 'next_cursor' in body
+
+        response = app.lambda_handler(request({'bbox': '-97,27,-90,30', 'async': 'true', 'limit': '10'}), None)
+        poll['pathParameters']['job_id'] = json.loads(response['body'])['job_id']
+        body = json.loads(app.lambda_handler(poll, None)['body'])
+        assert body['count'] == 10
+
+    def test_compressed_and_conditional_listing(self, client, monkeypatch):
+        monkeypatch.setattr(http_response, 'brotli', None)
+        event = request({})
+        event['headers'] = {'accept-encoding': 'gzip'}
+        response = app.lambda_handler(event, None)
+
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        body = json.loads(gzip.decompress(base64.b64decode(response['body'])))
+        assert body['count'] == app.MAX_PAGE_SIZE
+
+        event['headers']['if-none-match'] = response['headers']['ETag']
+        response = app.lambda_handler(event, None)
+        assert response['statusCode'] == 304
+        assert response['body'] == ''
+        # served from the result cache
+        assert len(client.queries) == 1
+
+    def test_paging(self, client):
+        platforms = []
+        query_params = {'providers': 'PGS', 'limit': '1000'}
+        while True:
+            body = json.loads(app.lambda_handler(request(query_params), None)['body'])
+            platforms += [i['platform'] for i in body['data']]
+            if 'next_cursor' not in body:
+                break
+            query_params = {'cursor': body['next_cursor'], 'limit': '1000'}
+
+        assert platforms == [f'Vessel {i:04d}' for i in range(2500)]
+        assert len(client.queries) == 1, "subsequent pages should not re-run the query"
+
+    def test_invalid_paging_parameters(self, client):
+        assert app.lambda_handler(request({'limit': '0'}), None)['statusCode'] == 400
+        assert app.lambda_handler(request({'limit': 'all'}), None)['statusCode'] == 400
+        assert app.lambda_handler(request({'cursor': 'bogus'}), None)['statusCode'] == 400
+        assert app.lambda_handler(request({'collection_date_start': '2023'}), None)['statusCode'] == 400
+        assert client.queries == []
+
+    def test_bbox_query_prunes_partitions(self, client):
+        app.lambda_handler(request({'bbox': '-97,27,-90,30'}), None)
+        clause, cells = partition_clause([-97, 27, -90, 30])
+        assert f"and {clause}" in client.queries[-1]
+        assert client.parameters[-1] == ['-97.0', '-90.0', '27.0', '30.0'] + [f"'{i}'" for i in cells]
+
+    def test_scan_budget(self, client, monkeypatch, stub_snapshot):
+        manifest = {'partitions': {h3.geo_to_h3(28.5, -93.5, 1): {'2023-01': app.SCAN_BUDGET_BYTES + 1}}}
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(manifest))
+        monkeypatch.setattr(app, 'job_store', MemoryJobStore())
+
+        # over the budget, run as a job
+        response = app.lambda_handler(request({'bbox': '-97,27,-90,30'}), None)
+        assert response['statusCode'] == 202
+        assert response['headers']['X-Scan-Estimate-Bytes'] == str(app.SCAN_BUDGET_BYTES + 1)
+
+        # elsewhere, reads nothing
+        response = app.lambda_handler(request({'bbox': '10,-5,12,5'}), None)
+        assert response['statusCode'] == 200
+        assert response['headers']['X-Scan-Estimate-Bytes'] == '0'
+
+        manifest['partitions'][h3.geo_to_h3(28.5, -93.5, 1)]['2023-01'] = app.MAX_SCAN_BYTES + 1
+        response = app.lambda_handler(request({'bbox': '-97,27,-90,30', 'async': 'true'}), None)
+        assert response['statusCode'] == 413
+        assert len(client.queries) == 2
@@ -0,0 +1,27 @@
+import pytest
+from query_slot import app
+from query_governor import QueryGovernor, ConcurrencyLimitException, EXTRACT
+from single_flight import MemoryLeaseStore
+
+
+@pytest.fixture()
+def governor(monkeypatch):
+    governor = QueryGovernor(MemoryLeaseStore(), limits={EXTRACT: 1})
+    monkeypatch.setattr(app, 'governor', governor)
+    return governor
+
+
+class TestApp:
+    def test_acquire_and_release(self, governor):
+        slot = app.lambda_handler({'action': 'acquire', 'query_class': 'extract'}, None)['slot']
+        assert slot['key']
+
+        # raised for the state machine to retry
+        with pytest.raises(ConcurrencyLimitException):
+            app.lambda_handler({'action': 'acquire', 'query_class': 'extract'}, None)
+
+        app.lambda_handler({'action': 'release', 'slot': slot}, None)
+        assert app.lambda_handler({'action': 'acquire'}, None)['slot']
+
+    def test_release_ungoverned(self, governor):
+        assert app.lambda_handler({'action': 'release', 'slot': None}, None) == {'slot': None}
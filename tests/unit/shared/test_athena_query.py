@@ -0,0 +1,131 @@
+import json
+import random
+import pytest
+import athena_query
+from athena_query import poll_intervals, run_query, execution_parameters, QueryTimeoutException, QueryFailedException
+
+
+class StubAthenaClient:
+    """stands in for the boto3 Athena client, reporting the given sequence of query states"""
+    def __init__(self, states, statistics=None):
+        self.states = list(states)
+        self.statistics = statistics or {'TotalExecutionTimeInMillis': 300, 'DataScannedInBytes': 1024}
+        self.status_checks = 0
+        self.stopped = []
+        self.query_string = None
+        self.execution_parameters = None
+
+    def start_query_execution(self, QueryString, WorkGroup, ExecutionParameters=None):
+        self.query_string = QueryString
+        self.execution_parameters = ExecutionParameters
+        return {'QueryExecutionId': 'abc-123'}
+
+    def get_query_execution(self, QueryExecutionId):
+        state = self.states[min(self.status_checks, len(self.states) - 1)]
+        self.status_checks += 1
+        status = {'State': state}
+        if state == 'FAILED':
+            status['StateChangeReason'] = 'SYNTAX_ERROR'
+        return {
+            'QueryExecution': {
+                'QueryExecutionId': QueryExecutionId,
+                'Status': status,
+                'Statistics': self.statistics
+            }
+        }
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def __call__(self):
+        return self.now
+
+
+class TestAthenaQuery:
+    def test_poll_intervals(self):
+        intervals = poll_intervals(rng=random.Random(42))
+        values = [next(intervals) for _ in range(20)]
+
+        assert values[:3] == athena_query.FIRST_POLLS, "first polls should be short and fixed"
+        assert all(v <= athena_query.MAX_POLL_INTERVAL for v in values), "intervals should be capped"
+        assert values[-1] >= athena_query.MAX_POLL_INTERVAL / 2, "intervals should back off"
+
+    def test_fast_query_returns_quickly(self):
+        client = StubAthenaClient(['QUEUED', 'RUNNING', 'SUCCEEDED'])
+        clock = FakeClock()
+
+        query_execution = run_query(client, 'select 1', 25, sleep=clock.sleep, clock=clock)
+
+        assert query_execution['QueryExecutionId'] == 'abc-123'
+        assert query_execution['Statistics']['DataScannedInBytes'] == 1024
+        assert client.status_checks == 3
+        assert clock.now < 1, "should not wait a full second for a fast query"
+
+    def test_fewer_status_checks_than_fixed_polling(self, monkeypatch):
+        # the old loop made one status call per second until the 25 second timeout
+        seeded = athena_query.poll_intervals
+        monkeypatch.setattr(athena_query, 'poll_intervals', lambda: seeded(rng=random.Random(42)))
+        client = StubAthenaClient(['RUNNING'])
+        clock = FakeClock()
+        with pytest.raises(QueryTimeoutException):
+            run_query(client, 'select 1', 25, sleep=clock.sleep, clock=clock)
+
+        assert client.status_checks <= 20
+
+    def test_timeout_stops_query(self):
+        client = StubAthenaClient(['RUNNING'])
+        clock = FakeClock()
+
+        with pytest.raises(QueryTimeoutException) as e:
+            run_query(client, 'select 1', 5, sleep=clock.sleep, clock=clock)
+
+        assert client.stopped == ['abc-123']
+        assert e.value.statistics['TotalExecutionTimeInMillis'] == 300
+        assert clock.now == pytest.approx(5)
+
+    def test_failed_query(self):
+        client = StubAthenaClient(['RUNNING', 'FAILED'])
+        clock = FakeClock()
+
+        with pytest.raises(QueryFailedException) as e:
+            run_query(client, 'select 1', 25, sleep=clock.sleep, clock=clock)
+
+        assert e.value.reason == 'SYNTAX_ERROR'
+        assert client.stopped == []
+
+    def test_execution_parameters(self):
+        assert execution_parameters(["Hi'ialakai", '2023-01-01', -97.5, 3]) == \
+               ["'Hi''ialakai'", "'2023-01-01'", '-97.5', '3']
+
+    def test_run_query_with_parameters(self):
+        client = StubAthenaClient(['SUCCEEDED'])
+        run_query(client, 'select count(*) from t where provider = ?', 5, sleep=lambda s: None, params=['PGS'])
+        assert client.execution_parameters == ["'PGS'"]
+
+    def test_statistics_recorded_with_tags(self, capsys):
+        client = StubAthenaClient(['SUCCEEDED'])
+        run_query(client, 'select 1', 5, sleep=lambda s: None, tags={'endpoint': 'count', 'shape': 'bbox'})
+        record = json.loads(capsys.readouterr().out)
+        assert record['endpoint'] == 'count' and record['shape'] == 'bbox'
+        assert record['state'] == 'SUCCEEDED'
+        assert record['DataScannedInBytes'] == 1024
+
+        clock = FakeClock()
+        with pytest.raises(QueryTimeoutException):
+            run_query(StubAthenaClient(['RUNNING']), 'select 1', 5, sleep=clock.sleep, clock=clock,
+                      tags={'endpoint': 'count'})
+        assert json.loads(capsys.readouterr().out)['state'] == 'TIMEOUT'
+
+        # nothing recorded without tags
+        run_query(client, 'select 1', 5, sleep=lambda s: None)
+        assert capsys.readouterr().out == ''
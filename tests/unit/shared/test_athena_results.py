@@ -0,0 +1,43 @@
+import io
+import pytest
+from athena_results import stream_csv_results, read_page, encode_cursor, decode_cursor, InvalidCursorException
+
+
+class StubS3Client:
+    def __init__(self, content):
+        self.content = content
+        self.requested = None
+
+    def get_object(self, Bucket, Key):
+        self.requested = (Bucket, Key)
+        return {'Body': io.BytesIO(self.content.encode('utf-8'))}
+
+
+QUERY_EXECUTION = {
+    'QueryExecutionId': 'abc-123',
+    'ResultConfiguration': {'OutputLocation': 's3://order-pickup/abc-123.csv'}
+}
+
+
+class TestAthenaResults:
+    def test_stream_csv_results(self):
+        s3 = StubS3Client('"provider","platform_name"\n"PGS","Ramform Vanguard"\n"AquaMap","""Airwaves """\n')
+        rows = list(stream_csv_results(s3, QUERY_EXECUTION))
+
+        assert s3.requested == ('order-pickup', 'abc-123.csv')
+        assert rows == [['PGS', 'Ramform Vanguard'], ['AquaMap', '"Airwaves "']]
+
+    def test_stream_csv_results_with_offset(self):
+        s3 = StubS3Client('"n"\n' + ''.join([f'"{i}"\n' for i in range(10)]))
+        assert list(stream_csv_results(s3, QUERY_EXECUTION, offset=8)) == [['8'], ['9']]
+
+    def test_read_page(self):
+        assert read_page(iter(range(5)), 3) == ([0, 1, 2], True)
+        assert read_page(iter(range(3)), 3) == ([0, 1, 2], False)
+
+    def test_cursor(self):
+        assert decode_cursor(encode_cursor('abc-123', 1000)) == ('abc-123', 1000)
+        with pytest.raises(InvalidCursorException):
+            decode_cursor('not a cursor')
+        with pytest.raises(InvalidCursorException):
+            decode_cursor(encode_cursor('abc-123', -1))
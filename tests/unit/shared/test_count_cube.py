@@ -0,0 +1,60 @@
+import io
+from datetime import datetime
+import pytest
+from count_cube import CountCube, month_index
+
+
+@pytest.fixture()
+def cube():
+    # (x, y, month, provider, platform_name, count)
+    rows = [
+        (-97, 27, month_index(2023, 1), 'PGS', 'Ramform Vanguard', 100),
+        (-97, 28, month_index(2023, 2), 'PGS', 'Ramform Vanguard', 10),
+        (-91, 29, month_index(2023, 1), 'MacGregor', 'Anonymous', 5),
+        (-89, 29, month_index(2023, 1), 'MacGregor', 'Anonymous', 1000),
+        (10, 60, month_index(2022, 12), 'Rosepoint', 'CODA', 7)
+    ]
+    return CountCube.from_rows(rows)
+
+
+class TestCountCube:
+    def test_supports(self, cube):
+        assert cube.supports({})
+        assert cube.supports({'bbox': '-97.0,27.0,-90.0,30.0', 'collection_date_start': '2023-01-01'})
+        assert not cube.supports({'bbox': '-97.5,27.0,-90.0,30.0'}), "bbox not on cell boundaries"
+        assert not cube.supports({'collection_date_end': '2023-01-15'}), "date not on month boundary"
+        assert not cube.supports({'archive_date_start': '2023-01-01'}), "archive date not in cube"
+
+    def test_count_points(self, cube):
+        assert cube.count_points({}) == 1122
+        assert cube.count_points({'bbox': '-97.0,27.0,-90.0,30.0'}) == 115
+        assert cube.count_points({'bbox': '-97.0,27.0,-90.0,30.0', 'providers': 'PGS'}) == 110
+        assert cube.count_points({'platforms': 'Anonymous,CODA'}) == 1012
+        assert cube.count_points({'providers': 'PGS', 'platforms': 'Anonymous'}) == 0
+        assert cube.count_points({'providers': 'unknown'}) == 0
+
+    def test_count_points_by_month(self, cube):
+        assert cube.count_points({'collection_date_start': '2023-01-01'}) == 1115
+        assert cube.count_points({'collection_date_start': '2023-01-01', 'collection_date_end': '2023-02-01'}) == 1105
+        assert cube.count_points({'collection_date_end': '2023-01-01'}) == 7
+
+    def test_save_and_load(self, cube):
+        with io.BytesIO() as f:
+            cube.save(f)
+            f.seek(0)
+            loaded = CountCube.load(f)
+
+        assert loaded.created == cube.created
+        assert loaded.cell_size == cube.cell_size
+        assert list(loaded.platforms) == list(cube.platforms)
+        assert loaded.count_points({'bbox': '-97.0,27.0,-90.0,30.0', 'providers': 'PGS'}) == 110
+
+    def test_is_stale(self, cube):
+        assert not cube.is_stale()
+        cube.created = '2024-01-01T00:00:00+00:00'
+        assert cube.age(datetime.fromisoformat('2024-01-02T00:00:00+00:00')) == 86400
+        assert not cube.is_stale(2 * 86400, datetime.fromisoformat('2024-01-02T00:00:00+00:00'))
+        assert cube.is_stale(2 * 86400, datetime.fromisoformat('2024-01-03T00:00:01+00:00'))
+        # snapshots without a created date are never used
+        cube.created = ''
+        assert cube.is_stale()
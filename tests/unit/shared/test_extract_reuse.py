@@ -0,0 +1,43 @@
+from extract_reuse import ExtractIndex, MemoryExtractStore, data_version, extract_key
+
+SQL = "SELECT lon,lat,depth FROM dcdb.csb_parquet where (lon > ? and lon < ?)"
+PARAMETERS = ['5', '6']
+
+
+class FailingExtractStore:
+    def get(self, key):
+        raise IOError('table unavailable')
+
+    def put(self, key, output_location, created, expires):
+        raise IOError('table unavailable')
+
+
+class TestExtractReuse:
+    def test_extract_key(self):
+        key = extract_key(SQL, PARAMETERS, 'parquet', '2024-01-31')
+        assert key == extract_key(SQL.replace(' where', '\n    where'), PARAMETERS, 'parquet', '2024-01-31')
+        # new data, filters or format change the output
+        assert key != extract_key(SQL, PARAMETERS, 'parquet', '2024-02-01')
+        assert key != extract_key(SQL, ['5', '7'], 'parquet', '2024-01-31')
+        assert key != extract_key(SQL, PARAMETERS, 'csv', '2024-01-31')
+        # not reused without knowing the data version
+        assert extract_key(SQL, PARAMETERS, 'parquet', None) is None
+        assert data_version(None) is None
+        assert data_version({'latest_entry_date': '2024-01-31', 'partitions': {}}) == '2024-01-31'
+
+    def test_index(self):
+        now = [1000.0]
+        index = ExtractIndex(MemoryExtractStore(), ttl_in_seconds=60, clock=lambda: now[0])
+        assert index.get('f00d') is None
+
+        index.put('f00d', 's3://order-pickup/extracts/abc-123/csb/6f1c/manifest.json')
+        now[0] += 30
+        assert index.get('f00d') == 's3://order-pickup/extracts/abc-123/csb/6f1c/manifest.json'
+        now[0] += 31
+        assert index.get('f00d') is None
+        assert index.get(None) is None
+
+    def test_store_unavailable(self):
+        index = ExtractIndex(FailingExtractStore())
+        index.put('f00d', 's3://order-pickup/abc.csv')
+        assert index.get('f00d') is None
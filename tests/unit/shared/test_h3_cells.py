@@ -0,0 +1,147 @@
+import random
+import sqlite3
+import h3
+import pytest
+from h3_cells import interior_cells, cell_within_bbox, cell_to_bigint, covering_cells, polygon_covering_cells, \
+    polygon_bounds, inner_bbox
+from query_builder import partition_clause
+
+
+PRUNING_BBOXES = [
+    [-97, 27, -90, 30],
+    [-97, 27, -96.9, 27.1],
+    [-97, 27, -87, 37],
+    [170, -50, 180, -40],
+    [-180, 80, -150, 90],
+    [10, -5, 12, 5],
+]
+
+# concave, with a hole, and a thin diagonal strip whose bbox is mostly empty
+POLYGONS = [
+    {'type': 'Polygon', 'coordinates': [[[-97, 27], [-80, 27], [-80, 30], [-94, 30], [-94, 40], [-97, 40], [-97, 27]]]},
+    {'type': 'Polygon', 'coordinates': [[[0, 0], [10, 0], [10, 10], [0, 10], [0, 0]],
+                                        [[2, 2], [8, 2], [8, 8], [2, 8], [2, 2]]]},
+    {'type': 'Polygon', 'coordinates': [[[-60, -40], [-59.5, -40], [-20, 0], [-20.5, 0], [-60, -40]]]},
+]
+
+
+def contains(polygon, lon, lat):
+    """even-odd rule point in polygon test"""
+    inside = False
+    for ring in polygon['coordinates']:
+        for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+            if (y0 > lat) != (y1 > lat) and lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+    return inside
+
+
+@pytest.fixture()
+def points_table():
+    """
+    in-memory stand-in for the point table with the h3 column assigned as by reprocess_csb_data
+    """
+    rng = random.Random(7)
+    rows = []
+    for _ in range(50000):
+        lon, lat = rng.uniform(-180, 180), rng.uniform(-90, 90)
+        rows.append((lon, lat, h3.geo_to_h3(lat, lon, 1)))
+    # points just inside the edges and corners of the test bboxes
+    for minx, miny, maxx, maxy in PRUNING_BBOXES:
+        for lon in [minx + 1e-9, (minx + maxx) / 2, maxx - 1e-9]:
+            for lat in [miny + 1e-9, (miny + maxy) / 2, maxy - 1e-9]:
+                rows.append((lon, lat, h3.geo_to_h3(lat, lon, 1)))
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute('create table points (lon real, lat real, h3 text)')
+    connection.executemany('insert into points values (?, ?, ?)', rows)
+    yield connection
+    connection.close()
+
+
+class TestH3Cells:
+    def test_interior_cells(self):
+        bbox = [-97, 27, -90, 30]
+        cells = interior_cells(bbox, 3)
+
+        assert len(cells) > 0
+        for cell in cells:
+            for lat, lon in h3.h3_to_geo_boundary(cell):
+                assert -97 < lon < -90 and 27 < lat < 30
+
+        # cells straddling the bbox edge are excluded
+        candidates = h3.polyfill(
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-90, 30], [-97, 30], [-97, 27]]]},
+            3, geo_json_conformant=True)
+        assert len(candidates) > len(cells)
+
+    def test_small_bbox_has_no_interior_cells(self):
+        assert interior_cells([-97, 27, -96.9, 27.1], 3) == []
+
+    @pytest.mark.parametrize('bbox', [[-100, 20, -80, 40], [10, 55, 40, 70], [-10, -30, 10, -10]])
+    def test_inner_bbox(self, bbox):
+        cells = set(interior_cells(bbox, 3))
+        inner = inner_bbox(bbox, 3)
+        rng = random.Random(3)
+        for _ in range(10000):
+            lat, lon = rng.uniform(inner[1], inner[3]), rng.uniform(inner[0], inner[2])
+            assert h3.geo_to_h3(lat, lon, 3) in cells
+
+    def test_small_bbox_has_no_inner_bbox(self):
+        assert inner_bbox([-97, 27, -90, 30], 3) is None
+        assert inner_bbox([-180, 80, 180, 90], 3) is None
+
+    def test_cell_within_bbox(self):
+        cell = h3.geo_to_h3(28.5, -93.5, 3)
+        assert cell_within_bbox(cell, [-97, 27, -90, 30])
+        assert not cell_within_bbox(cell, [-93.5, 27, -90, 30])
+
+    def test_cell_to_bigint(self):
+        assert cell_to_bigint('83446cfffffffff') == 591175310259519487
+
+    def test_covering_cells(self):
+        bbox = [-97, 27, -87, 37]
+        cells = set(covering_cells(bbox))
+        rng = random.Random(3)
+        for _ in range(10000):
+            lat, lon = rng.uniform(27, 37), rng.uniform(-97, -87)
+            assert h3.geo_to_h3(lat, lon, 1) in cells
+
+    def test_small_bbox_covers_few_cells(self):
+        # containing cell and its neighbors
+        assert len(covering_cells([-97, 27, -96.9, 27.1])) == 7
+
+    @pytest.mark.parametrize('polygon', POLYGONS)
+    def test_polygon_covering_cells(self, polygon):
+        cells = set(polygon_covering_cells(polygon))
+        minx, miny, maxx, maxy = polygon_bounds(polygon)
+        rng = random.Random(5)
+        points = 0
+        while points < 5000:
+            lon, lat = rng.uniform(minx, maxx), rng.uniform(miny, maxy)
+            if contains(polygon, lon, lat):
+                points += 1
+                assert h3.geo_to_h3(lat, lon, 1) in cells
+
+    def test_polygon_covers_fewer_cells_than_bbox(self):
+        strip = POLYGONS[2]
+        assert len(polygon_covering_cells(strip)) < len(covering_cells(polygon_bounds(strip))) / 2
+
+    def test_large_bbox_has_no_partition_clause(self):
+        assert partition_clause([-180, -90, 180, 90]) is None
+
+    @pytest.mark.parametrize('bbox', PRUNING_BBOXES)
+    def test_pruned_results_equal_unpruned(self, points_table, bbox):
+        minx, miny, maxx, maxy = bbox
+        bbox_clause = f"(lon > {minx} and lon < {maxx}) and (lat > {miny} and lat < {maxy})"
+        sql = f"select lon, lat from points where {bbox_clause}"
+
+        clause, params = partition_clause(bbox)
+
+        unpruned = points_table.execute(sql).fetchall()
+        pruned = points_table.execute(f"{sql} and {clause}", params).fetchall()
+
+        assert len(unpruned) > 0
+        assert sorted(pruned) == sorted(unpruned)
+        # fraction of the table read
+        partition_rows = points_table.execute(f"select count(*) from points where {clause}", params).fetchone()[0]
+        assert partition_rows < 50000 / 10
@@ -0,0 +1,89 @@
+import base64
+import gzip
+import json
+import pytest
+import http_response
+from http_response import accepted_encodings, api_response, dumps, entity_tag, finalize
+
+PLATFORMS = {
+    'count': 200,
+    'data': [{'provider': 'Rosepoint', 'platform': f'vessel {i}'} for i in range(200)]
+}
+
+
+def get_event(**headers):
+    return {'requestContext': {'http': {'method': 'GET'}}, 'headers': headers}
+
+
+def ok(body):
+    return {'statusCode': 200, 'headers': {'Age': '0'}, 'body': dumps(body)}
+
+
+@pytest.fixture()
+def no_brotli(monkeypatch):
+    monkeypatch.setattr(http_response, 'brotli', None)
+
+
+class TestHttpResponse:
+    def test_dumps(self):
+        body = {'count': '12', 'histogram': {1: [1.5, None]}}
+        assert json.loads(dumps(body)) == {'count': '12', 'histogram': {'1': [1.5, None]}}
+        assert ' ' not in dumps(body)
+
+    def test_accepted_encodings(self):
+        assert accepted_encodings(get_event(**{'accept-encoding': 'gzip, deflate, br'})) == {'gzip', 'deflate', 'br'}
+        assert accepted_encodings(get_event(**{'Accept-Encoding': 'br;q=0, gzip;q=0.5'})) == {'gzip'}
+        assert accepted_encodings(get_event()) == set()
+        assert accepted_encodings({}) == set()
+
+    def test_uncompressed_without_accept_encoding(self):
+        response = finalize(get_event(), ok(PLATFORMS))
+        assert json.loads(response['body']) == PLATFORMS
+        assert 'Content-Encoding' not in response['headers']
+        assert response['headers']['Age'] == '0'
+        assert response['headers']['ETag'] == entity_tag(dumps(PLATFORMS).encode())
+
+    def test_gzip(self, no_brotli):
+        response = finalize(get_event(**{'accept-encoding': 'gzip, br'}), ok(PLATFORMS))
+        assert response['isBase64Encoded'] is True
+        assert response['headers']['Content-Encoding'] == 'gzip'
+        assert response['headers']['Vary'] == 'Accept-Encoding'
+        data = gzip.decompress(base64.b64decode(response['body']))
+        assert json.loads(data) == PLATFORMS
+        assert len(base64.b64decode(response['body'])) < len(data) / 4
+        # each encoding is a distinct representation
+        assert response['headers']['ETag'] == entity_tag(data, 'gzip')
+
+    def test_small_body_not_compressed(self):
+        response = finalize(get_event(**{'accept-encoding': 'gzip'}), ok({'count': '12'}))
+        assert response['body'] == '{"count":"12"}'
+        assert 'Content-Encoding' not in response['headers']
+        assert 'Vary' not in response['headers']
+
+    def test_not_modified(self, no_brotli):
+        first = finalize(get_event(), ok(PLATFORMS))
+        etag = first['headers']['ETag']
+
+        response = finalize(get_event(**{'if-none-match': etag}), ok(PLATFORMS))
+        assert response['statusCode'] == 304
+        assert response['body'] == ''
+        assert response['headers']['ETag'] == etag
+
+        # the ETag of the gzip representation also matches, as does a weak tag
+        gzipped = finalize(get_event(**{'accept-encoding': 'gzip'}), ok(PLATFORMS))['headers']['ETag']
+        for tag in [gzipped, f'W/{etag}', f'"other", {etag}', '*']:
+            assert finalize(get_event(**{'if-none-match': tag}), ok(PLATFORMS))['statusCode'] == 304
+
+        changed = PLATFORMS | {'count': 201}
+        assert finalize(get_event(**{'if-none-match': etag}), ok(changed))['statusCode'] == 200
+
+    def test_only_complete_results_have_etag(self):
+        response = {'statusCode': 202, 'headers': {'Retry-After': '5'}, 'body': dumps({'job_id': 'abc'})}
+        assert 'ETag' not in finalize(get_event(**{'if-none-match': '*'}), response)['headers']
+
+    def test_api_response(self):
+        @api_response
+        def handler(event, context):
+            return {'statusCode': 400, 'body': 'no filters'}
+
+        assert handler(get_event(), None) == {'statusCode': 400, 'headers': {}, 'body': 'no filters'}
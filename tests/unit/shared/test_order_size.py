@@ -0,0 +1,58 @@
+import pytest
+import order_size
+from count_cube import CountCube, month_index
+from order_size import classify, cube_filters, estimate_points, month_start, size_class, SMALL, STANDARD
+
+
+@pytest.fixture()
+def cube():
+    # (x, y, month, provider, platform_name, count)
+    rows = [
+        (-97, 27, month_index(2023, 1), 'PGS', 'Ramform Vanguard', 100),
+        (-97, 28, month_index(2023, 2), 'PGS', 'Ramform Vanguard', 10),
+        (-91, 29, month_index(2023, 1), 'MacGregor', 'Anonymous', 5),
+        (-89, 29, month_index(2023, 1), 'MacGregor', 'Anonymous', 1000)
+    ]
+    return CountCube.from_rows(rows)
+
+
+class TestOrderSize:
+    def test_month_start(self):
+        assert month_start('2023-03-15') == '2023-03-01'
+        assert month_start('2023-12-01', months_after=1) == '2024-01-01'
+        assert month_start('bogus') is None
+        assert month_start(None) is None
+
+    def test_cube_filters(self):
+        filters = {'providers': ['PGS', 'MacGregor'], 'collection_date_start': '2023-01-15',
+                   'collection_date_end': '2023-02-01', 'unique_id': 'abc', 'archive_date_start': '2023-01-01'}
+        assert cube_filters([-96.5, 27.2, -90.1, 29.9], filters, 1.0) == {
+            'bbox': '-97.0,27.0,-90.0,30.0',
+            'providers': 'PGS,MacGregor',
+            'collection_date_start': '2023-01-01',
+            # the end date's points are included
+            'collection_date_end': '2023-03-01'
+        }
+
+    def test_estimate_points(self, cube):
+        # upper bound from the cells enclosing the bbox
+        assert estimate_points([-96.5, 27.2, -90.1, 29.9], {}, cube) == (115, 'count_cube')
+        assert estimate_points([-96.5, 27.2, -90.1, 29.9], {'providers': ['PGS']}, cube) == (110, 'count_cube')
+        # without the cube
+        scan_estimate = {'bytes': 1200, 'partitions': 1}
+        assert estimate_points([-96.5, 27.2, -90.1, 29.9], {}, None, scan_estimate) == (100, 'scan_manifest')
+        assert estimate_points([-96.5, 27.2, -90.1, 29.9], {}) == (None, None)
+
+    def test_classify(self, cube, monkeypatch):
+        monkeypatch.setattr(order_size, 'SMALL_ORDER_POINTS', 1000)
+        assert size_class(999) == SMALL
+        assert size_class(1000) == STANDARD
+        assert size_class(None) == STANDARD
+
+        assert classify([-97, 27, -96, 28], {}, cube) == {
+            'size_class': SMALL, 'estimated_points': 100, 'estimate_method': 'count_cube', 'query_class': 'small_extract'
+        }
+        assert classify([-97, 27, -88, 30], {}, cube)['query_class'] == 'extract'
+        assert classify([-97, 27, -88, 30], {}) == {
+            'size_class': STANDARD, 'estimated_points': None, 'estimate_method': None, 'query_class': 'extract'
+        }
@@ -0,0 +1,64 @@
+from platform_index import PlatformIndex, CatalogIndex, normalize
+
+PLATFORMS = [
+    {'provider': 'PGS', 'platform': 'Ramform Atlas'},
+    {'provider': 'PGS', 'platform': 'Ramform Vanguard'},
+    {'provider': 'Rosepoint', 'platform': 'ATHENA'},
+    {'provider': 'Rosepoint', 'platform': 'S/V Alaska Girl'},
+    {'provider': 'AquaMap', 'platform': 'Knot Supersonic'},
+    {'provider': 'AquaMap', 'platform': 'Atlas'},
+    {'provider': 'GLOS', 'platform': 'Erie  Explorer'}
+]
+
+
+def names(results):
+    return [i['platform'] for i in results]
+
+
+class TestPlatformIndex:
+    def test_normalize(self):
+        assert normalize(' Erie  Explorer ') == 'erie explorer'
+
+    def test_name_prefix_case_insensitive(self):
+        index = PlatformIndex(PLATFORMS)
+        assert names(index.search('ram')) == ['Ramform Atlas', 'Ramform Vanguard']
+        assert names(index.search('RAMFORM V')) == ['Ramform Vanguard']
+        assert names(index.search('erie explorer')) == ['Erie  Explorer']
+        assert index.search('zzz') == []
+        assert index.search(' ') == []
+
+    def test_words_within_name(self):
+        index = PlatformIndex(PLATFORMS)
+        # names starting with the prefix come first
+        assert names(index.search('at')) == ['ATHENA', 'Atlas', 'Ramform Atlas']
+        assert names(index.search('alaska')) == ['S/V Alaska Girl']
+        # ordered by the text from the matching word on
+        assert names(index.search('v')) == ['S/V Alaska Girl', 'Ramform Vanguard']
+
+    def test_limit_and_providers(self):
+        index = PlatformIndex(PLATFORMS)
+        assert len(index.search('a', limit=2)) == 2
+        assert index.search('atlas', providers={'PGS'}) == [{'provider': 'PGS', 'platform': 'Ramform Atlas'}]
+
+    def test_matches_linear_scan(self):
+        platforms = [{'provider': f'P{i % 7}', 'platform': f'Vessel {i:04d} {chr(65 + i % 26)}-{i % 13}'}
+                     for i in range(2000)]
+        index = PlatformIndex(platforms)
+        for prefix in ['vessel 01', '0042', 'q-1', 'q', '12']:
+            expected = [i['platform'] for i in platforms
+                        if any(w.startswith(prefix) for w in [normalize(i['platform'])] +
+                               [normalize(i['platform'])[n + 1:] for n, c in enumerate(normalize(i['platform']))
+                                if not c.isalnum()])]
+            assert sorted(names(index.search(prefix, limit=len(platforms)))) == sorted(expected)
+
+    def test_rebuilt_when_catalog_changes(self, stub_snapshot):
+        snapshot = stub_snapshot()
+        catalog_index = CatalogIndex(snapshot)
+        assert catalog_index.get() is None
+
+        snapshot.value = {'platforms': PLATFORMS}
+        index = catalog_index.get()
+        assert catalog_index.get() is index
+
+        snapshot.value = {'platforms': PLATFORMS[:1]}
+        assert len(catalog_index.get()) == 1
@@ -0,0 +1,159 @@
+import pytest
+import json
+from query_builder import valid_bbox, parse_bbox, partition_clause, bbox_to_where_clause, filters_to_where_clause, \
+    date_range_clause, where, date_pattern, parse_polygon, polygon_to_wkt, self_intersects, IllegalArgumentException
+
+TRIANGLE = {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 30], [-97, 27]]]}
+
+
+class TestQueryBuilder:
+    def test_valid_bbox(self):
+        assert valid_bbox([-180, -90, 180, 90]) is True, "coordinates should be in range"
+        assert valid_bbox([-180, -90, 180, 91]) is False, "coordinates should be out of range"
+        assert valid_bbox([-181, -90, 180, 90]) is False, "coordinates should be out of range"
+        assert valid_bbox([170, 0, -170, 10]) is False, "bbox crosses the antimeridian"
+        assert valid_bbox([-10, -10, -10, -10]) is False, "bbox area is zero"
+
+    def test_parse_bbox_with_out_of_range_coords(self):
+        with pytest.raises(IllegalArgumentException):
+            parse_bbox("-180,-90,180,901")
+
+    def test_parse_bbox_with_non_numeric_coords(self):
+        with pytest.raises(IllegalArgumentException):
+            parse_bbox("null,-90,180,90")
+
+    def test_bbox_to_where_clause(self):
+        where_clauses, params = bbox_to_where_clause(parse_bbox('-180, -90, 180, 90'))
+        assert where_clauses == ['(lon > ? and lon < ?)', '(lat > ? and lat < ?)']
+        assert params == [-180.0, 180.0, -90.0, 90.0]
+
+    def test_bbox_to_where_clause_with_partition_clause(self):
+        where_clauses, params = bbox_to_where_clause([-97, 27, -96, 28])
+        h3_clause, cells = partition_clause([-97, 27, -96, 28])
+        assert where_clauses[2] == h3_clause
+        assert h3_clause.startswith('h3 in (?')
+        assert params == [-97, -96, 27, 28] + cells
+
+    def test_parse_polygon(self):
+        assert parse_polygon(json.dumps(TRIANGLE)) == \
+               {'type': 'Polygon', 'coordinates': [[[-97.0, 27.0], [-90.0, 27.0], [-93.0, 30.0], [-97.0, 27.0]]]}
+        assert parse_polygon(TRIANGLE) == parse_polygon(json.dumps(TRIANGLE))
+
+    def test_parse_polygon_invalid(self):
+        invalid = [
+            'not json',
+            {'type': 'Point', 'coordinates': [-97, 27]},
+            {'type': 'Polygon', 'coordinates': []},
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 30]]]},
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 30], [-97, 28]]]},
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 91], [-97, 27]]]},
+            {'type': 'Polygon', 'coordinates': [[['a', 27], [-90, 27], [-93, 30], ['a', 27]]]},
+            {'type': 'Polygon', 'coordinates': [[[-170, 0], [170, 0], [170, 10], [-170, 0]]]},
+            {'type': 'Polygon', 'coordinates': [[[i % 2, i] for i in range(1000)] + [[0, 0]]]},
+            # bowtie
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 30], [-90, 27], [-97, 30], [-97, 27]]]},
+            # edge doubling back on itself
+            {'type': 'Polygon', 'coordinates': [[[-97, 27], [-90, 27], [-93, 27], [-93, 30], [-97, 27]]]}
+        ]
+        for polygon in invalid:
+            with pytest.raises(IllegalArgumentException):
+                parse_polygon(polygon)
+
+    def test_self_intersects(self):
+        assert not self_intersects(TRIANGLE['coordinates'][0])
+        square = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+        assert not self_intersects(square)
+        assert self_intersects([[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]])
+
+    def test_polygon_to_wkt(self):
+        assert polygon_to_wkt(parse_polygon(TRIANGLE)) == 'POLYGON ((-97.0 27.0, -90.0 27.0, -93.0 30.0, -97.0 27.0))'
+
+    def test_polygon_where_clause(self):
+        where_clauses, params = filters_to_where_clause({'polygon': json.dumps(TRIANGLE), 'providers': 'PGS'})
+        h3_clause, cells = partition_clause(parse_polygon(TRIANGLE))
+
+        assert where_clauses == [
+            '(lon > ? and lon < ?)',
+            '(lat > ? and lat < ?)',
+            h3_clause,
+            "ST_Contains(ST_GeometryFromText('POLYGON ((-97.0 27.0, -90.0 27.0, -93.0 30.0, -97.0 27.0))'), "
+            "ST_Point(lon, lat))",
+            'provider in (?)'
+        ]
+        assert params == [-97.0, -90.0, 27.0, 30.0] + cells + ['PGS']
+
+    def test_filters_to_where_clause(self):
+        query_params = {
+            "providers": "PGS,MacGregor",
+            "platforms": "Ramform Vanguard,Anonymous",
+            "collection_date_start": "2022-01-01",
+            "archive_date_start": "2022-01-01"
+        }
+        assert filters_to_where_clause(query_params) == ([
+            "platform_name in (?, ?)",
+            "provider in (?, ?)",
+            "time >= date(?)",
+            "entry_date >= date(?)"
+        ], ['Ramform Vanguard', 'Anonymous', 'PGS', 'MacGregor', '2022-01-01', '2022-01-01'])
+
+    def test_build_sql(self):
+        query_params = {
+            'bbox': '-97,27,-90,30',
+            'collection_date_start': '2023-08-01',
+            'platforms': 'Ramform Vanguard,Anonymous',
+            'providers': 'PGS,MacGregor',
+            "archive_date_start": '2023-01-01'
+        }
+        h3_clause, cells = partition_clause([-97, 27, -90, 30])
+
+        where_clauses, params = filters_to_where_clause(query_params)
+
+        assert ' and '.join(where_clauses) == "(lon > ? and lon < ?) and (lat > ? and lat < ?) " \
+            f"and {h3_clause} " \
+            "and platform_name in (?, ?) " \
+            "and provider in (?, ?) " \
+            "and time >= date(?) and entry_date >= date(?)"
+        assert params == [-97.0, -90.0, 27.0, 30.0] + cells + \
+            ['Ramform Vanguard', 'Anonymous', 'PGS', 'MacGregor', '2023-08-01', '2023-01-01']
+
+    def test_names_are_not_restricted(self):
+        # names once rejected by the character whitelists are passed as parameters
+        names = ['"Airwaves "', 'ANNIE O&apos;SHEA', 'Sea &#32;Dweller']
+        where_clauses, params = filters_to_where_clause({'platforms': names, 'providers': names,
+                                                         'unique_id': 'PGS_1;--'})
+        assert where_clauses == ['platform_name in (?, ?, ?)', 'provider in (?, ?, ?)', 'unique_id = ?']
+        assert params == names + names + ['PGS_1;--']
+
+    def test_values_are_not_in_sql(self):
+        where_clauses, params = filters_to_where_clause({'platforms': ["Hi'ialakai", "x') or (1=1"]})
+        assert where_clauses == ['platform_name in (?, ?)']
+        assert params == ["Hi'ialakai", "x') or (1=1"]
+
+    def test_sql_text_independent_of_values(self):
+        first = filters_to_where_clause({'bbox': '-97,27,-90,30', 'providers': 'PGS', 'unique_id': 'PGS-1'})[0]
+        second = filters_to_where_clause({'bbox': '-97.5,27,-90,30', 'providers': 'CIDCO', 'unique_id': 'CIDCO-2'})[0]
+        assert first[:2] == second[:2]
+        assert first[3:] == second[3:]
+
+    def test_invalid_bbox_is_ignored(self):
+        assert filters_to_where_clause({'bbox': '-97,27,-100,30', 'providers': 'PGS'}) == (['provider in (?)'], ['PGS'])
+
+    def test_date_range_clause(self):
+        assert date_range_clause('time', '2023-01-01', '2023-12-31') == \
+               (['(time >= date(?) and time <= date(?))'], ['2023-01-01', '2023-12-31'])
+        assert date_range_clause('time', None, '2023-12-31') == (['time <= date(?)'], ['2023-12-31'])
+        for start in ['2023', '2023-13-01', '2023-02-30']:
+            with pytest.raises(IllegalArgumentException):
+                date_range_clause('time', start, None)
+        with pytest.raises(IllegalArgumentException):
+            filters_to_where_clause({'archive_date_end': 'yesterday'})
+
+    def test_date_whitelist(self):
+        for i in ['2008', '2008-01', 'abcd-ef-gh', '200&-01-02']:
+            assert date_pattern.match(i) is None, "should reject dates with invalid characters or format"
+        for i in ['2008-01-02', '2008-1-2']:
+            assert date_pattern.match(i), "should accept dates with valid character(s) and format"
+
+    def test_where(self):
+        assert where([]) == ''
+        assert where(['a = ?', 'b = ?']) == ' where a = ? and b = ?'
@@ -0,0 +1,110 @@
+import json
+import random
+import threading
+import time
+import pytest
+from query_governor import QueryGovernor, ConcurrencyLimitException, throttled_response, INTERACTIVE, EXTRACT, \
+    SMALL_EXTRACT, ASYNC_JOB
+from single_flight import MemoryLeaseStore
+
+
+class FailingLeaseStore:
+    def claim(self, key, token, expires, now, previous_token=None):
+        raise IOError('table unavailable')
+
+    def release(self, key, token):
+        raise IOError('table unavailable')
+
+
+class TestQueryGovernor:
+    def test_limit_per_class(self):
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 2, EXTRACT: 1})
+        slots = [governor.acquire(INTERACTIVE), governor.acquire(INTERACTIVE)]
+        assert slots[0]['key'] != slots[1]['key']
+        with pytest.raises(ConcurrencyLimitException) as e:
+            governor.acquire(INTERACTIVE)
+        assert e.value.retry_after > 0
+
+        # classes are limited separately
+        extract = governor.acquire(EXTRACT)
+        with pytest.raises(ConcurrencyLimitException):
+            governor.acquire(EXTRACT)
+
+        # small orders do not wait for large extracts
+        assert governor.acquire(SMALL_EXTRACT)
+        assert governor.acquire(ASYNC_JOB)
+
+        governor.release(slots[0])
+        governor.release(extract)
+        assert governor.acquire(INTERACTIVE)
+        assert governor.acquire(EXTRACT)
+
+    def test_slot_context(self):
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 1})
+        with pytest.raises(RuntimeError):
+            with governor.slot(INTERACTIVE):
+                raise RuntimeError('query failed')
+        # released despite the error
+        with governor.slot(INTERACTIVE) as slot:
+            assert slot is not None
+
+    def test_abandoned_slot_expires(self):
+        now = [1000.0]
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 1}, lease_seconds={INTERACTIVE: 60},
+                                 clock=lambda: now[0])
+        governor.acquire(INTERACTIVE)
+        with pytest.raises(ConcurrencyLimitException):
+            governor.acquire(INTERACTIVE)
+        now[0] += 61
+        assert governor.acquire(INTERACTIVE)
+
+    def test_stale_release_does_not_free_new_holder(self):
+        now = [1000.0]
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 1}, lease_seconds={INTERACTIVE: 60},
+                                 clock=lambda: now[0])
+        stale = governor.acquire(INTERACTIVE)
+        now[0] += 61
+        governor.acquire(INTERACTIVE)
+        governor.release(stale)
+        with pytest.raises(ConcurrencyLimitException):
+            governor.acquire(INTERACTIVE)
+
+    def test_ungoverned_when_store_unavailable(self):
+        governor = QueryGovernor(FailingLeaseStore())
+        with governor.slot(INTERACTIVE) as slot:
+            assert slot is None
+
+    def test_concurrent_holders_within_limit(self):
+        governor = QueryGovernor(MemoryLeaseStore(), limits={INTERACTIVE: 3}, rng=random.Random(7))
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+        throttled = [0]
+
+        def query():
+            try:
+                with governor.slot(INTERACTIVE):
+                    with lock:
+                        running[0] += 1
+                        peak[0] = max(peak[0], running[0])
+                    time.sleep(0.02)
+                    with lock:
+                        running[0] -= 1
+            except ConcurrencyLimitException:
+                with lock:
+                    throttled[0] += 1
+
+        threads = [threading.Thread(target=query) for _ in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert peak[0] <= 3
+        assert throttled[0] > 0
+
+    def test_throttled_response(self):
+        response = throttled_response(ConcurrencyLimitException(INTERACTIVE, 2))
+        assert response['statusCode'] == 429
+        assert response['headers'] == {'Retry-After': '2'}
+        assert json.loads(response['body'])['message']
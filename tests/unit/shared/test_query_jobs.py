@@ -0,0 +1,99 @@
+import json
+from query_jobs import MemoryJobStore, submit_job, job_response, is_async_request
+from result_cache import ResultCache
+
+
+class StubAthenaClient:
+    def __init__(self, state='RUNNING'):
+        self.state = state
+        self.status_checks = 0
+
+    def get_query_execution(self, QueryExecutionId):
+        self.status_checks += 1
+        return {'QueryExecution': {'QueryExecutionId': QueryExecutionId, 'Status': {'State': self.state}}}
+
+
+class TestQueryJobs:
+    event = {
+        'headers': {'host': 'example.com'},
+        'rawPath': '/count',
+        'queryStringParameters': {'bbox': '-97,27,-90,30', 'async': 'true'}
+    }
+
+    def submit(self, store):
+        response = submit_job(store, self.event, 'count', 'abc-123', 'key')
+        assert response['statusCode'] == 202
+        body = json.loads(response['body'])
+        assert body['url'] == f"https://example.com/count/jobs/{body['job_id']}"
+        return body['job_id']
+
+    def test_is_async_request(self):
+        assert is_async_request(self.event)
+        assert not is_async_request({'queryStringParameters': {'bbox': '-97,27,-90,30'}})
+        assert not is_async_request({})
+
+    def test_running_job(self):
+        store = MemoryJobStore()
+        job_id = self.submit(store)
+
+        response = job_response(store, StubAthenaClient('RUNNING'), job_id, 'count', lambda i: None)
+        assert response['statusCode'] == 202
+        assert response['headers']['Retry-After']
+
+    def test_completed_job_result_is_stored(self):
+        store = MemoryJobStore()
+        client = StubAthenaClient('SUCCEEDED')
+        cache = ResultCache()
+        fetched = []
+
+        def fetch_results(query_execution_id):
+            fetched.append(query_execution_id)
+            return {'count': '42'}
+
+        job_id = self.submit(store)
+        for _ in range(3):
+            response = job_response(store, client, job_id, 'count', fetch_results, cache)
+            assert response['statusCode'] == 200
+            assert json.loads(response['body']) == {'count': '42'}
+
+        assert fetched == ['abc-123'], "results should only be retrieved once"
+        assert client.status_checks == 1
+        assert cache.get('key')[0] == {'count': '42'}
+
+    def test_failed_job(self):
+        store = MemoryJobStore()
+        job_id = self.submit(store)
+
+        response = job_response(store, StubAthenaClient('FAILED'), job_id, 'count', lambda i: None)
+        assert response['statusCode'] == 500
+        assert json.loads(response['body'])['status'] == 'failed'
+
+    def test_unknown_job(self):
+        store = MemoryJobStore()
+        job_id = self.submit(store)
+
+        assert job_response(store, StubAthenaClient(), 'nope', 'count', lambda i: None)['statusCode'] == 404
+        assert job_response(store, StubAthenaClient(), job_id, 'platforms', lambda i: None)['statusCode'] == 404
+
+    def test_job_params_passed_to_fetch_results(self):
+        store = MemoryJobStore()
+        response = submit_job(store, self.event, 'count', 'abc-123', 'key', {'names': ['a', 'b']})
+        job_id = json.loads(response['body'])['job_id']
+
+        def fetch_results(query_execution_id, names=None):
+            return {'counts': dict.fromkeys(names, '0')}
+
+        response = job_response(store, StubAthenaClient('SUCCEEDED'), job_id, 'count', fetch_results)
+        assert json.loads(response['body']) == {'counts': {'a': '0', 'b': '0'}}
+
+    def test_statistics_recorded_once_on_completion(self, capsys):
+        store = MemoryJobStore()
+        response = submit_job(store, self.event, 'count', 'abc-123', 'key', tags={'endpoint': 'count', 'shape': 'bbox'})
+        job_id = json.loads(response['body'])['job_id']
+
+        for _ in range(2):
+            job_response(store, StubAthenaClient('SUCCEEDED'), job_id, 'count', lambda i: {'count': '42'})
+        records = [json.loads(i) for i in capsys.readouterr().out.splitlines()]
+        assert len(records) == 1
+        assert records[0]['query_execution_id'] == 'abc-123'
+        assert records[0]['shape'] == 'bbox'
@@ -0,0 +1,94 @@
+import json
+import pytest
+from query_stats import filter_shape, batch_shape, record_execution, parse_records, percentile, query_cost, \
+    summarize, MIN_BILLED_BYTES
+
+
+def query_execution(query_execution_id, scanned, total, state='SUCCEEDED', reused=False):
+    return {
+        'QueryExecutionId': query_execution_id,
+        'Status': {'State': state},
+        'Statistics': {
+            'DataScannedInBytes': scanned,
+            'QueryQueueTimeInMillis': 100,
+            'EngineExecutionTimeInMillis': total - 100,
+            'TotalExecutionTimeInMillis': total,
+            'ResultReuseInformation': {'ReusedPreviousResult': reused}
+        }
+    }
+
+
+class TestQueryStats:
+    def test_filter_shape(self):
+        assert filter_shape({'providers': 'PGS', 'bbox': '-97,27,-90,30', 'platforms': ''}) == 'bbox+providers'
+        assert filter_shape({}) == 'none'
+        assert filter_shape(None) == 'none'
+        assert batch_shape([{'bbox': '1,1,2,2'}, {'bbox': '3,3,4,4'}, {}]) == 'batch(bbox|none)'
+
+    def test_record_execution(self):
+        lines = []
+        record = record_execution(query_execution('abc-123', 2048, 1500), emit=lines.append,
+                                  endpoint='order', shape='bbox', order_id='order-1', dataset=None)
+        assert record == {
+            'record_type': 'athena_query',
+            'query_execution_id': 'abc-123',
+            'state': 'SUCCEEDED',
+            'endpoint': 'order',
+            'shape': 'bbox',
+            'order_id': 'order-1',
+            'DataScannedInBytes': 2048,
+            'QueryQueueTimeInMillis': 100,
+            'EngineExecutionTimeInMillis': 1400,
+            'TotalExecutionTimeInMillis': 1500,
+            'ReusedPreviousResult': False
+        }
+        # embedded metric format
+        metrics = json.loads(lines[0])['_aws']['CloudWatchMetrics'][0]
+        assert metrics['Dimensions'] == [['endpoint', 'shape']]
+        assert {'Name': 'DataScannedInBytes', 'Unit': 'Bytes'} in metrics['Metrics']
+
+    def test_record_failure_is_not_raised(self):
+        def emit(line):
+            raise IOError('closed')
+        assert record_execution(query_execution('abc-123', 0, 100), emit=emit, endpoint='count') is None
+
+    def test_parse_records(self):
+        lines = []
+        record_execution(query_execution('a', 1, 100), emit=lines.append, endpoint='count', shape='bbox')
+        # another request waiting on the same query
+        record_execution(query_execution('a', 1, 100), emit=lines.append, endpoint='count', shape='bbox')
+        lines = ['2024-01-01T00:00:00.000Z\t' + i for i in lines] + ['START RequestId: x', '{"message": "other"}']
+        records = parse_records(lines)
+        assert len(records) == 1
+        assert '_aws' not in records[0]
+
+    def test_percentile(self):
+        assert percentile([], 50) is None
+        assert percentile([3, 1, 2], 50) == 2
+        assert percentile(list(range(1, 101)), 90) == 90
+        assert percentile(list(range(1, 101)), 99) == 99
+
+    def test_query_cost(self):
+        assert query_cost({'DataScannedInBytes': 1024 ** 4}) == pytest.approx(5.0)
+        assert query_cost({'DataScannedInBytes': 0}) == query_cost({'DataScannedInBytes': MIN_BILLED_BYTES})
+        assert query_cost({'DataScannedInBytes': 1024 ** 4, 'ReusedPreviousResult': True}) == 0
+
+    def test_summarize(self):
+        records = []
+        for i in range(10):
+            records.append(record_execution(query_execution(f'bbox-{i}', 1024 ** 3, 1000 * (i + 1)), emit=lambda line: None,
+                                            endpoint='count', shape='bbox'))
+        records.append(record_execution(query_execution('none', 1024 ** 4, 20000, state='FAILED'), emit=lambda line: None,
+                                        endpoint='count', shape='none'))
+        records.append(record_execution(query_execution('reused', 1024 ** 4, 200, reused=True), emit=lambda line: None,
+                                        endpoint='count', shape='bbox'))
+
+        summaries = summarize(records)
+        assert [(i['shape'], i['queries']) for i in summaries] == [('none', 1), ('bbox', 11)]
+        bbox = summaries[1]
+        assert bbox['reused'] == 1
+        assert bbox['failed'] == 0
+        assert bbox['cost'] == pytest.approx(10 * 5 / 1024)
+        assert bbox['TotalExecutionTimeInMillis_p50'] == 5000
+        assert bbox['TotalExecutionTimeInMillis_p99'] == 10000
+        assert summaries[0]['failed'] == 1
@@ -0,0 +1,114 @@
+from result_cache import ResultCache, MemoryCacheStore, normalize_filters, cache_key, cache_headers
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache:
+    def test_normalize_filters(self):
+        query_params = {
+            'bbox': '-97.123456789, 27.0000001,-90,30',
+            'platforms': 'Ramform Vanguard,Anonymous',
+            'providers': 'PGS, MacGregor',
+            'collection_date_start': '2023-8-1',
+            'callback': 'ignored'
+        }
+        expected = {
+            'bbox': '-97.1235,27.0,-90.0,30.0',
+            'platforms': 'Anonymous,Ramform Vanguard',
+            'providers': 'MacGregor,PGS',
+            'collection_date_start': '2023-08-01'
+        }
+        assert normalize_filters(query_params) == expected
+        assert normalize_filters(None) == {}
+
+    def test_normalize_filters_leaves_invalid_values(self):
+        query_params = {'bbox': 'null,-90,180,90', 'archive_date_end': '2023'}
+        assert normalize_filters(query_params) == query_params
+
+    def test_normalize_polygon(self):
+        polygon = '{"type": "Polygon", "coordinates": [[[-97.000001, 27], [-90, 27], [-93, 30], [-97, 27]]]}'
+        assert normalize_filters({'polygon': polygon}) == \
+               {'polygon': '{"type":"Polygon","coordinates":[[[-97.0,27.0],[-90.0,27.0],[-93.0,30.0],[-97.0,27.0]]]}'}
+        assert normalize_filters({'polygon': 'not json'}) == {'polygon': 'not json'}
+
+    def test_equivalent_filters_share_key(self):
+        a = normalize_filters({'platforms': 'B,A', 'bbox': '-97,27,-90,30'})
+        b = normalize_filters({'bbox': '-97.00001,27,-90,30.0', 'platforms': 'A,B'})
+        assert cache_key('count', a) == cache_key('count', b)
+        assert cache_key('count', a) != cache_key('platforms', a), "endpoints should not share entries"
+
+    def test_local_hit(self):
+        clock = FakeClock()
+        cache = ResultCache(max_entries=2, ttl_in_seconds=60, clock=clock)
+        cache.put('a', {'count': '1'})
+        clock.now += 10
+
+        assert cache.get('a') == ({'count': '1'}, 10)
+        assert cache.get('b') is None
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2, ttl_in_seconds=60, clock=FakeClock())
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        assert cache.get('b') is None, "least recently used entry should be evicted"
+        assert cache.get('a') is not None
+        assert cache.get('c') is not None
+
+    def test_expiration(self):
+        clock = FakeClock()
+        store = MemoryCacheStore()
+        cache = ResultCache(store=store, ttl_in_seconds=60, clock=clock)
+        cache.put('a', 1)
+        clock.now += 60
+
+        assert cache.get('a') is None
+
+    def test_shared_store_populates_local(self):
+        clock = FakeClock()
+        store = MemoryCacheStore()
+        ResultCache(store=store, ttl_in_seconds=60, clock=clock).put('a', {'count': '5'})
+        clock.now += 30
+
+        # e.g. a different Lambda container
+        cache = ResultCache(store=store, ttl_in_seconds=60, clock=clock)
+        assert cache.get('a') == ({'count': '5'}, 30)
+        assert 'a' in cache.entries
+
+    def test_get_many(self):
+        clock = FakeClock()
+        store = MemoryCacheStore()
+        ResultCache(store=store, ttl_in_seconds=60, clock=clock).put_many({'a': 1, 'b': 2})
+        clock.now += 30
+
+        cache = ResultCache(store=store, ttl_in_seconds=60, clock=clock)
+        cache.put('c', 3)
+        assert cache.get_many(['a', 'c', 'd']) == {'a': (1, 30), 'c': (3, 0)}
+        assert 'a' in cache.entries
+
+        clock.now += 30
+        assert cache.get_many(['a', 'b', 'c']) == {'c': (3, 30)}
+
+    def test_store_errors_are_ignored(self):
+        class BrokenStore:
+            def get(self, key):
+                raise Exception('throttled')
+
+            def put(self, key, value, created, expires):
+                raise Exception('throttled')
+
+        cache = ResultCache(store=BrokenStore(), clock=FakeClock())
+        cache.put('a', 1)
+        assert cache.get('a') == (1, 0)
+        assert cache.get('b') is None
+
+    def test_cache_headers(self):
+        assert cache_headers(100, ttl_in_seconds=3600) == {'Cache-Control': 'public, max-age=3500', 'Age': '100'}
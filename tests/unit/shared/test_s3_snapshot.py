@@ -0,0 +1,53 @@
+import io
+import json
+from botocore.exceptions import ClientError
+from s3_snapshot import S3JsonSnapshot
+
+
+class StubS3Client:
+    def __init__(self, document):
+        self.document = document
+        self.etag = '"v1"'
+        self.requests = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.requests.append(IfNoneMatch)
+        if IfNoneMatch == self.etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.BytesIO(json.dumps(self.document).encode('utf-8')), 'ETag': self.etag}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestS3Snapshot:
+    def test_revalidation(self):
+        s3 = StubS3Client({'version': 1})
+        clock = FakeClock()
+        snapshot = S3JsonSnapshot(s3, 'bucket', 'key', revalidate_seconds=60, clock=clock)
+
+        assert snapshot.get() == {'version': 1}
+        clock.now = 30
+        assert snapshot.get() == {'version': 1}
+        assert s3.requests == [None], "should not revalidate within revalidate_seconds"
+
+        clock.now = 90
+        assert snapshot.get() == {'version': 1}
+        assert s3.requests == [None, '"v1"'], "should revalidate with the ETag"
+
+        s3.document = {'version': 2}
+        s3.etag = '"v2"'
+        clock.now = 200
+        assert snapshot.get() == {'version': 2}
+
+    def test_unavailable(self):
+        class BrokenS3Client:
+            def get_object(self, **kwargs):
+                raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'missing'}}, 'GetObject')
+
+        assert S3JsonSnapshot(BrokenS3Client(), 'bucket', 'key').get() is None
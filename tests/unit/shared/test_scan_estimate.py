@@ -0,0 +1,76 @@
+import json
+import h3
+from query_builder import partition_clause
+from scan_estimate import estimate_scan, estimate_headers, over_budget, over_budget_response, month_of, cell_bytes
+
+GULF = h3.geo_to_h3(28.5, -93.5, 1)
+PACIFIC = h3.geo_to_h3(0, -150, 1)
+
+MANIFEST = {
+    'created': '2024-01-01T00:00:00+00:00',
+    'partitions': {
+        GULF: {'2023-01': 100, '2023-02': 200, '2023-03': 400},
+        PACIFIC: {'2023-01': 1000, '2023-03': 2000}
+    }
+}
+
+
+class TestScanEstimate:
+    def test_month_of(self):
+        assert month_of('2023-1-5') == '2023-01'
+        assert month_of('2023-12-31') == '2023-12'
+        assert month_of('2023') is None
+        assert month_of(None) is None
+
+    def test_full_scan(self):
+        assert estimate_scan(MANIFEST, {}) == {'bytes': 3700, 'partitions': 2}
+        # filters other than bbox and archive date do not reduce the estimate
+        assert estimate_scan(MANIFEST, {'providers': 'PGS', 'collection_date_start': '2023-03-01'})['bytes'] == 3700
+        # as for an invalid bbox, which is ignored
+        assert estimate_scan(MANIFEST, {'bbox': '-90,27,-97,30'})['bytes'] == 3700
+
+    def test_bbox(self):
+        assert GULF in partition_clause([-97, 27, -90, 30])[1]
+        assert estimate_scan(MANIFEST, {'bbox': '-97,27,-90,30'}) == {'bytes': 700, 'partitions': 1}
+
+    def test_polygon(self):
+        polygon = json.dumps({'type': 'Polygon', 'coordinates': [[[-151, -1], [-149, -1], [-150, 1], [-151, -1]]]})
+        assert estimate_scan(MANIFEST, {'polygon': polygon}) == {'bytes': 3000, 'partitions': 1}
+        # both predicates apply, so a bbox and polygon far apart read nothing
+        assert estimate_scan(MANIFEST, {'bbox': '-97,27,-90,30', 'polygon': polygon}) == {'bytes': 0, 'partitions': 0}
+
+    def test_archive_date_range(self):
+        filters = {'bbox': '-97,27,-90,30', 'archive_date_start': '2023-02-15'}
+        assert estimate_scan(MANIFEST, filters) == {'bytes': 600, 'partitions': 1}
+        filters = {'archive_date_start': '2023-02-01', 'archive_date_end': '2023-2-28'}
+        assert estimate_scan(MANIFEST, filters) == {'bytes': 200, 'partitions': 1}
+
+    def test_filter_sets(self):
+        # partitions read by both filter sets are counted once
+        filter_sets = [
+            {'bbox': '-97,27,-90,30'},
+            {'bbox': '-94,28,-93,29', 'archive_date_end': '2023-01-31'},
+            {'bbox': '-151,-1,-149,1', 'archive_date_start': '2023-03-01'}
+        ]
+        assert estimate_scan(MANIFEST, *filter_sets) == {'bytes': 2700, 'partitions': 2}
+        assert estimate_scan(MANIFEST, filter_sets[0], {}) == {'bytes': 3700, 'partitions': 2}
+
+    def test_cell_bytes(self):
+        assert cell_bytes(MANIFEST, [GULF, PACIFIC, 'unknown'], {'archive_date_start': '2023-02-01'}) == \
+            {GULF: 600, PACIFIC: 2000, 'unknown': 0}
+        assert cell_bytes(None, [GULF], {}) == {GULF: 0}
+
+    def test_no_manifest(self):
+        assert estimate_scan(None, {}) is None
+        assert not over_budget(None, 0)
+        assert estimate_headers(None) == {}
+
+    def test_over_budget_response(self):
+        estimate = {'bytes': 3700, 'partitions': 2}
+        assert over_budget(estimate, 1000)
+        assert not over_budget(estimate, 3700)
+
+        response = over_budget_response(estimate, 1000)
+        assert response['statusCode'] == 413
+        assert response['headers'] == {'X-Scan-Estimate-Bytes': '3700', 'X-Scan-Estimate-Partitions': '2'}
+        assert json.loads(response['body'])['scan_estimate'] == estimate
@@ -0,0 +1,131 @@
+import threading
+import time
+import pytest
+from athena_query import run_query, QueryTimeoutException
+from single_flight import SingleFlight, MemoryLeaseStore, normalize_sql, query_key
+
+
+class StubAthenaClient:
+    """counts executions started, each reporting the given state. Safe for use from multiple threads"""
+    def __init__(self, state='RUNNING', start_delay=0.0):
+        self.state = state
+        self.start_delay = start_delay
+        self.started = []
+        self.stopped = []
+        self.lock = threading.Lock()
+
+    def start_query_execution(self, QueryString, WorkGroup, ExecutionParameters=None):
+        time.sleep(self.start_delay)
+        with self.lock:
+            query_execution_id = f'query-{len(self.started)}'
+            self.started.append(query_execution_id)
+        return {'QueryExecutionId': query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': {'State': self.state},
+            'Statistics': {}
+        }}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+
+class TestSingleFlight:
+    def test_normalize_sql(self):
+        assert normalize_sql("select count(*)\n   from t where  name = 'a  b'") == "select count(*) from t where name = 'a  b'"
+        assert normalize_sql("where name in ('O''Brien',  'x')") == "where name in ('O''Brien', 'x')"
+        assert query_key('select 1  from t') == query_key('select 1 from t')
+        assert query_key("select 'a  b'") != query_key("select 'a b'")
+        assert query_key('select 1 from t where a = ?', ['x']) != query_key('select 1 from t where a = ?', ['y'])
+
+    def test_sequential_callers_share_query(self):
+        client = StubAthenaClient()
+        single_flight = SingleFlight(MemoryLeaseStore())
+
+        first = single_flight.start_query(client, 'select count(*) from t')
+        second = single_flight.start_query(client, 'select count(*)  from t')
+        other = single_flight.start_query(client, 'select count(*) from u')
+
+        assert first == second
+        assert other != first
+        assert len(client.started) == 2
+
+    def test_concurrent_callers_share_query(self):
+        # leader takes a while to start its query, followers wait for it
+        client = StubAthenaClient(start_delay=0.2)
+        single_flight = SingleFlight(MemoryLeaseStore())
+        results = []
+
+        def request():
+            results.append(single_flight.start_query(client, 'select count(*) from t'))
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(client.started) == 1
+        assert results == ['query-0'] * 20
+
+    def test_failed_query_is_not_shared(self):
+        client = StubAthenaClient(state='FAILED')
+        single_flight = SingleFlight(MemoryLeaseStore())
+
+        first = single_flight.start_query(client, 'select count(*) from t')
+        second = single_flight.start_query(client, 'select count(*) from t')
+
+        assert first != second
+        assert len(client.started) == 2
+
+    def test_expired_lease(self):
+        now = [1000.0]
+        client = StubAthenaClient()
+        single_flight = SingleFlight(MemoryLeaseStore(), lease_seconds=60, clock=lambda: now[0])
+
+        first = single_flight.start_query(client, 'select count(*) from t')
+        now[0] += 61
+        assert single_flight.start_query(client, 'select count(*) from t') != first
+
+    def test_unpublished_lease_is_replaced(self):
+        now = [1000.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        store = MemoryLeaseStore()
+        client = StubAthenaClient()
+        # e.g. the lease holder timed out before starting its query
+        store.claim(query_key('select 1'), 'abandoned', now[0] + 60, now[0])
+        single_flight = SingleFlight(store, sleep=sleep, clock=lambda: now[0])
+
+        assert single_flight.start_query(client, 'select 1') == 'query-0'
+        assert now[0] >= 1002, "should wait for the lease holder before replacing the lease"
+
+    def test_store_errors_fall_back_to_starting_query(self):
+        class BrokenStore:
+            def claim(self, key, token, expires, now, previous_token=None):
+                raise Exception('throttled')
+
+        client = StubAthenaClient()
+        single_flight = SingleFlight(BrokenStore())
+
+        assert single_flight.start_query(client, 'select 1') == 'query-0'
+        assert single_flight.start_query(client, 'select 1') == 'query-1'
+
+    def test_shared_query_left_running_on_timeout(self):
+        client = StubAthenaClient()
+        single_flight = SingleFlight(MemoryLeaseStore())
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        with pytest.raises(QueryTimeoutException):
+            run_query(client, 'select 1', 5, sleep=sleep, clock=lambda: now[0], single_flight=single_flight)
+
+        assert client.stopped == []
+        # a retry attaches to the running query
+        assert single_flight.start_query(client, 'select 1') == 'query-0'
@@ -0,0 +1,89 @@
+import random
+import sqlite3
+import pytest
+from tile_counts import decompose, tile_bounds, tile_clause, tile_level, tile_id, remainder_strips, MAX_TILE_LEVEL
+
+BBOXES = [
+    [-97, 27, -90, 30],
+    [-97.3, 27.1, -96.1, 28.05],
+    [-180, -90, 180, 90],
+    [0, 0, 45, 22.5],
+    [-60, -40, -20, 0],
+]
+
+
+@pytest.fixture()
+def points_table():
+    rng = random.Random(11)
+    rows = [(rng.uniform(-180, 180), rng.uniform(-90, 90)) for _ in range(20000)]
+    # points on the tile and bbox edges
+    for minx, miny, maxx, maxy in BBOXES:
+        rows += [(minx, miny), (maxx, maxy), (minx, (miny + maxy) / 2), ((minx + maxx) / 2, miny)]
+        interior, tiles = decompose([minx, miny, maxx, maxy])
+        for tile in tiles:
+            tminx, tminy, tmaxx, tmaxy = tile_bounds(tile)
+            rows += [(tminx, tminy), (tmaxx, tmaxy), (tminx, (tminy + tmaxy) / 2)]
+        for _ in range(2000):
+            rows.append((rng.uniform(minx, maxx), rng.uniform(miny, maxy)))
+
+    connection = sqlite3.connect(':memory:')
+    connection.execute('create table points (lon real, lat real)')
+    connection.executemany('insert into points values (?, ?)', rows)
+    yield connection
+    connection.close()
+
+
+def count(connection, clause, params):
+    return connection.execute(f'select count(*) from points where {clause}', params).fetchone()[0]
+
+
+class TestTileCounts:
+    def test_tile_bounds(self):
+        assert tile_bounds('0/0/0') == [-180, -90, 180, 90]
+        assert tile_bounds('1/1/0') == [0, -90, 180, 0]
+        assert tile_bounds(tile_id(3, 2, 5)) == [-90, 22.5, -45, 45]
+
+    def test_tile_level(self):
+        assert tile_level([-97, 27, -90, 30]) == 9
+        # too small to tile
+        assert tile_level([-97, 27, -96.9, 27.1]) is None
+        assert decompose([-97, 27, -96.9, 27.1]) is None
+
+    def test_tiles_are_largest_aligned(self):
+        interior, tiles = decompose([0, 0, 45, 22.5])
+        # west and south edges aligned with the bbox are moved inside it
+        assert interior[0] > 0 and interior[1] > 0
+        assert interior[2] == 45 and interior[3] == 22.5
+        assert len(tiles) < 64
+        assert min([int(i.split('/')[0]) for i in tiles]) < MAX_TILE_LEVEL
+
+    @pytest.mark.parametrize('bbox', BBOXES)
+    def test_tiles_and_remainder_count_each_point_once(self, points_table, bbox):
+        minx, miny, maxx, maxy = bbox
+        bbox_clause = '(lon > ? and lon < ?) and (lat > ? and lat < ?)'
+        bbox_params = [minx, maxx, miny, maxy]
+        interior, tiles = decompose(bbox)
+
+        interior_clause, interior_params = tile_clause(interior)
+        total = count(points_table, f'{bbox_clause} and not {interior_clause}', bbox_params + interior_params)
+        for tile in tiles:
+            clause, params = tile_clause(tile_bounds(tile))
+            total += count(points_table, f'{bbox_clause} and {clause}', bbox_params + params)
+
+        assert total == count(points_table, bbox_clause, bbox_params)
+        # tiles lie within the bbox
+        assert count(points_table, f'{interior_clause} and not ({bbox_clause})', interior_params + bbox_params) == 0
+
+    @pytest.mark.parametrize('bbox', BBOXES)
+    def test_remainder_strips_cover_remainder(self, points_table, bbox):
+        minx, miny, maxx, maxy = bbox
+        bbox_clause = '(lon > ? and lon < ?) and (lat > ? and lat < ?)'
+        bbox_params = [minx, maxx, miny, maxy]
+        interior, _ = decompose(bbox)
+        interior_clause, interior_params = tile_clause(interior)
+
+        strips = remainder_strips(bbox, interior)
+        strip_clause = ' or '.join(['(lon >= ? and lon <= ? and lat >= ? and lat <= ?)'] * len(strips))
+        strip_params = [i for x0, y0, x1, y1 in strips for i in [x0, x1, y0, y1]]
+        assert count(points_table, f'{bbox_clause} and not {interior_clause} and not ({strip_clause})',
+                     bbox_params + interior_params + strip_params) == 0
@@ -0,0 +1,44 @@
+import pytest
+from size_order import app
+
+
+class StubTable:
+    def __init__(self):
+        self.updates = []
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues):
+        self.updates.append((Key, UpdateExpression, ExpressionAttributeValues))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+@pytest.fixture()
+def table(monkeypatch):
+    table = StubTable()
+    monkeypatch.setattr(app, 'table', table)
+    monkeypatch.setattr(app, 'count_cube', None)
+    return table
+
+
+class TestApp:
+    def test_order_size_stored(self, table):
+        event = {
+            'order_id': 'abc-123',
+            'label': 'csb',
+            'bbox': [5, 60, 6, 61],
+            'filters': {'providers': ['PGS']},
+            'scan_estimate': {'bytes': 12 * 1000, 'partitions': 1}
+        }
+        result = app.lambda_handler(event, None)
+
+        assert result['size_class'] == 'small'
+        assert result['estimated_points'] == 1000
+        key, expression, values = table.updates[0]
+        assert key == {'PK': 'ORDER#abc-123', 'SK': 'DATASET#csb'}
+        assert values[':size_class'] == 'small'
+        assert values[':estimated_points'] == 1000
+
+    def test_unknown_size(self, table):
+        event = {'order_id': 'abc-123', 'label': 'csb', 'bbox': [5, 60, 6, 61], 'filters': {}, 'scan_estimate': None}
+        assert app.lambda_handler(event, None)['size_class'] == 'standard'
+        _, expression, values = table.updates[0]
+        assert ':estimated_points' not in values
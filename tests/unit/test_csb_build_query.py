@@ -1,21 +1,34 @@
+import math
+import h3
 import pytest
-from format_point_query.utils import sql_quote_and_escape
-from format_point_query.utils import filters_to_where_clause
+from format_point_query import app
+from format_point_query.app import lambda_handler, dataset_to_filters
+from extract_reuse import ExtractIndex, MemoryExtractStore
+from h3_cells import covering_cells
+from scan_estimate import ScanBudgetExceededException
 import logging
 import os
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "INFO"))
 
 
+@pytest.fixture(autouse=True)
+def no_scan_manifest(monkeypatch, stub_snapshot):
+    monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+    monkeypatch.setattr(app, 'extract_index', ExtractIndex(MemoryExtractStore()))
+
+
 class TestCsbBuildQuery:
     @pytest.fixture()
     def test_data(self):
         return [
             {
                 "name": "test case 0",
-                "expected": "platform_name in ('Ramform Vanguard','Anonymous') "
-                            "and provider in ('PGS','MacGregor') "
-                            "and time >= date('2023-01-01') and entry_date >= date('2023-01-01')",
+                "expected": "platform_name in (?, ?) "
+                            "and provider in (?, ?) "
+                            "and time >= date(?) and entry_date >= date(?)",
+                "expected_parameters": ["'Ramform Vanguard'", "'Anonymous'", "'PGS'", "'MacGregor'",
+                                        "'2023-01-01'", "'2023-01-01'"],
                 "payload": {
                     'bbox': [5, 60, 6, 61],
                     'order_id': 'bc22b3a3-0ce7-4169-8754-a7cd68375985',
@@ -30,18 +43,146 @@ class TestCsbBuildQuery:
             }
         ]
 
-    def test_sql_quote_and_escape(self):
-        platforms = ["Hi'ialakai", "Surveyor"]
-        expected = ["'Hi''ialakai'", "'Surveyor'"]
+    def test_dataset_to_filters(self, test_data):
+        assert dataset_to_filters(test_data[0]['payload']['dataset']) == {
+            'providers': ['PGS', 'MacGregor'],
+            'platforms': ['Ramform Vanguard', 'Anonymous'],
+            'collection_date_start': '2023-01-01',
+            'archive_date_start': '2023-01-01'
+        }
 
-        assert sql_quote_and_escape(platforms[0]) == expected[0]
-        assert sql_quote_and_escape(platforms[1]) == expected[1]
+    def test_quoted_parameters(self):
+        payload = {
+            'bbox': [5, 60, 6, 61],
+            'order_id': 'bc22b3a3-0ce7-4169-8754-a7cd68375985',
+            'dataset': {'label': 'csb', 'platforms': ["Hi'ialakai", "Surveyor"]}
+        }
+        assert lambda_handler(payload, None)['execution_parameters'][-2:] == ["'Hi''ialakai'", "'Surveyor'"]
 
     def test_filters_to_where_clause(self, test_data):
         for case in test_data:
             payload = case['payload']
-            expected = case['expected']
             name = case['name']
             logger.info(f'running test case {name}')
-            where_clauses = filters_to_where_clause(payload['dataset'])
-            assert ' and '.join(where_clauses) == expected
+            result = lambda_handler(payload, None)
+
+            cells = covering_cells(payload['bbox'])
+            bbox_clause = f"(lon > ? and lon < ?) and (lat > ? and lat < ?) and h3 in ({', '.join(['?'] * len(cells))})"
+            assert result['query_string'].endswith(f"where {bbox_clause} and {case['expected']}")
+            assert result['execution_parameters'] == \
+                ['5', '6', '60', '61'] + [f"'{i}'" for i in cells] + case['expected_parameters']
+            assert result['order_id'] == payload['order_id']
+
+    def test_output_format(self, test_data):
+        payload = test_data[0]['payload']
+        result = lambda_handler(payload, None)
+
+        assert result['output_format'] == 'parquet'
+        location = result['unload_location']
+        assert location.startswith(f"s3://order-pickup/extracts/{payload['order_id']}/csb/") and location.endswith('/')
+        part = result['parts'][0]
+        assert part['part_prefix'] == f'{location}part-000/'
+        assert part['query_template'] == \
+            f"UNLOAD ({result['query_string']} and h3 in ({', '.join(['?'] * len(part['cells']))})) " \
+            f"TO '{{}}' WITH (format = 'PARQUET', compression = 'ZSTD')"
+        assert part['execution_parameters'] == result['execution_parameters'] + [f"'{i}'" for i in part['cells']]
+        # each order writes to an empty prefix
+        assert lambda_handler(payload, None)['unload_location'] != location
+
+        payload = dict(payload, dataset=dict(payload['dataset'], output_format='csv'))
+        result = lambda_handler(payload, None)
+        assert result['output_format'] == 'csv'
+        assert result['unload_location'] is None
+        assert result['parts'] is None
+
+        payload['dataset']['output_format'] = 'xlsx'
+        with pytest.raises(app.IllegalArgumentException):
+            lambda_handler(payload, None)
+
+    def test_response_format(self, test_data):
+        payload = test_data[0]['payload']
+        assert lambda_handler(payload, None)['query_string'].startswith(f"SELECT {','.join(app.POINT_COLUMNS)} FROM")
+
+        payload = dict(payload, dataset=dict(payload['dataset'], response_format='compact'))
+        assert lambda_handler(payload, None)['query_string'].startswith(f"SELECT {','.join(app.COMPACT_COLUMNS)} FROM")
+
+    def test_invalid_date(self, test_data):
+        payload = test_data[0]['payload']
+        payload = dict(payload, dataset=dict(payload['dataset'], collection_date={'start': '2023-02-30'}))
+        with pytest.raises(app.IllegalArgumentException):
+            lambda_handler(payload, None)
+
+    def test_extract_parts(self, test_data, monkeypatch, stub_snapshot):
+        payload = dict(test_data[0]['payload'], bbox=[-100, 20, -90, 30])
+        cells = covering_cells(payload['bbox'])
+        # all of the data in two of the cells
+        manifest = {'partitions': {cells[0]: {'2023-01': 30}, cells[1]: {'2023-01': 15, '2022-12': 1000}}}
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(manifest))
+        monkeypatch.setattr(app, 'PART_SCAN_BYTES', 10)
+
+        parts = lambda_handler(payload, None)['parts']
+        # 45 bytes within the archive date range
+        assert len(parts) == 5
+        assert sorted([i for part in parts for i in part['cells']]) == cells
+        assert [len(i['cells']) for i in parts if cells[0] in i['cells']] == [1]
+        assert [i['part_prefix'][-9:] for i in parts] == [f'part-{n:03d}/' for n in range(5)]
+
+        # without sizes, split by the number of cells
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot())
+        parts = lambda_handler(payload, None)['parts']
+        assert len(parts) == math.ceil(len(cells) / app.CELLS_PER_PART)
+        assert max([len(i['cells']) for i in parts]) - min([len(i['cells']) for i in parts]) <= 1
+
+    def test_reuse(self, test_data, monkeypatch, stub_snapshot, s3_client):
+        payload = test_data[0]['payload']
+        manifest = {'latest_entry_date': '2024-01-31', 'partitions': {}}
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(manifest))
+        earlier = 's3://order-pickup/extracts/abc-123/csb/6f1c/manifest.json'
+        s3_client.objects = {earlier}
+        monkeypatch.setattr(app, 's3', s3_client)
+
+        result = lambda_handler(payload, None)
+        assert result['extract_key']
+        assert result['reuse_location'] is None
+
+        app.extract_index.put(result['extract_key'], earlier)
+        assert lambda_handler(payload, None)['reuse_location'] == earlier
+        # not once more data is ingested
+        manifest['latest_entry_date'] = '2024-02-01'
+        assert lambda_handler(payload, None)['reuse_location'] is None
+        # nor after the output has been removed
+        manifest['latest_entry_date'] = '2024-01-31'
+        s3_client.objects.clear()
+        assert lambda_handler(payload, None)['reuse_location'] is None
+
+    def test_split_cells(self):
+        sizes = {'a': 50, 'b': 40, 'c': 30, 'd': 20, 'e': 10, 'f': 0}
+        assert app.split_cells(sizes, part_bytes=60) == [['a', 'f'], ['b', 'e'], ['c', 'd']]
+        assert app.split_cells(sizes, part_bytes=1, max_parts=2) == [['a', 'd', 'e'], ['b', 'c', 'f']]
+        assert app.split_cells({'a': 0}, part_bytes=1) == [['a']]
+
+    def test_format_template(self):
+        assert app.format_template("ST_GeometryFromText('{x}') \\") == "ST_GeometryFromText('\\{x\\}') \\\\"
+
+    def test_polygon(self, test_data):
+        payload = dict(test_data[0]['payload'])
+        payload['polygon'] = {'type': 'Polygon', 'coordinates': [[[5, 60], [6, 60], [5.5, 61], [5, 60]]]}
+
+        result = lambda_handler(payload, None)
+
+        assert "ST_Contains(ST_GeometryFromText('POLYGON ((5.0 60.0, 6.0 60.0, 5.5 61.0, 5.0 60.0))'), " \
+               "ST_Point(lon, lat))" in result['query_string']
+        # null for orders without a polygon
+        payload['polygon'] = None
+        assert 'ST_Contains' not in lambda_handler(payload, None)['query_string']
+
+    def test_scan_budget(self, test_data, monkeypatch, stub_snapshot):
+        payload = test_data[0]['payload']
+        manifest = {'partitions': {h3.geo_to_h3(60.5, 5.5, 1): {'2023-01': 1024}}}
+        monkeypatch.setattr(app, 'scan_manifest', stub_snapshot(manifest))
+
+        assert lambda_handler(payload, None)['scan_estimate'] == {'bytes': 1024, 'partitions': 1}
+
+        manifest['partitions'][h3.geo_to_h3(60.5, 5.5, 1)]['2023-01'] = app.MAX_SCAN_BYTES + 1
+        with pytest.raises(ScanBudgetExceededException):
+            lambda_handler(payload, None)
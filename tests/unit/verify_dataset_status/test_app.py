@@ -0,0 +1,46 @@
+import pytest
+from verify_dataset_status import app
+
+
+class StubTable:
+    def __init__(self, items):
+        self.items = items
+        self.updates = []
+
+    def query(self, KeyConditionExpression):
+        return {'Items': self.items}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ExpressionAttributeNames):
+        self.updates.append((Key, ExpressionAttributeValues))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+
+@pytest.fixture()
+def table(monkeypatch):
+    table = StubTable([])
+    monkeypatch.setattr(app, 'table', table)
+    return table
+
+
+class TestApp:
+    def test_order_size_class(self):
+        small = {'status': 'complete', 'size_class': 'small', 'estimated_points': 600_000}
+        assert app.order_size_class([small]) == 'small'
+        # small datasets adding up to a standard order
+        assert app.order_size_class([small, small | {'SK': 'DATASET#other'}]) == 'standard'
+        # multibeam datasets are not sized, nor are datasets whose size_order failed
+        assert app.order_size_class([small, {'status': 'complete'}]) == 'standard'
+        assert app.order_size_class([{'status': 'complete', 'size_class': 'standard'}]) == 'standard'
+
+    def test_lambda_handler(self, table):
+        table.items = [{'status': 'complete', 'size_class': 'small', 'estimated_points': 1000}]
+        result = app.lambda_handler({'order_id': 'abc-123'}, None)
+
+        assert result == {'order_id': 'abc-123', 'size_class': 'small'}
+        key, values = table.updates[0]
+        assert key == {'PK': 'ORDER#abc-123', 'SK': 'ORDER'}
+        assert values[':size_class'] == 'small'
+
+        table.items.append({'status': 'running'})
+        with pytest.raises(Exception):
+            app.lambda_handler({'order_id': 'abc-123'}, None)
@@ -0,0 +1,83 @@
+import json
+import pytest
+from write_extract_manifest import app
+
+LOCATION = 's3://order-pickup/extracts/abc-123/csb/6f1c/'
+
+
+class StubPaginator:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def paginate(self, Bucket, Prefix):
+        yield {'Contents': [{'Key': i} for i in self.objects if i.startswith(Prefix)]}
+
+
+class StubS3Client:
+    def __init__(self, objects):
+        self.objects = objects
+        self.puts = {}
+
+    def get_paginator(self, name):
+        return StubPaginator(self.objects)
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self.puts[f's3://{Bucket}/{Key}'] = json.loads(Body)
+
+
+def succeeded(part, attempt):
+    return {
+        'part': part,
+        'cells': [f'cell{part}'],
+        'state': 'SUCCEEDED',
+        'location': f'{LOCATION}part-{part:03d}/{attempt}/',
+        'query_execution': {'QueryExecutionId': f'q{part}', 'Status': {'State': 'SUCCEEDED'},
+                            'Statistics': {'DataScannedInBytes': 1024}}
+    }
+
+
+@pytest.fixture()
+def s3(monkeypatch):
+    s3 = StubS3Client([
+        'extracts/abc-123/csb/6f1c/part-000/a1/20240101_00001',
+        # left by a failed attempt which was retried
+        'extracts/abc-123/csb/6f1c/part-001/b1/20240101_00002',
+        'extracts/abc-123/csb/6f1c/part-001/b2/20240101_00003',
+        'extracts/abc-123/csb/6f1c/part-001/b2/20240101_00004'
+    ])
+    monkeypatch.setattr(app, 's3', s3)
+    return s3
+
+
+def event(parts):
+    return {'order_id': 'abc-123', 'label': 'csb', 'unload_location': LOCATION, 'filter_shape': 'bbox',
+            'extract_key': 'f00d', 'parts': parts}
+
+
+class TestApp:
+    def test_manifest(self, s3, capsys):
+        failed = {'part': 2, 'cells': ['cell2'], 'state': 'FAILED',
+                  'error': {'Error': 'States.TaskFailed', 'Cause': 'HIVE_CURSOR_ERROR'}}
+        result = app.lambda_handler(event([failed, succeeded(1, 'b2'), succeeded(0, 'a1')]), None)
+
+        # incomplete, not reused
+        assert result == {'label': 'csb', 'manifest_location': f'{LOCATION}manifest.json', 'extract_key': None,
+                          'parts': 2, 'failed_parts': 1}
+        manifest = s3.puts[result['manifest_location']]
+        assert manifest['parts'] == [
+            {'part': 0, 'cells': ['cell0'], 'files': [f'{LOCATION}part-000/a1/20240101_00001']},
+            {'part': 1, 'cells': ['cell1'], 'files': [f'{LOCATION}part-001/b2/20240101_00003',
+                                                      f'{LOCATION}part-001/b2/20240101_00004']}
+        ]
+        assert manifest['failed_parts'] == [{'part': 2, 'cells': ['cell2'], 'error': 'States.TaskFailed'}]
+        # statistics recorded for each part
+        assert capsys.readouterr().out.count('"query_execution_id"') == 2
+
+        result = app.lambda_handler(event([succeeded(0, 'a1')]), None)
+        assert result['extract_key'] == 'f00d'
+
+    def test_all_parts_failed(self, s3):
+        failed = {'part': 0, 'cells': None, 'state': 'FAILED', 'error': {'Error': 'States.TaskFailed'}}
+        with pytest.raises(app.ExtractFailedException):
+            app.lambda_handler(event([failed]), None)
+        assert s3.puts == {}
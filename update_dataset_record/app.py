@@ -5,6 +5,8 @@ import time
 import boto3
 from datetime import datetime
 from datetime import timezone
+from extract_reuse import ExtractIndex, DynamoDBExtractStore
+from query_stats import record_execution
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
@@ -13,6 +15,7 @@ TABLE = os.getenv('ORDERS_TABLE', default='bathy-orders')
 
 dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(TABLE)
+extract_index = ExtractIndex(DynamoDBExtractStore(TABLE))
 
 
 def update_dataset(order_id, dataset, output_location, status, ttl, now):
@@ -76,6 +79,13 @@ def lambda_handler(event, context):
         ttl = int(time.time()) + (60 * 24 * 60 * 60)
 
         update_dataset(order_id=order_id, dataset=dataset, output_location=output_location, status=status, ttl=ttl, now=now)
+        # passed by the state machine for point extracts
+        if 'query_execution' in event:
+            record_execution(event['query_execution'], endpoint='order', shape=event.get('filter_shape'),
+                             order_id=order_id, dataset=dataset)
+        # passed by the state machine for complete point extracts, reused by later identical orders
+        if event.get('extract_key') and status == 'complete':
+            extract_index.put(event['extract_key'], output_location)
         #update_order(order_id=order_id, output_location=output_location, status=f'{dataset} complete', ttl=ttl, now=now)
 
         return {
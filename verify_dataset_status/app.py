@@ -6,6 +6,7 @@ import boto3
 from datetime import datetime
 from datetime import timezone
 from boto3.dynamodb.conditions import Key
+from order_size import size_class, STANDARD
 
 logger = logging.getLogger()
 logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
@@ -15,7 +16,7 @@ dynamodb = boto3.resource('dynamodb')
 table = dynamodb.Table(TABLE)
 
 
-def all_datasets_complete(order_id):
+def dataset_items(order_id):
     response = table.query(
         KeyConditionExpression=
         Key('PK').eq('ORDER#' + order_id) &
@@ -24,13 +25,16 @@ def all_datasets_complete(order_id):
     items = response['Items']
     if len(items) < 1:
         raise Exception(f'no datasets items found for order ${order_id}')
+    return items
 
+
+def all_datasets_complete(items):
     # depends on string defined in step function definition
-    completed = [i['status'] == 'complete' for i in response['Items']]
+    completed = [i['status'] == 'complete' for i in items]
     return all(completed)
 
 
-def update_order(order_id, status):
+def update_order(order_id, status, order_size_class):
     now = datetime.now(timezone.utc).isoformat(timespec='seconds')
     # expire records 60 days after last update
     ttl = int(time.time()) + (60 * 24 * 60 * 60)
@@ -42,11 +46,12 @@ def update_order(order_id, status):
             'PK': 'ORDER#' + order_id,
             'SK': 'ORDER'
         },
-        UpdateExpression='SET #status = :status, last_update = :now, #ttl = :ttl',
+        UpdateExpression='SET #status = :status, last_update = :now, #ttl = :ttl, size_class = :size_class',
         ExpressionAttributeValues={
             ':status': status,
             ':now': now,
-            ':ttl': ttl
+            ':ttl': ttl,
+            ':size_class': order_size_class
         },
         ExpressionAttributeNames={
             "#status": "status",
@@ -57,6 +62,18 @@ def update_order(order_id, status):
         raise Exception("failed to update item")
 
 
+def order_size_class(items):
+    """
+    size class of the whole order from the estimates size_order stored on its
+    datasets. Orders with a multibeam or unsized dataset are standard
+
+    :param items: the order's dataset items
+    """
+    if any(i.get('estimated_points') is None for i in items):
+        return STANDARD
+    return size_class(sum([int(i['estimated_points']) for i in items]))
+
+
 def lambda_handler(event, context):
     """
     verify that each dataset in the specified order is staged for further
@@ -64,10 +81,12 @@ def lambda_handler(event, context):
     """
     order_id = event['order_id']
 
-    if not all_datasets_complete(order_id):
+    items = dataset_items(order_id)
+    if not all_datasets_complete(items):
         raise Exception("datasets are not staged correctly")
 
-    update_order(order_id, status="data staged")
+    order_size = order_size_class(items)
+    update_order(order_id, status="data staged", order_size_class=order_size)
 
-    # return original payload
-    return event
+    # return original payload, with the size class choosing the grid queue
+    return event | {'size_class': order_size}
@@ -0,0 +1,89 @@
+"""
+merge the parts of a Parquet extract, each UNLOADed separately by the state
+machine, into one deliverable. The manifest lists the files written by each
+part which succeeded and the H3 cells of any part which failed after its
+retries, e.g.
+    {'order_id': '...', 'label': 'csb', 'format': 'parquet', 'created': '2024-01-01T00:00:00+00:00',
+     'parts': [{'part': 0, 'cells': ['8126fffffffffff'], 'files': ['s3://order-pickup/extracts/...']}],
+     'failed_parts': [{'part': 1, 'cells': ['812a3ffffffffff'], 'error': 'States.TaskFailed'}]}
+
+Files of abandoned attempts are left under the extract's prefix, so consumers
+read the manifest rather than listing the prefix.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from datetime import timezone
+import boto3
+from athena_results import split_s3_uri
+from query_stats import record_execution
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get("LOGLEVEL", "WARNING"))
+
+MANIFEST_NAME = 'manifest.json'
+
+s3 = boto3.client('s3')
+
+
+def part_files(location):
+    """:return: S3 URIs of the files under the part's prefix"""
+    bucket, prefix = split_s3_uri(location)
+    files = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        files += [f"s3://{bucket}/{i['Key']}" for i in page.get('Contents', []) if not i['Key'].endswith('/')]
+    return sorted(files)
+
+
+def lambda_handler(event, context):
+    """
+    expects the order_id, label, unload_location, extract_key and filter_shape from format_point_query
+    and the results of the state machine's parts
+
+    :return: dict with the S3 location of the manifest
+    """
+    order_id = event['order_id']
+    label = event['label']
+    results = sorted(event['parts'], key=lambda i: i['part'])
+
+    parts = []
+    failed_parts = []
+    for result in results:
+        if result['state'] != 'SUCCEEDED':
+            error = result.get('error') or {}
+            logger.warning(f"part {result['part']} of order {order_id} failed: {error.get('Cause')}")
+            failed_parts.append({'part': result['part'], 'cells': result['cells'], 'error': error.get('Error')})
+            continue
+        record_execution(result['query_execution'], endpoint='order', shape=event.get('filter_shape'),
+                         order_id=order_id, dataset=label, part=result['part'])
+        parts.append({'part': result['part'], 'cells': result['cells'], 'files': part_files(result['location'])})
+
+    if not parts:
+        raise ExtractFailedException(f'all {len(failed_parts)} parts of the extract failed')
+
+    manifest = {
+        'order_id': order_id,
+        'label': label,
+        'format': 'parquet',
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'parts': parts,
+        'failed_parts': failed_parts
+    }
+    manifest_location = event['unload_location'] + MANIFEST_NAME
+    bucket, key = split_s3_uri(manifest_location)
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(manifest).encode('utf-8'), ContentType='application/json')
+    logger.info(f'wrote manifest of {len(parts)} parts to {manifest_location}, {len(failed_parts)} failed')
+
+    return {
+        'label': label,
+        'manifest_location': manifest_location,
+        # only a complete extract is reused by later orders
+        'extract_key': None if failed_parts else event.get('extract_key'),
+        'parts': len(parts),
+        'failed_parts': len(failed_parts)
+    }
+
+
+class ExtractFailedException(Exception):
+    pass